@@ -0,0 +1,219 @@
+"""
+Benchmarks for the inventory, on made-up inventories of different sizes.
+
+    python benchmark.py                      # 10k, 100k and 1M devices
+    python benchmark.py --sizes 10000 50000  # just these sizes
+    python benchmark.py --compare benchmark-OLD.json
+
+Each size runs in its own process (in a temporary folder, so the real
+inventory is never touched) and gets timed for: load, save, lookup by
+hostname, lookup by IP, the duplicate check new devices go through, reports
+and a full listing. The results, with throughput and peak memory, are written
+to a JSON file named after the date and git commit, so two versions can be
+compared with --compare.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import network_inventory as inventory
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+LOOKUPS = 100_000 # lookups timed per lookup benchmark
+DUPLICATE_CHECKS = 20_000 # new-device checks timed
+
+# Real networks are lopsided: a couple of vendors own most of the gear, and
+# most devices run one of a few OS versions. (weight, vendor, OS versions most common first)
+VENDORS = [
+    (45, "Cisco", ["17.9.4", "17.6.5", "16.12.10", "15.2(7)E8", "17.3.8", "16.9.8", "15.9(3)M7"]),
+    (20, "Juniper", ["21.4R3", "22.2R3", "20.4R3", "23.2R1", "19.4R3"]),
+    (12, "Arista", ["4.30.2F", "4.28.9M", "4.31.1F", "4.26.10M"]),
+    (8, "Fortinet", ["7.2.7", "7.4.2", "7.0.13"]),
+    (6, "Palo Alto Networks", ["11.0.3", "10.2.8", "11.1.1"]),
+    (4, "HPE Aruba", ["10.13.1000", "10.10.1100", "8.11.2.1"]),
+    (3, "MikroTik", ["7.13.2", "6.49.10"]),
+    (2, "Ubiquiti", ["6.5.59", "7.0.66"]),
+]
+SITES = ["ams", "fra", "lon", "nyc", "sfo", "sin", "syd", "tok", "gru", "jnb", "dub", "chi", "sea", "par", "mad", "waw"]
+ROLES = ["core", "dist", "acc", "fw", "edge", "wlc", "lb", "oob"]
+
+
+def generate_inventory(device_count, seed=42):
+    """Makes a list of device dicts with unique hostnames and IPs and skewed vendors / OS versions."""
+    rng = random.Random(seed)
+    vendor_weights = [weight for weight, _, _ in VENDORS]
+    # each vendor's OS versions get Zipf-like weights: the first is twice as common as the second, and so on
+    os_weights = {vendor: [1 / (rank + 1) for rank in range(len(versions))] for _, vendor, versions in VENDORS}
+    # devices sit in /24s that are mostly full, like a real address plan
+    subnet_count = device_count // 200 + 1
+    subnets = rng.sample(range(10 << 16, 11 << 16), subnet_count) # /24s inside 10.0.0.0/8
+    devices = []
+    picked_vendors = rng.choices(VENDORS, weights=vendor_weights, k=device_count)
+    for number, (_, vendor, versions) in enumerate(picked_vendors):
+        subnet, host = divmod(number, 200)
+        ip_number = (subnets[subnet] << 8) | (host + 1)
+        devices.append({
+            "hostname": f"{SITES[number % len(SITES)]}-{ROLES[(number // len(SITES)) % len(ROLES)]}-{number:07d}",
+            "vendor": vendor,
+            "os_version": rng.choices(versions, weights=os_weights[vendor])[0],
+            "ip_address": inventory.int_to_ip(ip_number),
+        })
+    return devices
+
+
+def timed(function, *args):
+    """Runs function(*args) once. Returns (seconds, whatever it returned)."""
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process so far, or None where we can't tell."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1) # bytes on macOS, KB elsewhere
+
+
+def run_one_size(device_count):
+    """Times every operation on one inventory size. Returns the results dict."""
+    seconds = {}
+    throughput = {}
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, 'w') as devnull:
+        inventory.use_data_file(os.path.join(work_dir, "inventory.json"))
+        seconds["generate"], devices = timed(generate_inventory, device_count)
+        with open(inventory.DATA_FILE, 'w') as f:
+            json.dump(devices, f, separators=(',', ':'))
+        rng = random.Random(7)
+        sample = [rng.choice(devices) for _ in range(LOOKUPS)]
+        del devices # let the store be the only copy, so the memory numbers mean something
+
+        with contextlib.redirect_stdout(devnull): # the program is chatty about loading and saving
+            seconds["load_json"], _ = timed(inventory.load_devices)
+            store = inventory.network_devices
+
+            # save: one journal record, then a full snapshot (JSON + binary)
+            store.update(store.find_by_hostname(sample[0]["hostname"]), {"os_version": "benchmark"})
+            seconds["save_journal"], _ = timed(inventory.save_devices)
+            seconds["save_snapshot"], _ = timed(inventory.compact_journal, True)
+            seconds["load_binary"], _ = timed(inventory.load_devices)
+            store = inventory.network_devices
+
+            host_names = [device["hostname"].upper() for device in sample] # upper case, so the lookups have to fold
+            ip_addresses = [device["ip_address"] for device in sample]
+            seconds["lookup_hostname"], _ = timed(lambda: [store.find_by_hostname(name) for name in host_names])
+            seconds["lookup_ip"], _ = timed(lambda: [store.find_by_ip(address) for address in ip_addresses])
+
+            # the check every new device goes through: half clash with an existing hostname or IP
+            new_devices = []
+            for number in range(DUPLICATE_CHECKS):
+                existing = sample[number]
+                new_devices.append({
+                    "hostname": existing["hostname"] if number % 4 == 0 else f"bench-new-{number}",
+                    "vendor": "Cisco", "os_version": "17.9.4",
+                    "ip_address": existing["ip_address"] if number % 4 == 1 else inventory.int_to_ip((172 << 24) + number),
+                })
+
+            def check_all():
+                for device_details in new_devices:
+                    try:
+                        inventory.check_device_details(dict(device_details))
+                    except inventory.CommandError:
+                        pass
+            seconds["duplicate_check"], _ = timed(check_all)
+
+            store.counts_stale = True # first report counts from scratch...
+            seconds["report_cold"], _ = timed(inventory.generate_reports)
+            seconds["report"], _ = timed(inventory.generate_reports) # ...later ones use the kept-up-to-date counts
+
+            every_row = inventory.select_devices()
+            seconds["list_block"], _ = timed(inventory.write_device_list, every_row, 'block', devnull)
+            seconds["list_table"], _ = timed(inventory.write_device_list, every_row, 'table', devnull)
+
+    for name, operation_count in (("lookup_hostname", LOOKUPS), ("lookup_ip", LOOKUPS),
+                                  ("duplicate_check", DUPLICATE_CHECKS)):
+        throughput[name + "_per_second"] = round(operation_count / seconds[name])
+    for name in ("load_json", "load_binary", "save_snapshot", "list_block", "list_table"):
+        throughput[name + "_devices_per_second"] = round(device_count / seconds[name])
+    return {
+        "devices": device_count,
+        "seconds": {name: round(value, 4) for name, value in seconds.items()},
+        "throughput": throughput,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old_results, new_results):
+    """Prints how much each timing changed between two result files."""
+    old_by_size = {result["devices"]: result for result in old_results["results"]}
+    print(f"\nCompared with {old_results.get('commit')} ({old_results.get('date')}):")
+    for result in new_results["results"]:
+        old_result = old_by_size.get(result["devices"])
+        if old_result is None:
+            continue
+        print(f"  {result['devices']} devices:")
+        for name, new_seconds in result["seconds"].items():
+            old_seconds = old_result["seconds"].get(name)
+            if old_seconds:
+                change = (new_seconds - old_seconds) / old_seconds * 100
+                flag = "  <-- slower" if change > 10 else ""
+                print(f"    {name:<16} {old_seconds:>9.4f}s -> {new_seconds:>9.4f}s ({change:+.0f}%){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the inventory on synthetic inventories.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="inventory sizes (default: 10k 100k 1M)")
+    parser.add_argument('--output', help="results file (default: benchmark-COMMIT-DATE.json)")
+    parser.add_argument('--compare', help="an earlier results file to compare against")
+    parser.add_argument('--one-size', type=int, help=argparse.SUPPRESS) # used by the per-size child processes
+    args = parser.parse_args()
+
+    if args.one_size:
+        print(json.dumps(run_one_size(args.one_size)))
+        return
+
+    all_results = []
+    for device_count in args.sizes:
+        print(f"Benchmarking {device_count} devices...", file=sys.stderr)
+        # a fresh process per size, so each one's peak memory is its own
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--one-size', str(device_count)],
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            sys.exit(f"Benchmark for {device_count} devices failed:\n{child.stderr}")
+        result = json.loads(child.stdout)
+        all_results.append(result)
+        print(json.dumps(result, indent=2), file=sys.stderr)
+
+    commit = git_commit()
+    date = time.strftime("%Y-%m-%dT%H:%M:%S")
+    results = {"commit": commit, "date": date, "python": platform.python_version(),
+               "machine": platform.machine(), "results": all_results}
+    output_path = args.output or f"benchmark-{commit or 'unknown'}-{date.replace(':', '')}.json"
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_path}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
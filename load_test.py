@@ -0,0 +1,98 @@
+"""
+Load test for the inventory HTTP service.
+
+Start the service first (python network_inventory.py serve), then run:
+
+    python load_test.py --clients 8 --seconds 10
+
+Each client keeps one connection open and sends lookups by hostname and by IP
+(plus the odd list and report) as fast as it can. At the end it prints the
+requests per second and the latency percentiles as JSON.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import quote
+
+
+def fetch_sample_devices(host, port, sample_size):
+    """Gets some real hostnames and IPs to look up."""
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    connection.request('GET', f'/devices?limit={sample_size}')
+    response = connection.getresponse()
+    devices = json.loads(response.read())["devices"]
+    connection.close()
+    if not devices:
+        raise SystemExit("The inventory is empty, add some devices before load testing.")
+    return devices
+
+
+def run_client(host, port, paths, stop_at, latencies, errors):
+    """Sends requests down one keep-alive connection until stop_at."""
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    pick = random.Random().choice
+    while time.perf_counter() < stop_at:
+        path = pick(paths)
+        started = time.perf_counter()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer the inventory HTTP service with lookups.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=8, help="connections sending requests at once (default: 8)")
+    parser.add_argument('--seconds', type=float, default=10, help="how long to run (default: 10)")
+    parser.add_argument('--sample', type=int, default=1000, help="how many different devices to look up (default: 1000)")
+    args = parser.parse_args()
+
+    devices = fetch_sample_devices(args.host, args.port, args.sample)
+    paths = [f"/devices/{quote(device['hostname'], safe='')}" for device in devices]
+    paths += [f"/ips/{device['ip_address']}" for device in devices]
+    paths += ['/report', '/devices?limit=20'] # a few heavier ones in the mix
+
+    latencies, errors = [], [] # list.append is thread-safe, no lock needed
+    stop_at = time.perf_counter() + args.seconds
+    clients = [threading.Thread(target=run_client, args=(args.host, args.port, paths, stop_at, latencies, errors))
+               for _ in range(args.clients)]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 2) if latencies else None
+                       for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,2063 @@
+import csv # reading and writing CSV files for bulk import
+import heapq # picking the best few search results without sorting them all
 import json # helps us save and load data
-from collections import Counter # good for counting things easily
+import mmap # lets us read the binary snapshot without copying it into memory first
+import os # for atomic file replacing and fsync
+import re # pattern search, used to find a hostname in the binary snapshot without decoding it
+import signal # so 'kill -USR1' can ask for the metrics
+import struct # packs numbers into bytes for the binary snapshot
+import sys # command line arguments
+import threading # locks for the HTTP service
+import time # timestamps and timings for the reachability sweep
+from datetime import datetime, timezone # turning sweep timestamps into readable dates
+from array import array # compact arrays of numbers
+from bisect import bisect_left, bisect_right # binary search in the sorted IP index
+from itertools import accumulate # running totals, for finding where each hostname starts
+from collections import Counter, OrderedDict # good for counting things easily (and a cache that remembers its order)
+from contextlib import contextmanager # for 'with inventory_lock():'
+
+# --- Instrumentation ---
+# Off unless asked for (--metrics FILE). Functions marked @instrumented('name')
+# are only swapped for timed copies when it's switched on, so normally they
+# run exactly as written and cost nothing extra.
+LATENCY_BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0) # histogram bucket upper bounds, in seconds
+instrumented_functions = [] # (function, operation name) for everything marked @instrumented
+operation_metrics = {} # operation name -> {"count", "seconds", "max_seconds", "bytes", "buckets"}
+metrics_lock = threading.RLock() # the HTTP service records from lots of threads (re-entrant, for the USR1 handler)
+metrics_enabled = False
+
+def instrumented(operation_name):
+    """Marks a function (or method) to be timed as 'operation_name' once metrics are switched on."""
+    def mark(function):
+        instrumented_functions.append((function, operation_name))
+        return function
+    return mark
+
+def metrics_for(operation_name):
+    """The metrics entry for an operation, made on first use. Call with metrics_lock held."""
+    metrics = operation_metrics.get(operation_name)
+    if metrics is None:
+        metrics = operation_metrics[operation_name] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0,
+                                                       "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+    return metrics
+
+def record_operation(operation_name, seconds):
+    with metrics_lock:
+        metrics = metrics_for(operation_name)
+        metrics["count"] += 1
+        metrics["seconds"] += seconds
+        metrics["max_seconds"] = max(metrics["max_seconds"], seconds)
+        metrics["buckets"][bisect_left(LATENCY_BUCKETS, seconds)] += 1 # the last bucket is "slower than all of them"
+
+def record_bytes(operation_name, byte_count):
+    """Adds to the bytes read or written by an operation (only called when metrics are on)."""
+    with metrics_lock:
+        metrics_for(operation_name)["bytes"] += byte_count
+
+def enable_metrics():
+    """Swaps every @instrumented function for a copy that times itself."""
+    global metrics_enabled
+    if metrics_enabled:
+        return
+    metrics_enabled = True
+    from functools import wraps
+    perf_counter = time.perf_counter
+
+    def timed_copy(function, operation_name):
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_operation(operation_name, perf_counter() - started)
+        return timed_function
+
+    module_globals = globals()
+    for function, operation_name in instrumented_functions:
+        owner_name, _, attribute_name = function.__qualname__.rpartition('.')
+        if owner_name: # a method, e.g. 'DeviceStore.find_by_ip'
+            setattr(module_globals[owner_name], attribute_name, timed_copy(function, operation_name))
+        else:
+            module_globals[attribute_name] = timed_copy(function, operation_name)
+
+def metrics_as_json():
+    with metrics_lock:
+        return {operation_name: {
+                    "count": metrics["count"],
+                    "total_seconds": round(metrics["seconds"], 6),
+                    "mean_ms": round(metrics["seconds"] / metrics["count"] * 1000, 4) if metrics["count"] else None,
+                    "max_ms": round(metrics["max_seconds"] * 1000, 4),
+                    "bytes": metrics["bytes"],
+                    "histogram": dict(zip([f"le_{bound:g}" for bound in LATENCY_BUCKETS] + ["le_inf"], metrics["buckets"])),
+                } for operation_name, metrics in sorted(operation_metrics.items())}
+
+def metrics_as_prometheus():
+    """The metrics in Prometheus text format (histogram buckets there count everything at or below the bound)."""
+    lines = ["# HELP inventory_operation_seconds Time spent in each inventory operation.",
+             "# TYPE inventory_operation_seconds histogram"]
+    with metrics_lock:
+        for operation_name, metrics in sorted(operation_metrics.items()):
+            running_total = 0
+            for bound, bucket_count in zip([f"{bound:g}" for bound in LATENCY_BUCKETS] + ["+Inf"], metrics["buckets"]):
+                running_total += bucket_count
+                lines.append(f'inventory_operation_seconds_bucket{{operation="{operation_name}",le="{bound}"}} {running_total}')
+            lines.append(f'inventory_operation_seconds_sum{{operation="{operation_name}"}} {metrics["seconds"]:.6f}')
+            lines.append(f'inventory_operation_seconds_count{{operation="{operation_name}"}} {metrics["count"]}')
+        lines += ["# HELP inventory_operation_bytes_total Bytes read or written by each inventory operation.",
+                  "# TYPE inventory_operation_bytes_total counter"]
+        lines += [f'inventory_operation_bytes_total{{operation="{operation_name}"}} {metrics["bytes"]}'
+                  for operation_name, metrics in sorted(operation_metrics.items()) if metrics["bytes"]]
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(path):
+    """Writes the metrics to a file: Prometheus text for .prom / .txt, JSON for anything else."""
+    if os.path.splitext(path)[1].lower() in ('.prom', '.txt'):
+        metrics_text = metrics_as_prometheus()
+    else:
+        metrics_text = json.dumps({"operations": metrics_as_json()}, indent=2) + '\n'
+    write_file_atomically(path, metrics_text)
+    print(f"Metrics written to {path}.", file=sys.stderr)
+
+# --- Device Store ---
+DEVICE_FIELDS = ('hostname', 'vendor', 'os_version', 'ip_address') # every device has exactly these
+STATUS_FIELDS = ('last_seen', 'reachable', 'latency_ms') # filled in by the reachability sweep, missing until then
+BULK_REINDEX_ROWS = 100 # bulk changes bigger than this rebuild the sorted indexes later instead of shuffling them row by row
+
+class DeviceRow:
+    """
+    A tiny read-only view of one device in the store.
+
+    It reads like the old device dicts (row['hostname'], row.get('vendor'),
+    dict(row)) but only holds the store and a row id, so handing one out costs
+    almost nothing.
+    """
+    __slots__ = ('store', 'row_id')
+
+    def __init__(self, store, row_id):
+        self.store = store
+        self.row_id = row_id
+
+    def __getitem__(self, field_name):
+        return self.store.get_field(self.row_id, field_name)
+
+    def get(self, field_name, default=None):
+        try:
+            return self[field_name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def to_dict(self):
+        """Copies the device out into a normal dict (sweep status fields only if it's been swept)."""
+        device_details = {field_name: self[field_name] for field_name in DEVICE_FIELDS}
+        for field_name in STATUS_FIELDS:
+            value = self[field_name]
+            if value is not None:
+                device_details[field_name] = value
+        return device_details
+
+class DeviceStore:
+    """
+    Holds every device plus lookup indexes, so finding one by hostname or IP
+    is a dictionary hit instead of a walk through the whole inventory.
+
+    The data is stored column by column instead of one dict per device:
+    hostnames in a list, IPs as 32-bit numbers in an array('I'), and vendor /
+    OS version as small numbers pointing into one shared table of strings, so
+    'Cisco' is stored once no matter how many Cisco boxes there are. A device
+    is a row number across those columns; get() hands out a DeviceRow view.
+
+    Hostnames are indexed case-folded (so 'Core-SW1' and 'core-sw1' are the
+    same device) and IPs are indexed by their number. Always go through
+    add/update/delete (or update_many/delete_many for a batch) so the indexes
+    never drift.
+
+    Deleted rows are left as gaps (hostname None) so row ids never move.
+
+    For subnet / range searches there's also a sorted IP index: two parallel
+    arrays of IP numbers (in order) and their row ids. It's built the first
+    time someone needs it and then kept in order on every add/update/delete.
+
+    Hostname search has two more lazy indexes of the same kind: the folded
+    hostnames in sorted order (prefix search is a bisect), and a trigram index
+    (every 3-letter piece of a hostname -> the rows that have it) for "names
+    containing" and "did you mean" searches. The trigram index only ever gets
+    added to; a renamed or deleted row's old entries stay behind and searches
+    check each candidate against the real hostname, with a rebuild once too
+    many old entries pile up.
+
+    The report numbers (devices per vendor, per OS version, per vendor + OS
+    pair and per /24 subnet) work the same way: counted once on first use,
+    then nudged up and down as devices change, so a report never has to look
+    at every device.
+
+    Every add/update/delete also leaves a small change record in
+    'pending_changes', which save_devices() appends to the journal file.
+    """
+
+    def __init__(self):
+        self.hostnames = [] # row id -> hostname (None if the row was deleted)
+        self.ips = array('I') # row id -> IP address as a 32-bit number
+        self.vendor_codes = array('I') # row id -> position of the vendor in self.strings
+        self.os_codes = array('I') # row id -> position of the OS version in self.strings
+        self.last_seen = array('d') # row id -> when the sweep last reached it (Unix time, 0 = never)
+        self.reachable = array('b') # row id -> last sweep result (1 = yes, 0 = no, -1 = never swept)
+        self.latency_ms = array('f') # row id -> last connect time in ms (-1 = unknown)
+        self.strings = [] # the shared vendor / OS version table
+        self.string_codes = {} # vendor / OS text -> its position in self.strings
+        self.hostname_index = {} # case-folded hostname -> row id
+        self.ip_index = {} # IP address number -> row id
+        self.live_count = 0 # rows that haven't been deleted
+        self.sorted_ips = array('I') # every IP number, smallest first
+        self.sorted_rows = array('I') # the row id for each entry in sorted_ips
+        self.ip_order_stale = True # the sorted index needs (re)building before use
+        self.sorted_host_keys = [] # every folded hostname, in order
+        self.sorted_host_rows = array('I') # the row id for each entry in sorted_host_keys
+        self.host_order_stale = True
+        self.trigram_rows = {} # 3-letter piece of a folded hostname -> list of row ids that have (or had) it
+        self.old_trigram_entries = 0 # entries left behind by renames and deletes
+        self.trigrams_stale = True
+        self.vendor_counts = Counter() # vendor code -> number of devices
+        self.os_counts = Counter() # OS version code -> number of devices
+        self.vendor_os_counts = Counter() # (vendor code, OS version code) -> number of devices
+        self.subnet_counts = Counter() # IP number >> 8 (i.e. the /24) -> number of devices
+        self.counts_stale = True # the counters need (re)counting before use
+        self.pending_changes = [] # change records not written to the journal yet
+
+    def __len__(self):
+        return self.live_count
+
+    def __iter__(self):
+        """Goes through the devices in the order they were added."""
+        for row_id in self.row_ids():
+            yield DeviceRow(self, row_id)
+
+    def row_ids(self):
+        """Goes through the row ids of all devices that haven't been deleted."""
+        for row_id, host_name in enumerate(self.hostnames):
+            if host_name is not None:
+                yield row_id
+
+    def clear(self):
+        """Empties the store and its indexes."""
+        self.__init__()
+
+    def intern(self, text):
+        """Returns the code for a vendor / OS string, adding it to the shared table the first time."""
+        code = self.string_codes.get(text)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(text)
+            self.string_codes[text] = code
+        return code
+
+    def load(self, device_list):
+        """Replaces the store contents with a list of device dicts (e.g. from the JSON file)."""
+        self.clear()
+        skipped = 0
+        hostnames, ips, vendor_codes, os_codes = self.hostnames, self.ips, self.vendor_codes, self.os_codes
+        hostname_index, ip_index, intern = self.hostname_index, self.ip_index, self.intern # local names are quicker in a big loop
+        for device_dict in device_list:
+            host_name = device_dict['hostname']
+            host_key = fold_hostname(host_name)
+            try:
+                ip_number = ip_to_int(device_dict['ip_address'])
+            except ValueError:
+                skipped += 1 # someone hand-edited a broken IP into the file
+                continue
+            if host_key in hostname_index or ip_number in ip_index:
+                skipped += 1 # the file has a duplicate in it, keep the first one we saw
+                continue
+            row_id = len(hostnames)
+            hostnames.append(host_name)
+            ips.append(ip_number)
+            vendor_codes.append(intern(device_dict['vendor']))
+            os_codes.append(intern(device_dict['os_version']))
+            self.append_status(device_dict)
+            hostname_index[host_key] = row_id
+            ip_index[ip_number] = row_id
+        self.live_count = len(hostnames) # loading isn't a change, so nothing goes to pending_changes
+        if skipped:
+            print(f"Warning: skipped {skipped} duplicate or broken device(s) while loading.")
+
+    def append_status(self, device_dict):
+        """Adds the sweep status columns for a new row, from the optional fields of a device dict."""
+        last_seen, reachable, latency_ms = device_dict.get('last_seen'), device_dict.get('reachable'), device_dict.get('latency_ms')
+        try:
+            self.last_seen.append(datetime.fromisoformat(last_seen).timestamp() if last_seen else 0.0)
+        except (TypeError, ValueError): # a date we can't read is as good as none
+            self.last_seen.append(0.0)
+        self.reachable.append(-1 if reachable is None else int(bool(reachable)))
+        self.latency_ms.append(latency_ms if isinstance(latency_ms, (int, float)) else -1.0)
+
+    def set_status(self, row_id, reachable, latency_ms, checked_at):
+        """Records a sweep result. 'last_seen' only moves forward when the device actually answered."""
+        self.reachable[row_id] = int(reachable)
+        self.latency_ms[row_id] = latency_ms if reachable else -1.0
+        if reachable:
+            self.last_seen[row_id] = checked_at
+
+    def load_columns(self, strings, ips, vendor_codes, os_codes, hostnames, last_seen=None, reachable=None, latency_ms=None):
+        """Replaces the store contents with ready-made columns (e.g. straight from the binary snapshot)."""
+        self.clear()
+        device_count = len(hostnames)
+        self.last_seen = last_seen if last_seen is not None else array('d', bytes(8 * device_count)) # all zeros = never
+        self.reachable = reachable if reachable is not None else array('b', [-1]) * device_count
+        self.latency_ms = latency_ms if latency_ms is not None else array('f', [-1.0]) * device_count
+        self.strings = strings
+        self.string_codes = {text: code for code, text in enumerate(strings)}
+        host_keys = list(map(str.casefold, hostnames))
+        # most hostnames are already lower case - keep one string for both the column and the index key
+        hostnames = [host_key if host_key == host_name else host_name for host_name, host_key in zip(hostnames, host_keys)]
+        self.hostnames, self.ips, self.vendor_codes, self.os_codes = hostnames, ips, vendor_codes, os_codes
+        self.hostname_index = dict(zip(host_keys, range(len(hostnames))))
+        self.ip_index = dict(zip(ips, range(len(ips))))
+        self.live_count = len(hostnames)
+        if len(self.hostname_index) != len(hostnames) or len(self.ip_index) != len(hostnames):
+            # duplicates snuck in somehow, take the slow road that keeps the first of each
+            self.load([DeviceRow(self, row_id).to_dict() for row_id in range(len(hostnames))])
+
+    def columns(self):
+        """
+        Returns (strings, ips, vendor_codes, os_codes, hostnames, last_seen,
+        reachable, latency_ms) with deleted rows squeezed out.
+        """
+        all_columns = (self.ips, self.vendor_codes, self.os_codes, self.hostnames, self.last_seen, self.reachable, self.latency_ms)
+        if self.live_count == len(self.hostnames): # no gaps, hand back the columns as they are
+            return (self.strings, *all_columns)
+        live_rows = list(self.row_ids())
+        squeezed = []
+        for column in all_columns:
+            live_values = [column[row_id] for row_id in live_rows]
+            squeezed.append(array(column.typecode, live_values) if isinstance(column, array) else live_values)
+        return (self.strings, *squeezed)
+
+    def get(self, row_id):
+        """Returns a view of the device stored under a row id."""
+        if self.hostnames[row_id] is None:
+            raise KeyError(row_id)
+        return DeviceRow(self, row_id)
+
+    def get_field(self, row_id, field_name):
+        """Reads one field of one device."""
+        if field_name == 'hostname':
+            return self.hostnames[row_id]
+        if field_name == 'vendor':
+            return self.strings[self.vendor_codes[row_id]]
+        if field_name == 'os_version':
+            return self.strings[self.os_codes[row_id]]
+        if field_name == 'ip_address':
+            return int_to_ip(self.ips[row_id])
+        if field_name == 'last_seen':
+            seen_at = self.last_seen[row_id]
+            return datetime.fromtimestamp(seen_at, timezone.utc).isoformat(timespec='seconds') if seen_at else None
+        if field_name == 'reachable':
+            reachable = self.reachable[row_id]
+            return None if reachable < 0 else bool(reachable)
+        if field_name == 'latency_ms':
+            latency_ms = self.latency_ms[row_id]
+            return None if latency_ms < 0 else round(latency_ms, 2)
+        raise KeyError(field_name)
+
+    @instrumented('lookup_hostname')
+    def find_by_hostname(self, host_name):
+        """Returns the row id of the device with this hostname (any case), or None."""
+        return self.hostname_index.get(fold_hostname(host_name))
+
+    @instrumented('lookup_ip')
+    def find_by_ip(self, ip_address_string):
+        """Returns the row id of the device with this IP address, or None."""
+        try:
+            return self.ip_index.get(ip_to_int(ip_address_string))
+        except ValueError: # not an IP at all, so it can't be in here
+            return None
+
+    @instrumented('store_add')
+    def add(self, device_dict):
+        """
+        Adds a device and indexes it. Returns the new row id. Raises ValueError
+        (changing nothing) if the hostname or IP is already in the store.
+        """
+        ip_number = ip_to_int(device_dict['ip_address']) # raises ValueError before we touch anything
+        host_key = fold_hostname(device_dict['hostname'])
+        if host_key in self.hostname_index:
+            raise ValueError(f"Host Name '{device_dict['hostname']}' already exists.")
+        if ip_number in self.ip_index:
+            raise ValueError(f"IP address {device_dict['ip_address']} is already in use.")
+        row_id = len(self.hostnames)
+        self.hostnames.append(device_dict['hostname'])
+        self.ips.append(ip_number)
+        self.vendor_codes.append(self.intern(device_dict['vendor']))
+        self.os_codes.append(self.intern(device_dict['os_version']))
+        self.append_status(device_dict)
+        self.hostname_index[host_key] = row_id
+        self.ip_index[ip_number] = row_id
+        self.live_count += 1
+        self.insert_ip_order(ip_number, row_id)
+        self.insert_host_order(host_key, row_id)
+        self.add_trigrams(host_key, row_id)
+        self.count_row(row_id, 1)
+        self.pending_changes.append({"op": "add", "device": DeviceRow(self, row_id).to_dict()})
+        return row_id
+
+    @instrumented('store_update')
+    def update(self, row_id, changes):
+        """Applies a dict of field changes to a device, re-indexing a renamed hostname or IP."""
+        old_host_name = self.hostnames[row_id]
+        new_ip_number = ip_to_int(changes['ip_address']) if 'ip_address' in changes else None
+        # journal it under the old hostname, that's the name replay will find it by
+        self.pending_changes.append({"op": "update", "hostname": old_host_name, "changes": dict(changes)})
+        self.count_row(row_id, -1) # take the old values out of the counters...
+        if 'hostname' in changes:
+            old_host_key, new_host_key = fold_hostname(old_host_name), fold_hostname(changes['hostname'])
+            del self.hostname_index[old_host_key]
+            self.hostname_index[new_host_key] = row_id
+            self.hostnames[row_id] = changes['hostname']
+            self.remove_host_order(old_host_key)
+            self.insert_host_order(new_host_key, row_id)
+            self.forget_trigrams(old_host_key)
+            self.add_trigrams(new_host_key, row_id)
+        if new_ip_number is not None:
+            self.remove_ip_order(self.ips[row_id])
+            del self.ip_index[self.ips[row_id]]
+            self.ip_index[new_ip_number] = row_id
+            self.ips[row_id] = new_ip_number
+            self.insert_ip_order(new_ip_number, row_id)
+        if 'vendor' in changes:
+            self.vendor_codes[row_id] = self.intern(changes['vendor'])
+        if 'os_version' in changes:
+            self.os_codes[row_id] = self.intern(changes['os_version'])
+        self.count_row(row_id, 1) # ...and put the new ones in
+
+    @instrumented('store_delete')
+    def delete(self, row_id):
+        """Removes a device and drops it from the indexes."""
+        host_name = self.hostnames[row_id]
+        host_key = fold_hostname(host_name)
+        self.count_row(row_id, -1)
+        del self.hostname_index[host_key]
+        self.remove_host_order(host_key)
+        self.forget_trigrams(host_key)
+        self.remove_ip_order(self.ips[row_id])
+        del self.ip_index[self.ips[row_id]]
+        self.hostnames[row_id] = None # leave a gap so no other row id moves
+        self.live_count -= 1
+        self.pending_changes.append({"op": "delete", "hostname": host_name})
+
+    @instrumented('store_update_many')
+    def update_many(self, changes_by_row):
+        """
+        Applies {row id: field changes} to a batch of devices. The caller has
+        already checked that no new hostname or IP clashes with another device.
+
+        The report counters are adjusted once for the whole batch, and a batch
+        bigger than BULK_REINDEX_ROWS marks the sorted indexes for a rebuild
+        instead of moving entries around in them once per device.
+        """
+        row_ids = list(changes_by_row)
+        for row_id, changes in changes_by_row.items():
+            self.pending_changes.append({"op": "update", "hostname": self.hostnames[row_id], "changes": dict(changes)})
+        self.count_rows(row_ids, -1)
+        renamed = [(row_id, changes['hostname']) for row_id, changes in changes_by_row.items() if 'hostname' in changes]
+        renumbered = [(row_id, ip_to_int(changes['ip_address'])) for row_id, changes in changes_by_row.items() if 'ip_address' in changes]
+        if len(renamed) > BULK_REINDEX_ROWS:
+            self.host_order_stale = True
+        if len(renumbered) > BULK_REINDEX_ROWS:
+            self.ip_order_stale = True
+        # every old name / IP comes out before any new one goes in, so the batch never trips over itself
+        for row_id, _ in renamed:
+            old_host_key = fold_hostname(self.hostnames[row_id])
+            del self.hostname_index[old_host_key]
+            self.remove_host_order(old_host_key)
+            self.forget_trigrams(old_host_key)
+        for row_id, new_host_name in renamed:
+            new_host_key = fold_hostname(new_host_name)
+            self.hostname_index[new_host_key] = row_id
+            self.hostnames[row_id] = new_host_name
+            self.insert_host_order(new_host_key, row_id)
+            self.add_trigrams(new_host_key, row_id)
+        for row_id, _ in renumbered:
+            self.remove_ip_order(self.ips[row_id])
+            del self.ip_index[self.ips[row_id]]
+        for row_id, new_ip_number in renumbered:
+            self.ip_index[new_ip_number] = row_id
+            self.ips[row_id] = new_ip_number
+            self.insert_ip_order(new_ip_number, row_id)
+        for field_name, code_column in (('vendor', self.vendor_codes), ('os_version', self.os_codes)):
+            for row_id, changes in changes_by_row.items():
+                if field_name in changes:
+                    code_column[row_id] = self.intern(changes[field_name])
+        self.count_rows(row_ids, 1)
+
+    @instrumented('store_delete_many')
+    def delete_many(self, row_ids):
+        """Removes a batch of devices, with the same batched upkeep as update_many()."""
+        row_ids = list(row_ids)
+        self.count_rows(row_ids, -1)
+        if len(row_ids) > BULK_REINDEX_ROWS:
+            self.host_order_stale = self.ip_order_stale = True
+        for row_id in row_ids:
+            host_name = self.hostnames[row_id]
+            host_key = fold_hostname(host_name)
+            del self.hostname_index[host_key]
+            self.remove_host_order(host_key)
+            self.forget_trigrams(host_key)
+            self.remove_ip_order(self.ips[row_id])
+            del self.ip_index[self.ips[row_id]]
+            self.hostnames[row_id] = None
+            self.pending_changes.append({"op": "delete", "hostname": host_name})
+        self.live_count -= len(row_ids)
+
+    def ensure_ip_order(self):
+        """Builds the sorted IP index if it isn't up to date."""
+        if not self.ip_order_stale:
+            return
+        ip_index = self.ip_index
+        self.sorted_ips = array('I', sorted(ip_index)) # IPs are unique, so sorting the numbers is enough...
+        self.sorted_rows = array('I', [ip_index[ip_number] for ip_number in self.sorted_ips]) # ...and the index gives us the rows
+        self.ip_order_stale = False
+
+    def insert_ip_order(self, ip_number, row_id):
+        """Puts one IP into the sorted index (if it's been built yet)."""
+        if self.ip_order_stale:
+            return # it'll be built from scratch the first time someone needs it
+        position = bisect_left(self.sorted_ips, ip_number)
+        self.sorted_ips.insert(position, ip_number)
+        self.sorted_rows.insert(position, row_id)
+
+    def remove_ip_order(self, ip_number):
+        """Takes one IP out of the sorted index (if it's been built yet)."""
+        if self.ip_order_stale:
+            return
+        position = bisect_left(self.sorted_ips, ip_number)
+        del self.sorted_ips[position]
+        del self.sorted_rows[position]
+
+    def ensure_host_order(self):
+        """Builds the sorted hostname index if it isn't up to date."""
+        if not self.host_order_stale:
+            return
+        hostname_index = self.hostname_index
+        self.sorted_host_keys = sorted(hostname_index)
+        self.sorted_host_rows = array('I', [hostname_index[host_key] for host_key in self.sorted_host_keys])
+        self.host_order_stale = False
+
+    def insert_host_order(self, host_key, row_id):
+        if self.host_order_stale:
+            return # it'll be built from scratch the first time someone needs it
+        position = bisect_left(self.sorted_host_keys, host_key)
+        self.sorted_host_keys.insert(position, host_key)
+        self.sorted_host_rows.insert(position, row_id)
+
+    def remove_host_order(self, host_key):
+        if self.host_order_stale:
+            return
+        position = bisect_left(self.sorted_host_keys, host_key)
+        del self.sorted_host_keys[position]
+        del self.sorted_host_rows[position]
+
+    def ensure_trigrams(self):
+        """Builds the trigram index if it isn't up to date."""
+        if not self.trigrams_stale:
+            return
+        trigram_rows = {}
+        for host_key, row_id in self.hostname_index.items():
+            for trigram in hostname_trigrams(host_key):
+                rows_with_it = trigram_rows.get(trigram)
+                if rows_with_it is None:
+                    trigram_rows[trigram] = [row_id]
+                else:
+                    rows_with_it.append(row_id)
+        self.trigram_rows = trigram_rows
+        self.old_trigram_entries = 0
+        self.trigrams_stale = False
+
+    def add_trigrams(self, host_key, row_id):
+        if self.trigrams_stale:
+            return
+        for trigram in hostname_trigrams(host_key):
+            self.trigram_rows.setdefault(trigram, []).append(row_id)
+
+    def forget_trigrams(self, host_key):
+        """Notes that a hostname's trigram entries are out of date (they're left in place, see above)."""
+        if self.trigrams_stale:
+            return
+        self.old_trigram_entries += len(hostname_trigrams(host_key))
+        if self.old_trigram_entries > 4 * self.live_count + 1000: # mostly junk by now, rebuild it next time
+            self.trigrams_stale = True
+            self.trigram_rows = {}
+
+    def find_by_hostname_prefix(self, prefix, limit=None):
+        """Returns the row ids of devices whose hostname starts with 'prefix' (any case), in name order."""
+        self.ensure_host_order()
+        prefix_key = prefix.casefold()
+        start = bisect_left(self.sorted_host_keys, prefix_key)
+        end = bisect_left(self.sorted_host_keys, prefix_key + '\U0010ffff') # just past the last name starting with it
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.sorted_host_rows[start:end]
+
+    @instrumented('search_hostname')
+    def search_hostnames(self, text, limit=10):
+        """
+        Finds hostnames like 'text', best first: the exact name, then names
+        starting with it, then names containing it, then names that share most
+        of its 3-letter pieces (the "did you mean" ones, catching typos).
+        Text shorter than 3 letters only finds names starting with it, as
+        there's no 3-letter piece to look up and the alternative is a scan.
+        Returns a list of (row id, 'exact' / 'prefix' / 'contains' / 'similar').
+        """
+        query = text.strip().casefold()
+        found = {} # row id -> how it matched, in ranking order (dicts keep insertion order)
+        if not query or limit < 1:
+            return []
+        exact_row_id = self.hostname_index.get(query)
+        if exact_row_id is not None:
+            found[exact_row_id] = 'exact'
+        for row_id in self.find_by_hostname_prefix(query, limit + 1):
+            found.setdefault(row_id, 'prefix')
+        if len(found) < limit and len(query) >= 3:
+            for row_id in self.find_hostnames_containing(query, limit - len(found) + 1):
+                found.setdefault(row_id, 'contains')
+        if len(found) < limit and len(query) >= 3:
+            for row_id in self.find_similar_hostnames(query, limit):
+                found.setdefault(row_id, 'similar')
+        return list(found.items())[:limit]
+
+    def find_hostnames_containing(self, query, limit):
+        """Row ids of the shortest 'limit' hostnames with 'query' (already folded, 3 letters or more) inside them."""
+        self.ensure_trigrams()
+        # every name containing the query has all of its inner trigrams (no padding, the
+        # query can sit anywhere in the name), so the rarest one is the shortest list to check
+        inner_trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+        rarest_rows = min((self.trigram_rows.get(trigram, ()) for trigram in inner_trigrams), key=len)
+        hostnames = self.hostnames
+        matching_rows = set() # a set, since renames can leave a row listed twice
+        for row_id in rarest_rows:
+            host_name = hostnames[row_id]
+            if host_name is not None and query in host_name.casefold():
+                matching_rows.add(row_id)
+        candidates = ((hostnames[row_id].casefold(), row_id) for row_id in matching_rows)
+        return [row_id for _, row_id in heapq.nsmallest(limit, candidates, key=lambda candidate: (len(candidate[0]), candidate[0]))]
+
+    def find_similar_hostnames(self, query, limit):
+        """Row ids of hostnames sharing the most trigrams with 'query' (already folded), most alike first."""
+        self.ensure_trigrams()
+        query_trigrams = hostname_trigrams(query)
+        # count trigram hits per row, starting with the rarest trigrams and skipping the very common
+        # ones once we have plenty to go on ('-le' in 'dc1-leaf-0412' is in half the network)
+        hits = Counter()
+        counted = 0
+        for rows_with_it in sorted((self.trigram_rows.get(trigram, ()) for trigram in query_trigrams), key=len):
+            if counted and counted + len(rows_with_it) > SIMILAR_SEARCH_BUDGET:
+                break
+            hits.update(rows_with_it)
+            counted += len(rows_with_it)
+        scored = []
+        for row_id, _ in hits.most_common(SIMILAR_CANDIDATES):
+            host_name = self.hostnames[row_id]
+            if host_name is None:
+                continue # deleted since it was indexed
+            host_trigrams = hostname_trigrams(host_name.casefold())
+            similarity = len(host_trigrams & query_trigrams) / len(host_trigrams | query_trigrams)
+            if similarity >= SIMILAR_MIN_SCORE:
+                scored.append((-similarity, host_name.casefold(), row_id))
+        return [row_id for _, _, row_id in sorted(set(scored))[:limit]]
+
+    def ensure_counts(self):
+        """Counts everything for the reports if the counters aren't up to date."""
+        if not self.counts_stale:
+            return
+        vendor_codes, os_codes, ips = self.vendor_codes, self.os_codes, self.ips
+        if self.live_count != len(self.hostnames): # there are deleted rows, only count the live ones
+            live_rows = list(self.row_ids())
+            vendor_codes = [vendor_codes[row_id] for row_id in live_rows]
+            os_codes = [os_codes[row_id] for row_id in live_rows]
+            ips = [ips[row_id] for row_id in live_rows]
+        self.vendor_counts = Counter(vendor_codes)
+        self.os_counts = Counter(os_codes)
+        self.vendor_os_counts = Counter(zip(vendor_codes, os_codes))
+        self.subnet_counts = Counter([ip_number >> 8 for ip_number in ips])
+        self.counts_stale = False
+
+    def count_row(self, row_id, step):
+        """Adds one row's values to the report counters (step 1) or takes them out (step -1)."""
+        if self.counts_stale:
+            return # they'll be counted from scratch the first time someone needs them
+        vendor_code, os_code = self.vendor_codes[row_id], self.os_codes[row_id]
+        for counter, key in ((self.vendor_counts, vendor_code), (self.os_counts, os_code),
+                             (self.vendor_os_counts, (vendor_code, os_code)), (self.subnet_counts, self.ips[row_id] >> 8)):
+            counter[key] += step
+            if not counter[key]:
+                del counter[key] # drop zeros, so a report only ever walks values that exist
+
+    def count_rows(self, row_ids, step):
+        """count_row() for a whole batch of rows, with one update per counter."""
+        if self.counts_stale:
+            return
+        vendor_codes, os_codes, ips = self.vendor_codes, self.os_codes, self.ips
+        for counter, batch_counts in (
+                (self.vendor_counts, Counter([vendor_codes[row_id] for row_id in row_ids])),
+                (self.os_counts, Counter([os_codes[row_id] for row_id in row_ids])),
+                (self.vendor_os_counts, Counter([(vendor_codes[row_id], os_codes[row_id]) for row_id in row_ids])),
+                (self.subnet_counts, Counter([ips[row_id] >> 8 for row_id in row_ids]))):
+            if step > 0:
+                counter.update(batch_counts)
+            else:
+                counter.subtract(batch_counts)
+            for key in batch_counts:
+                if not counter[key]:
+                    del counter[key]
+
+    @instrumented('report_counts')
+    def report_counts(self):
+        """
+        Returns the report numbers with real names instead of codes:
+        {'vendor': Counter, 'os_version': Counter, 'vendor_os': Counter of
+        (vendor, OS) pairs, 'subnet_24': Counter of '10.0.0.0/24' style keys}.
+        """
+        self.ensure_counts()
+        strings = self.strings
+        return {
+            "vendor": Counter({strings[code]: count for code, count in self.vendor_counts.items()}),
+            "os_version": Counter({strings[code]: count for code, count in self.os_counts.items()}),
+            "vendor_os": Counter({(strings[vendor_code], strings[os_code]): count
+                                  for (vendor_code, os_code), count in self.vendor_os_counts.items()}),
+            "subnet_24": Counter({int_to_ip(subnet << 8) + '/24': count for subnet, count in self.subnet_counts.items()}),
+        }
+
+    def recount_from_scratch(self):
+        """Counts the report numbers the slow way, device by device, for checking the kept-up-to-date ones."""
+        fresh_counts = {"vendor": Counter(), "os_version": Counter(), "vendor_os": Counter(), "subnet_24": Counter()}
+        for device_row in self:
+            fresh_counts["vendor"][device_row['vendor']] += 1
+            fresh_counts["os_version"][device_row['os_version']] += 1
+            fresh_counts["vendor_os"][(device_row['vendor'], device_row['os_version'])] += 1
+            first_ip_number = ip_to_int(device_row['ip_address']) & 0xFFFFFF00
+            fresh_counts["subnet_24"][int_to_ip(first_ip_number) + '/24'] += 1
+        return fresh_counts
+
+    @instrumented('lookup_ip_range')
+    def find_in_ip_range(self, first_ip_number, last_ip_number):
+        """Returns the row ids of every device with an IP between the two numbers (inclusive), in IP order."""
+        self.ensure_ip_order()
+        start = bisect_left(self.sorted_ips, first_ip_number)
+        end = bisect_right(self.sorted_ips, last_ip_number)
+        return self.sorted_rows[start:end]
+
+    def apply_change(self, change):
+        """
+        Replays one journal record. Returns False if it doesn't fit the current
+        data (e.g. the device is already gone), so a replay can skip it safely.
+        """
+        try:
+            return self._apply_change(change)
+        except (KeyError, TypeError, ValueError): # a record we can't make sense of
+            return False
+
+    def _apply_change(self, change):
+        op = change.get('op')
+        if op == 'add':
+            device_dict = change['device']
+            if self.find_by_hostname(device_dict['hostname']) is not None or \
+               self.find_by_ip(device_dict['ip_address']) is not None:
+                return False
+            self.add(dict(device_dict))
+            return True
+        row_id = self.find_by_hostname(change.get('hostname', ''))
+        if row_id is None:
+            return False
+        if op == 'update':
+            changes = change['changes']
+            if 'hostname' in changes and self.find_by_hostname(changes['hostname']) not in (None, row_id):
+                return False
+            if 'ip_address' in changes and self.find_by_ip(changes['ip_address']) not in (None, row_id):
+                return False
+            self.update(row_id, changes)
+            return True
+        if op == 'delete':
+            self.delete(row_id)
+            return True
+        return False
+
+    def to_list(self):
+        """Returns all devices as a plain list of dicts, ready for JSON."""
+        return [DeviceRow(self, row_id).to_dict() for row_id in self.row_ids()]
+
+SIMILAR_SEARCH_BUDGET = 200000 # trigram index entries a "did you mean" search may count
+SIMILAR_CANDIDATES = 500 # rows with the most trigram hits that get a proper similarity score
+SIMILAR_MIN_SCORE = 0.3 # share of trigrams in common for a name to count as "similar"
+
+def hostname_trigrams(host_key):
+    """
+    The set of 3-letter pieces of a folded hostname. It's padded with spaces
+    first, so the start and end of the name count too and a swapped pair of
+    letters ('hots12' for 'host12') still leaves plenty in common.
+    """
+    padded_key = f"  {host_key} "
+    return {padded_key[i:i + 3] for i in range(len(padded_key) - 2)}
+
+def fold_hostname(host_name):
+    """
+    Case-folds a hostname for the index. Most hostnames are already lower case,
+    and then we reuse the original string instead of keeping a second copy.
+    """
+    host_key = host_name.casefold()
+    return host_name if host_key == host_name else host_key
 
 # --- Global Stuff ---
-# This list will hold all our network devices while the program is running.
-network_devices = []
-DATA_FILE = 'network_devices.json' # This is the file where our inventory data lives
+# This store will hold all our network devices while the program is running.
+network_devices = DeviceStore()
+DATA_FILE = 'network_devices.json' # This is the file where our inventory data lives (the snapshot)
+JOURNAL_FILE = 'network_devices.journal' # every change since the last snapshot, one JSON line each
+COMPACT_EVERY = 1000 # once the journal has this many records we fold it into the snapshot
+journal_record_count = 0 # how many records the journal file holds right now
+journal_generation = 0 # bumped by every compaction, written on the journal's first line
+journal_read_to = 0 # how far into the journal (in bytes) we've read or written - together with the generation, the version of the data we have
+snapshot_generation = 0 # the journal generation written in the snapshot we read (or wrote); an older journal is already in it
+BINARY_FILE = 'network_devices.bin' # optional compact snapshot, used instead of DATA_FILE when it's newer
+store_lock = threading.RLock() # held while the store changes, or while a save copies out what it's going to write
+save_lock = threading.RLock() # held while this program reads or writes the inventory files (and the journal_* numbers above). Taken before store_lock, never after
+inventory_lock_file = None # the open lock file while this program holds the inventory lock
+inventory_reloads = 0 # goes up every time reload_devices() swaps in a fresh copy, which renumbers the rows
 
 # --- Data Saving/Loading Functions ---
 
-def load_devices():
-    """Loads device data from our JSON file."""
-    global network_devices # gotta tell Python we're changing the global list
+def write_file_atomically(path, data):
+    """
+    Writes text (or bytes) to a temp file next to 'path' and renames it into place.
+
+    The rename is atomic, so after a crash you get either the old file or the
+    new one, never half of each.
+    """
+    import tempfile # only needed when we write, so scripts that just read don't pay to import it
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        current_umask = os.umask(0) # mkstemp makes private files, give it the permissions a normal open() would
+        os.umask(current_umask)
+        os.chmod(temp_path, 0o666 & ~current_umask)
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno()) # make sure it's really on disk before we swap it in
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path) # don't leave temp files lying around
+        raise
+
+# --- Binary Snapshot Functions ---
+# Layout (all numbers little-endian):
+#   header:    magic b'NDIB', format version (H), padding (H), string count (I), device count (I),
+#              journal generation (Q) - the journal that goes on top of this snapshot (see load_devices)
+#   strings:   string count x [length (H) + UTF-8 bytes]   <- every distinct vendor / OS version, stored once
+#   IPs:       device count x IP as a 32-bit number (I)
+#   vendors:   device count x string number (I)
+#   OS:        device count x string number (I)
+#   last seen: device count x Unix time the sweep last reached it, 0 = never (d)
+#   reachable: device count x last sweep result: 1 yes, 0 no, -1 never swept (b)
+#   latency:   device count x last connect time in ms, -1 = unknown (f)
+#   hostname lengths: device count x byte length of the UTF-8 hostname (H)
+#   hostnames: all the UTF-8 hostnames back to back
+# Every column sits in its own block, the same way DeviceStore keeps them, so the
+# number blocks load in one go with array.frombytes and the hostnames decode in one go.
+BINARY_MAGIC = b'NDIB'
+BINARY_VERSION = 4 # version 3 had no journal generation (still read, as generation 0), version 2 had no sweep status, version 1 stored each hostname with its own length in front
+BINARY_STATUS_BYTES = 8 + 1 + 4 # last seen + reachable + latency, per device
+BINARY_HEADER = struct.Struct('<4sHHII')
+BINARY_GENERATION = struct.Struct('<Q') # after the header, from version 4 on
+BINARY_LENGTH = struct.Struct('<H')
+
+def pack_binary_string(text):
+    """Length-prefixes one string for the binary format."""
+    encoded = text.encode('utf-8')
+    if len(encoded) > 0xFFFF:
+        raise ValueError(f"'{text[:40]}...' is too long for the binary format.")
+    return BINARY_LENGTH.pack(len(encoded)) + encoded
+
+def unpack_binary_strings(view, offset, count):
+    """Reads 'count' length-prefixed strings starting at 'offset'. Returns (strings, new offset)."""
+    strings = []
+    append = strings.append # skip the attribute lookup in the loop
+    for _ in range(count):
+        length = view[offset] | (view[offset + 1] << 8)
+        offset += 2
+        append(str(view[offset:offset + length], 'utf-8'))
+        offset += length
+    return strings, offset
+
+def pack_binary_hostnames(hostnames):
+    """Packs hostnames as a block of lengths followed by one block of UTF-8 text."""
+    encoded_names = [host_name.encode('utf-8') for host_name in hostnames]
+    lengths = array('H')
+    try:
+        lengths.extend(map(len, encoded_names))
+    except OverflowError:
+        raise ValueError("a Host Name is too long for the binary format.")
+    return little_endian_bytes(lengths) + b''.join(encoded_names)
+
+def unpack_binary_hostnames(view, offset, count):
+    """Reads the hostname lengths block and the text block after it. Returns (hostnames, new offset)."""
+    lengths = read_binary_array(view, offset, 'H', count)
+    offset += count * lengths.itemsize
+    blob_end = offset + sum(lengths)
+    if blob_end > len(view):
+        raise ValueError("the file is cut short")
+    blob = view[offset:blob_end]
+    ends = list(accumulate(lengths))
+    starts = [0] + ends[:-1]
+    if blob.isascii(): # the usual case: one decode, then slicing the text is safe because 1 byte = 1 character
+        text = blob.decode('ascii')
+        return [text[start:end] for start, end in zip(starts, ends)], blob_end
+    return [str(blob[start:end], 'utf-8') for start, end in zip(starts, ends)], blob_end
+
+def read_binary_array(view, offset, typecode, count):
+    """Reads one block of little-endian numbers into an array."""
+    column = array(typecode)
+    block_end = offset + count * column.itemsize
+    if block_end > len(view):
+        raise ValueError("the file is cut short")
+    column.frombytes(view[offset:block_end])
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+def little_endian_bytes(number_array):
+    """Returns an array's bytes in little-endian order, whatever machine we're on."""
+    if sys.byteorder == 'big':
+        number_array = array(number_array.typecode, number_array)
+        number_array.byteswap()
+    return number_array.tobytes()
+
+def encode_binary_snapshot(store, generation=0):
+    """Turns a DeviceStore into binary snapshot bytes (marked with the journal generation that goes on top)."""
+    strings, ips, vendor_codes, os_codes, hostnames, last_seen, reachable, latency_ms = store.columns() # the store is already laid out the same way
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(strings), len(hostnames)) + BINARY_GENERATION.pack(generation)
+    return b''.join([header, *map(pack_binary_string, strings),
+                     *map(little_endian_bytes, (ips, vendor_codes, os_codes, last_seen, reachable, latency_ms)),
+                     pack_binary_hostnames(hostnames)])
+
+def read_binary_header(view):
+    """Checks a binary snapshot's header. Returns (journal generation, string count, device count, where the strings start)."""
+    magic, version, _, string_count, device_count = BINARY_HEADER.unpack_from(view, 0)
+    if magic != BINARY_MAGIC or version not in (3, BINARY_VERSION):
+        raise ValueError("not a binary inventory snapshot (or a newer format)")
+    if version == 3:
+        return 0, string_count, device_count, BINARY_HEADER.size
+    generation, = BINARY_GENERATION.unpack_from(view, BINARY_HEADER.size)
+    return generation, string_count, device_count, BINARY_HEADER.size + BINARY_GENERATION.size
+
+def read_binary_columns(path):
+    """
+    Reads a binary snapshot file through mmap.
+
+    Returns the same columns as DeviceStore.columns(): the string table,
+    the number arrays and the list of hostnames.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("the file is empty")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            _, string_count, device_count, offset = read_binary_header(view)
+            strings, offset = unpack_binary_strings(view, offset, string_count)
+            columns = []
+            for typecode in 'IIIdbf': # IPs, vendor codes, OS codes, last seen, reachable, latency
+                columns.append(read_binary_array(view, offset, typecode, device_count))
+                offset += device_count * columns[-1].itemsize
+            hostnames, offset = unpack_binary_hostnames(view, offset, device_count)
+            if offset != len(view):
+                raise ValueError("unexpected data after the last hostname")
+    if device_count and max(max(columns[1]), max(columns[2])) >= string_count:
+        raise ValueError("a device points past the end of the string table")
+    ips, vendor_codes, os_codes, last_seen, reachable, latency_ms = columns
+    return strings, ips, vendor_codes, os_codes, hostnames, last_seen, reachable, latency_ms
+
+def read_binary_snapshot(path):
+    """Reads a binary snapshot file and returns a list of device dicts."""
+    snapshot_devices = DeviceStore()
+    snapshot_devices.load_columns(*read_binary_columns(path))
+    return snapshot_devices.to_list()
+
+@instrumented('lookup_binary_snapshot')
+def find_in_binary_snapshot(path, host_name=None, ip_number=None):
+    """
+    Looks up one device (by hostname or IP number) straight from a binary
+    snapshot file, without loading the rest. Returns a device dict or None.
+    """
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            _, string_count, device_count, strings_offset = read_binary_header(view)
+            strings, ips_offset = unpack_binary_strings(view, strings_offset, string_count)
+            lengths_offset = ips_offset + (3 * 4 + BINARY_STATUS_BYTES) * device_count # skip the IP, vendor, OS and status blocks
+            blob_offset = lengths_offset + 2 * device_count
+            found_row = None
+            if ip_number is not None:
+                try:
+                    found_row = read_binary_array(view, ips_offset, 'I', device_count).index(ip_number)
+                except ValueError: # .index() says it's not there
+                    return None
+                lengths = read_binary_array(view, lengths_offset, 'H', found_row + 1)
+                host_start = blob_offset + sum(lengths) - lengths[-1]
+                found_name = str(view[host_start:host_start + lengths[-1]], 'utf-8')
+            else:
+                target = host_name.encode('utf-8')
+                lengths = read_binary_array(view, lengths_offset, 'H', device_count)
+                blob_end = blob_offset + sum(lengths)
+                if not target.isascii() or re.search(rb'[\x80-\xff]', view[blob_offset:blob_end]):
+                    # non-ASCII case rules are too subtle for a byte search, decode everything and compare properly
+                    hostnames, _ = unpack_binary_hostnames(view, lengths_offset, device_count)
+                    host_key = host_name.casefold()
+                    found_row = next((row for row, name in enumerate(hostnames) if name.casefold() == host_key), None)
+                    if found_row is None:
+                        return None
+                    found_name = hostnames[found_row]
+                else:
+                    ends = array('Q', accumulate(lengths)) # where each hostname ends inside the text block
+                    # a lookahead, so matches can overlap: 'aa' inside 'aaa' mustn't swallow the start of the real 'aa' after it
+                    for match in re.compile(b'(?=' + re.escape(target) + b')', re.IGNORECASE).finditer(view, blob_offset, blob_end):
+                        position = match.start() - blob_offset
+                        row = bisect_right(ends, position) # the hostname this match starts inside of
+                        if (ends[row - 1] if row else 0) == position and lengths[row] == len(target):
+                            found_row = row
+                            found_name = str(view[match.start():match.start() + len(target)], 'utf-8')
+                            break
+                    if found_row is None:
+                        return None
+            vendor_code, = struct.unpack_from('<I', view, ips_offset + 4 * device_count + 4 * found_row)
+            os_code, = struct.unpack_from('<I', view, ips_offset + 8 * device_count + 4 * found_row)
+            found_ip, = struct.unpack_from('<I', view, ips_offset + 4 * found_row)
+            status_offset = ips_offset + 12 * device_count # the last seen, reachable and latency blocks follow the OS block
+            last_seen = read_binary_array(view, status_offset + 8 * found_row, 'd', 1)
+            reachable = read_binary_array(view, status_offset + 8 * device_count + found_row, 'b', 1)
+            latency_ms = read_binary_array(view, status_offset + 9 * device_count + 4 * found_row, 'f', 1)
+            # borrow a one-device store to turn the raw numbers into the usual dict
+            found_devices = DeviceStore()
+            found_devices.load_columns(strings, array('I', [found_ip]), array('I', [vendor_code]), array('I', [os_code]),
+                                       [found_name], last_seen, reachable, latency_ms)
+            return found_devices.get(0).to_dict()
+
+def binary_snapshot_is_current():
+    """True if the binary snapshot exists and is newer than the JSON snapshot."""
+    try:
+        binary_mtime = os.stat(BINARY_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    try:
+        return binary_mtime > os.stat(DATA_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return True # only the binary one exists
+
+def convert_json_to_binary(json_path=None, binary_path=None):
+    """Converts a JSON snapshot into the binary format. Returns how many devices were converted."""
+    json_path = json_path or DATA_FILE
+    binary_path = binary_path or BINARY_FILE
+    converted_devices = DeviceStore()
+    with open(json_path, 'r') as f:
+        generation, device_list = unpack_json_snapshot(json.load(f))
+    converted_devices.load(device_list)
+    write_file_atomically(binary_path, encode_binary_snapshot(converted_devices, generation))
+    return len(converted_devices)
+
+def convert_binary_to_json(binary_path=None, json_path=None):
+    """
+    Converts a binary snapshot back into the JSON format. Returns how many devices were converted.
+    Refuses (ValueError) to put our binary snapshot over our JSON one if it's
+    older, as that would undo the changes compacted into the JSON one since.
+    """
+    binary_path = binary_path or BINARY_FILE
+    json_path = json_path or DATA_FILE
+    with inventory_file_lock(): # so a save can't compact into the snapshots while we replace one
+        if (binary_path, json_path) == (BINARY_FILE, DATA_FILE) and os.path.exists(BINARY_FILE) and not binary_snapshot_is_current():
+            raise ValueError(f"{BINARY_FILE} is older than {DATA_FILE}, so converting it would undo newer changes. Nothing was converted.")
+        device_list = read_binary_snapshot(binary_path)
+        write_file_atomically(json_path, pack_json_snapshot(device_list, snapshot_file_generation(binary_path)))
+    return len(device_list)
+
+def pack_json_snapshot(device_list, generation):
+    """The JSON snapshot's text: the journal generation that goes on top of it first, then the devices."""
+    return json.dumps({"generation": generation, "devices": device_list}, separators=(',', ':')) # ensure_ascii, so one character is one byte
+
+def unpack_json_snapshot(data):
+    """Returns (journal generation, device list) from a loaded JSON snapshot. A plain list is an older snapshot, generation 0."""
+    if isinstance(data, dict):
+        return data['generation'], data['devices']
+    return 0, data
+
+def snapshot_file_generation(path):
+    """
+    The journal generation a snapshot file goes with, reading just the start
+    of it. 0 if there's no such file (or it's from before snapshots had one).
+    """
+    try:
+        with open(path, 'rb') as f:
+            start = f.read(64)
+    except FileNotFoundError:
+        return 0
+    if start.startswith(BINARY_MAGIC):
+        return read_binary_header(start)[0]
+    found = re.match(rb'\{"generation":(\d+),', start)
+    return int(found.group(1)) if found else 0
+
+def current_snapshot_file():
+    """The snapshot load_devices() reads: the binary one if it's up to date, the JSON one otherwise."""
+    return BINARY_FILE if binary_snapshot_is_current() else DATA_FILE
+
+def read_journal_header(f):
+    """
+    Reads the header line at the top of an open journal (binary mode), leaving
+    f just after it. Returns the journal's generation (0 if it has no header).
+    """
+    first_line = f.readline()
+    if first_line.startswith(b'{"generation"') and first_line.endswith(b'\n'):
+        return json.loads(first_line)['generation']
+    f.seek(0) # an old journal without a header, its first line is already a change
+    return 0
+
+def complete_journal_size(f):
+    """
+    Where the last complete (newline-ended) line of an open journal ends. A
+    torn line left at the end by a crash isn't counted, as replaying stops
+    before it too.
+    """
+    end = os.fstat(f.fileno()).st_size
+    while end > 0:
+        chunk_start = max(0, end - 4096) # one small read unless the torn line is a long one
+        f.seek(chunk_start)
+        newline_at = f.read(end - chunk_start).rfind(b'\n')
+        if newline_at >= 0:
+            return chunk_start + newline_at + 1
+        end = chunk_start
+    return 0
+
+def read_journal_records(f):
+    """Yields (change record, where the next one starts) from wherever the open journal (binary mode) is up to."""
+    next_offset = f.tell()
+    for line in f:
+        try:
+            if not line.endswith(b'\n'):
+                raise ValueError("no newline")
+            change = json.loads(line)
+        except ValueError:
+            # a crash while appending can leave a torn last line, everything before it is fine
+            print(f"Warning: ignoring a damaged record at the end of {JOURNAL_FILE}.")
+            return
+        next_offset += len(line)
+        yield change, next_offset
+
+def read_journal():
+    """Goes through the change records in the journal file, without applying them."""
+    try:
+        with open(JOURNAL_FILE, 'rb') as f:
+            read_journal_header(f)
+            for change, _ in read_journal_records(f):
+                yield change
+    except FileNotFoundError: # no journal means nothing changed since the snapshot
+        return
+
+def replay_journal(start_offset=None):
+    """
+    Applies the journal records from start_offset (the top by default) on top
+    of what's in the store, and remembers how far it got. Returns how many it read.
+
+    A journal older than the snapshot (a compaction was cut short after the
+    snapshot went in, but before the new journal did) is already in the
+    snapshot, so it's skipped. The next save starts the new journal.
+    """
+    global journal_generation, journal_read_to
+    records_read = 0
+    skipped = 0
+    try:
+        with open(JOURNAL_FILE, 'rb') as f:
+            journal_generation = read_journal_header(f)
+            if journal_generation < snapshot_generation:
+                journal_read_to = complete_journal_size(f) # as if read, so it doesn't look like someone else saved
+            else:
+                if start_offset is not None:
+                    f.seek(start_offset)
+                journal_read_to = f.tell()
+                for change, journal_read_to in read_journal_records(f):
+                    records_read += 1
+                    if not network_devices.apply_change(change):
+                        skipped += 1
+    except FileNotFoundError: # no journal means nothing changed since the snapshot
+        journal_generation = journal_read_to = 0
+    network_devices.pending_changes.clear() # replayed changes are already on disk
+    if skipped:
+        print(f"Warning: skipped {skipped} journal record(s) that no longer apply.")
+    return records_read
+
+def read_snapshot(store):
+    """
+    Fills a store from the snapshot (not the journal): the binary one if it's
+    up to date, the JSON one otherwise. Returns (the file it read, the
+    journal generation that goes on top of it).
+    """
+    if binary_snapshot_is_current(): # the binary snapshot is much quicker to read, use it if it's up to date
+        try:
+            store.load_columns(*read_binary_columns(BINARY_FILE)) # straight into the store's columns
+            return BINARY_FILE, snapshot_file_generation(BINARY_FILE)
+        except (ValueError, IndexError, struct.error, UnicodeDecodeError) as e:
+            print(f"Error reading {BINARY_FILE} ({e}). Falling back to {DATA_FILE}.")
+    with open(DATA_FILE, 'r') as f: # opening the file to read from it
+        generation, device_list = unpack_json_snapshot(json.load(f)) # pulling the data out of the JSON file...
+    store.load(device_list) # ...and indexing it
+    return DATA_FILE, generation
+
+@instrumented('load')
+def load_devices(quiet=False):
+    """
+    Loads the device snapshot from our JSON file, then replays the journal on top.
+    quiet leaves out the "Loaded ..." message (errors are still printed).
+    """
+    global journal_record_count, snapshot_generation # gotta tell Python we're changing the global counters
+    with inventory_lock(exclusive=False): # other programs can read at the same time, but not save halfway through our read
+        if uses_sqlite(): # the inventory lives in a database instead
+            load_devices_from_database(quiet)
+            return
+        snapshot_file, snapshot_generation = DATA_FILE, 0
+        try:
+            snapshot_file, snapshot_generation = read_snapshot(network_devices)
+        except FileNotFoundError: # what if the file isn't there yet?
+            network_devices.clear() # make sure the store is empty if no file
+        except (json.JSONDecodeError, KeyError): # what if the file is messed up JSON?
+            print(f"Error reading {DATA_FILE}. It might be broken. Starting empty.")
+            network_devices.clear() # clear the store if the file is corrupted
+        journal_record_count = replay_journal()
+        if metrics_enabled: # how much we read, for the metrics
+            record_bytes('load', sum(os.path.getsize(path) for path in (snapshot_file, JOURNAL_FILE) if os.path.exists(path)))
+        if network_devices or journal_record_count:
+            if not quiet:
+                print(f"Loaded {len(network_devices)} devices from {snapshot_file} ({journal_record_count} journal record(s) replayed).")
+        elif not quiet:
+            print("No old inventory file found. Starting fresh!")
+
+def snapshot_to_write(write_binary=False):
+    """
+    What compacting would write right now: (the JSON snapshot's text, the
+    binary snapshot or None). The binary one is only there if it already
+    exists on disk (or write_binary is set). Call it holding store_lock.
+    """
+    generation = next_journal_generation()
+    snapshot_text = pack_json_snapshot(network_devices.to_list(), generation)
+    binary_snapshot = None
+    if write_binary or os.path.exists(BINARY_FILE): # someone opted into the binary snapshot, keep it fresh (and newer than the JSON)
+        try:
+            binary_snapshot = encode_binary_snapshot(network_devices, generation)
+        except ValueError as e:
+            print(f"Couldn't refresh {BINARY_FILE}: {e} Using {DATA_FILE} from now on.")
+    return snapshot_text, binary_snapshot
+
+def next_journal_generation():
+    """The generation the next compaction gives the snapshots and the fresh journal."""
+    return max(journal_generation, snapshot_generation) + 1
+
+@instrumented('compact')
+def write_snapshots(snapshot_text, binary_snapshot):
+    """
+    Writes what snapshot_to_write() gave us and starts an empty journal (with
+    the next generation number on its first line). Call it holding the
+    inventory lock - store_lock isn't needed, so the menu doesn't wait for this.
+
+    The snapshots carry the new generation too. A crash after they're written
+    but before the new journal is leaves the old journal behind, and as it's
+    an older generation than the snapshot, loading skips it instead of
+    applying its changes a second time.
+    """
+    global snapshot_generation
+    generation = next_journal_generation()
+    write_file_atomically(DATA_FILE, snapshot_text) # the snapshot now has every change in it...
+    if metrics_enabled:
+        record_bytes('compact', len(snapshot_text))
+    if binary_snapshot is not None:
+        write_file_atomically(BINARY_FILE, binary_snapshot)
+        if metrics_enabled:
+            record_bytes('compact', len(binary_snapshot))
+    snapshot_generation = generation
+    start_journal(generation) # ...so the journal can start over
+
+def start_journal(generation):
+    """Replaces the journal with an empty one of this generation."""
+    global journal_record_count, journal_generation, journal_read_to
+    journal_header = json.dumps({"generation": generation}, separators=(',', ':')) + '\n'
+    write_file_atomically(JOURNAL_FILE, journal_header)
+    journal_generation = generation
+    journal_read_to = len(journal_header)
+    journal_record_count = 0
+
+def compact_journal(write_binary=False):
+    """
+    Folds the journal into a fresh snapshot and starts an empty journal.
+    The binary snapshot is refreshed too if it already exists (or write_binary is set).
+    """
+    with inventory_file_lock():
+        with store_lock:
+            catch_up_before_saving() # the snapshot replaces the whole journal, so it needs everyone's changes in it
+            snapshot = snapshot_to_write(write_binary)
+        write_snapshots(*snapshot)
+
+@instrumented('save')
+def save_devices(force_compact=False, quiet=False):
+    """
+    Appends any pending changes to the journal file (and the change history).
+
+    Nothing is written if nothing changed. Every COMPACT_EVERY records (or when
+    force_compact is set) the journal gets folded into the JSON snapshot.
+    Holds the inventory lock the whole time, so the autosave thread and other
+    programs can save too; whatever they saved first is merged in before ours
+    goes on the end (see catch_up_before_saving). store_lock is only held
+    while merging and copying out what to write, not while writing, so the
+    menu can carry on while the autosave thread waits for the disk.
+    quiet leaves out the "Saved ..." messages (errors are still printed).
+    Returns our changes that clashed with theirs and were dropped (usually none).
+    """
+    with inventory_file_lock():
+        return _save_devices(force_compact, quiet)
+
+def _save_devices(force_compact, quiet):
+    global journal_record_count, journal_read_to
+    if not network_devices.pending_changes and not force_compact:
+        return [] # nothing changed, so nothing to write
+    start_history() # the first save starts it, with the inventory as it was before our changes
+    checkpoints = history_checkpoints() # looked up now, so it doesn't hold up the store below
+    history_version = latest_history_version(checkpoints)
+    dropped_changes = []
+    attempts_left = 3 # another program can write to a database without our lock, so a SQLite save may need to merge again
+    while True:
+        with store_lock: # everything we write is copied out here, so changes made while we write just wait for the next save
+            dropped_changes += catch_up_before_saving()
+            pending = network_devices.pending_changes # a fresh list if catching up reloaded the store
+            if not pending and not force_compact:
+                return dropped_changes # they all clashed, nothing left to write
+            saved_changes = list(pending)
+            compacting = force_compact or journal_record_count + len(pending) >= COMPACT_EVERY
+            if uses_sqlite():
+                status_rows = None
+                if force_compact: # sweep status isn't a change record, so it's written for every device
+                    status_rows = [database_status_values(row_id) + (network_devices.hostnames[row_id].casefold(),)
+                                   for row_id in network_devices.row_ids()]
+            elif compacting:
+                snapshot = snapshot_to_write()
+            else:
+                lines = ''.join(json.dumps(change, separators=(',', ':')) + '\n' for change in saved_changes).encode('utf-8')
+            device_count = len(network_devices)
+            checkpoint = None
+            if checkpoints and history_version + len(saved_changes) - checkpoints[-1] >= max(HISTORY_CHECKPOINT_MIN, device_count // 2):
+                checkpoint = encode_history_checkpoint(network_devices) # the inventory as of the last change we're saving
+        try:
+            if uses_sqlite():
+                if not save_changes_to_database(saved_changes, status_rows): # another program wrote in between our check and our write
+                    attempts_left -= 1
+                    if attempts_left:
+                        continue # merge theirs in and try again
+                    print("Oops, the database kept changing while we were saving. The changes will be saved next time.")
+                    return dropped_changes
+                if not quiet:
+                    print(f"Saved {device_count} devices to {DATA_FILE}." if force_compact else f"Saved {len(saved_changes)} change(s) to {DATA_FILE}.")
+            elif compacting:
+                write_snapshots(*snapshot)
+                if not quiet:
+                    print(f"Saved {device_count} devices to {DATA_FILE}.")
+            else:
+                if journal_generation < snapshot_generation: # a compaction was cut short before starting the new journal, finish it
+                    start_journal(snapshot_generation)
+                with open(JOURNAL_FILE, 'ab') as f: # append only, we never rewrite what's already there
+                    if f.tell() > journal_read_to: # a torn line left by a crash, cut it off so ours starts on a clean line
+                        f.truncate(journal_read_to)
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if metrics_enabled:
+                    record_bytes('save', len(lines))
+                journal_record_count += len(saved_changes)
+                journal_read_to += len(lines)
+                if not quiet:
+                    print(f"Saved {len(saved_changes)} change(s) to {JOURNAL_FILE}.")
+        except Exception as e: # catching any other weird errors while saving - the changes stay pending for next time
+            print(f"Oops, something went wrong saving devices: {e}")
+            return dropped_changes
+        break
+    with store_lock:
+        del pending[:len(saved_changes)] # anything after them was changed while we were writing
+    if saved_changes: # only changes that really got saved go into the history
+        try:
+            record_history(saved_changes, checkpoints, history_version, checkpoint)
+        except (OSError, ValueError) as e:
+            print(f"Saved, but couldn't add the changes to the history: {e}")
+    return dropped_changes
+
+# --- Sharing the Inventory Between Programs ---
+# Several copies of the program (two people at the menu, a script, the HTTP
+# service) can use the same inventory files at once:
+# - Saving holds an exclusive lock on DATA_FILE + '.lock' and loading a shared
+#   one (advisory flock, so only this program pays attention to it), so nobody
+#   ever reads a save halfway through.
+# - The data has a version: the journal's generation (bumped by every compaction)
+#   and how many bytes of it we've read. Before writing, a save checks the
+#   version on disk. If someone else saved since, their changes get merged in
+#   first - usually by reading just the new end of the journal - instead of
+#   our save quietly overwriting them.
+# - refresh_devices() picks up other programs' changes between saves the same
+#   cheap way, so the menu and the service don't work from an old copy.
+# A SQLite inventory uses the same lock, and the database's data_version as
+# its version (which also catches programs that write to it without the lock).
+
+@contextmanager
+def inventory_lock(exclusive=True):
+    """Holds the inventory lock and store_lock for the 'with' block (see inventory_file_lock)."""
+    with inventory_file_lock(exclusive), store_lock:
+        yield
+
+@contextmanager
+def inventory_file_lock(exclusive=True):
+    """
+    Holds the inventory lock (and save_lock) for the 'with' block, but not
+    store_lock, so other threads can keep using the store meanwhile. Calls
+    inside one that's already held just carry on under it. Without fcntl
+    (Windows) or a lock file we can create, only save_lock is taken.
+    """
+    global inventory_lock_file
+    with save_lock:
+        lock_file = None
+        if inventory_lock_file is None:
+            try:
+                import fcntl # POSIX only
+                lock_file = open(DATA_FILE + '.lock', 'a')
+            except (ImportError, OSError):
+                pass
+        if lock_file is None:
+            yield
+            return
+        with lock_file: # closing the file lets go of the lock
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) # waits while someone else holds it
+            inventory_lock_file = lock_file
+            try:
+                yield
+            finally:
+                inventory_lock_file = None
+
+def journal_version_on_disk():
+    """
+    The (generation, size) of the journal file right now, to compare with
+    (journal_generation, journal_read_to). The size leaves out a torn last
+    line, or it would look like a new save every time we checked.
+    """
+    try:
+        with open(JOURNAL_FILE, 'rb') as f:
+            return read_journal_header(f), complete_journal_size(f)
+    except FileNotFoundError:
+        return 0, 0
+
+def saved_elsewhere():
+    """True if another program saved the inventory since we last read or wrote it."""
+    if uses_sqlite():
+        return open_database().execute("PRAGMA data_version").fetchone()[0] != database_data_version
+    return (journal_version_on_disk() != (journal_generation, journal_read_to)
+            or snapshot_file_generation(current_snapshot_file()) != snapshot_generation) # a compaction cut short leaves just a new snapshot
+
+def read_new_journal_records():
+    """
+    Applies just the journal records other programs added since we last read
+    it. Returns how many, or None if that's not enough (the journal was
+    compacted, or we have unsaved changes that have to go after theirs).
+    """
+    if uses_sqlite() or network_devices.pending_changes:
+        return None
+    generation, journal_size = journal_version_on_disk()
+    if (generation != journal_generation or journal_size < journal_read_to
+            or snapshot_file_generation(current_snapshot_file()) != snapshot_generation):
+        return None
+    return replay_journal(journal_read_to)
+
+def reload_devices():
+    """
+    Loads the inventory again as it is on disk and re-applies our unsaved
+    changes on top, so they end up after everyone else's. Sweep results newer
+    than the saved ones are kept too. Returns the unsaved changes that no
+    longer fit (someone else deleted or renamed the device, or took its
+    hostname or IP) - those are dropped.
+    """
+    global inventory_reloads
+    unsaved_changes = list(network_devices.pending_changes)
+    store = network_devices
+    our_status = {fold_hostname(store.hostnames[row_id]): (store.last_seen[row_id], store.reachable[row_id], store.latency_ms[row_id])
+                  for row_id in store.row_ids() if store.reachable[row_id] >= 0} # sweep results, which aren't journal records
+    load_devices(quiet=True)
+    inventory_reloads += 1
+    dropped_changes = [change for change in unsaved_changes if not store.apply_change(change)]
+    for host_key, (seen_at, reachable, latency_ms) in our_status.items():
+        row_id = store.hostname_index.get(host_key)
+        if row_id is not None and seen_at >= store.last_seen[row_id]:
+            store.last_seen[row_id], store.reachable[row_id], store.latency_ms[row_id] = seen_at, reachable, latency_ms
+    return dropped_changes
+
+def reloaded_since(reloads_seen):
+    """
+    True if the inventory was reloaded after inventory_reloads was reloads_seen.
+    Row ids picked before a reload point at different devices after it.
+    """
+    return inventory_reloads != reloads_seen
+
+def catch_up_before_saving():
+    """
+    Merges in whatever other programs saved since we last read the inventory,
+    so our save goes on the end instead of over the top. Call it holding the
+    inventory lock. Returns our unsaved changes that clashed with theirs and
+    were dropped (a warning says which).
+    """
+    global journal_record_count
+    if not saved_elsewhere():
+        return []
+    picked_up = read_new_journal_records()
+    if picked_up is not None:
+        journal_record_count += picked_up
+        return []
+    dropped_changes = reload_devices()
+    if dropped_changes:
+        print(f"Warning: {len(dropped_changes)} change(s) clashed with changes someone else saved first, and weren't saved:")
+        for change in dropped_changes[:BULK_PREVIEW_SHOWN]:
+            print(f"  {describe_change(change)}")
+    return dropped_changes
+
+def refresh_devices():
+    """
+    Picks up changes other programs saved since we last read the inventory.
+    Checking costs one small read; picking them up usually means reading just
+    the new end of the journal (a full reload after a compaction, or with
+    SQLite). Unsaved changes of ours are left alone - the next save merges
+    them. If another thread of ours is saving right now it doesn't wait, it
+    just looks next time. Returns True if anything changed.
+    """
+    global journal_record_count
+    if not save_lock.acquire(blocking=False): # another thread of ours is saving right now, we'll look next time
+        return False
+    try:
+        with inventory_lock(exclusive=False):
+            if network_devices.pending_changes or not saved_elsewhere():
+                return False
+            picked_up = read_new_journal_records()
+            if picked_up is None:
+                reload_devices()
+            else:
+                journal_record_count += picked_up
+            return True
+    finally:
+        save_lock.release()
+
+# --- Change History ---
+# Every saved change is also kept in the history, so we can answer things like
+# "what was on 10.1.2.3 last Tuesday". It lives in a folder next to the data file
+# (network_devices.json.history):
+#   000000000000.bin    the inventory when the history started (binary snapshot format)
+#   000000000000.jsonl  a header line, then one line per change made after it, e.g.
+#                       {"version":1,"time":"...","op":"update","hostname":"r1","changes":{"os_version":"17.6"}}
+#   000000052000.bin    a checkpoint: the whole inventory as of version 52000
+#   000000052000.jsonl  the changes after that checkpoint, and so on
+# A change record only holds what changed, so the history grows with the number
+# of changes, not with the size of the inventory. A new checkpoint is written once
+# the changes since the last one add up to half the inventory, so the checkpoints
+# never take much more room than the changes themselves, and rebuilding any past
+# version is one checkpoint read plus at most that many changes replayed.
+# Sweep results aren't changes, so they're not part of the history.
+HISTORY_CHECKPOINT_MIN = 1000 # changes between checkpoints, at the least
+
+def history_folder():
+    return DATA_FILE + '.history' # the whole name, so inventory.json and inventory.db don't share one
+
+def history_path(checkpoint_version, extension):
+    return os.path.join(history_folder(), f"{checkpoint_version:012d}{extension}")
+
+def history_checkpoints():
+    """The versions that have a checkpoint (and a segment of changes after it), oldest first."""
+    try:
+        file_names = os.listdir(history_folder())
+    except FileNotFoundError:
+        return []
+    return sorted(int(file_name[:-6]) for file_name in file_names if file_name.endswith('.jsonl') and file_name[:-6].isdigit())
+
+def history_time(when=None):
+    """A time as it's written in the history (UTC, to the second), so two of them compare as plain strings."""
+    return (when or datetime.now(timezone.utc)).astimezone(timezone.utc).isoformat(timespec='seconds')
+
+def encode_history_checkpoint(store):
+    """A whole store as a history checkpoint, or None if the binary format can't hold it."""
+    try:
+        return encode_binary_snapshot(store)
+    except ValueError as e: # something the binary format can't hold, keep adding to the old segment
+        print(f"Couldn't write a history checkpoint: {e}")
+        return None
+
+def write_history_checkpoint(version, checkpoint):
+    """Saves checkpoint (from encode_history_checkpoint) as the one for 'version' and starts a new segment after it."""
+    if checkpoint is None:
+        return
+    write_file_atomically(history_path(version, '.bin'), checkpoint)
+    # the segment file goes last: it's what marks the checkpoint as there
+    write_file_atomically(history_path(version, '.jsonl'), json.dumps({"checkpoint": version, "time": history_time()}, separators=(",", ":")) + '\n')
+
+def read_saved_inventory():
+    """
+    The inventory as it's saved on disk right now, in a store of its own
+    (network_devices is left alone). Call it holding the inventory lock.
+    """
+    saved = DeviceStore()
+    if uses_sqlite():
+        load_database_rows(saved, open_database().execute(f"SELECT {DATABASE_COLUMNS} FROM devices ORDER BY id"))
+        return saved
+    generation = 0
+    try:
+        _, generation = read_snapshot(saved)
+    except FileNotFoundError: # nothing saved yet (or just a journal)
+        pass
+    try:
+        with open(JOURNAL_FILE, 'rb') as f:
+            if read_journal_header(f) < generation: # already in the snapshot (see replay_journal)
+                return saved
+            for change, _ in read_journal_records(f):
+                saved.apply_change(change)
+    except FileNotFoundError:
+        pass
+    return saved
+
+def start_history():
+    """
+    Starts the history, if there isn't one yet, with a checkpoint of the
+    inventory as it's saved on disk. save_devices() calls it before writing,
+    so the checkpoint is from just before the first saved change, and
+    programs that only read never write anything here.
+    """
+    if history_checkpoints():
+        return
+    try:
+        os.makedirs(history_folder(), exist_ok=True)
+        write_history_checkpoint(0, encode_history_checkpoint(read_saved_inventory()))
+    except (OSError, ValueError) as e: # can't write there, or the saved inventory won't read
+        print(f"Couldn't start the change history: {e}")
+
+def last_history_line(segment_path):
+    """
+    Returns the last line of a history segment. A torn line left at the end by
+    a crash is cut off first, so the next append starts on a clean line.
+    """
+    with open(segment_path, 'rb+') as f:
+        file_size = f.seek(0, os.SEEK_END)
+        tail_start = max(0, file_size - 65536) # far more than one record
+        f.seek(tail_start)
+        tail = f.read()
+        if not tail.endswith(b'\n'):
+            tail = tail[:tail.rfind(b'\n') + 1]
+            f.truncate(tail_start + len(tail))
+        return tail[tail.rfind(b'\n', 0, -1) + 1:]
+
+def latest_history_version(checkpoints=None):
+    """The version the saved inventory is at (the number of changes since the history started)."""
+    checkpoints = checkpoints or history_checkpoints()
+    if not checkpoints:
+        return None
+    last_record = json.loads(last_history_line(history_path(checkpoints[-1], '.jsonl')))
+    return last_record.get('version', checkpoints[-1]) # just the header means no changes since the checkpoint
+
+def record_history(changes, checkpoints, version, checkpoint=None):
+    """
+    Appends just-saved change records to the history, after 'version' (the
+    latest one, as looked up before the save). checkpoint is the inventory
+    after the last of them, when a new checkpoint is due.
+    """
+    if not checkpoints: # it couldn't be started (start_history said why)
+        return
+    saved_at = history_time()
+    lines = []
+    for change in changes:
+        version += 1
+        lines.append(json.dumps({"version": version, "time": saved_at, **change}, separators=(',', ':')) + '\n')
+    with open(history_path(checkpoints[-1], '.jsonl'), 'a') as f:
+        f.write(''.join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+    if checkpoint is not None:
+        write_history_checkpoint(version, checkpoint)
+
+def read_history_segment(checkpoint_version):
+    """Goes through the change records after one checkpoint (the header line is skipped)."""
+    with open(history_path(checkpoint_version, '.jsonl'), 'r') as f:
+        next(f, None)
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError: # torn by a crash, it's the last line anyway
+                return
+
+def parse_history_point(text):
+    """
+    Turns a point in the history typed by a user into a version: either a
+    version number ('1520') or a date / time ('2026-10-13', '2026-10-13T17:30',
+    local time unless it says otherwise).
+    """
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    try:
+        when = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"'{text}' is not a version number or a date like 2026-10-13 or 2026-10-13T17:30") from None
+    return version_at_time(history_time(when if when.tzinfo else when.astimezone())) # a time without a zone is local time
+
+def version_at_time(when):
+    """The last version saved at or before a time (as written in the history)."""
+    checkpoints = history_checkpoints()
+    started_at = []
+    for checkpoint_version in checkpoints:
+        with open(history_path(checkpoint_version, '.jsonl'), 'r') as f:
+            started_at.append(json.loads(f.readline())["time"])
+    segment = bisect_right(started_at, when) - 1
+    if segment < 0:
+        raise ValueError(f"The history only goes back to {started_at[0]}." if started_at else
+                         f"There's no change history for {DATA_FILE} yet.")
+    version = checkpoints[segment]
+    for change in read_history_segment(version):
+        if change['time'] > when:
+            break
+        version = change['version']
+    return version
+
+@instrumented('history_rebuild')
+def inventory_at(version):
+    """Rebuilds the inventory as it was at a history version. Returns a DeviceStore."""
+    checkpoints = history_checkpoints()
+    if not checkpoints:
+        raise ValueError(f"There's no change history for {DATA_FILE} yet.")
+    latest_version = latest_history_version(checkpoints)
+    if not checkpoints[0] <= version <= latest_version:
+        raise ValueError(f"There's no version {version}, the history goes from {checkpoints[0]} to {latest_version}.")
+    checkpoint_version = checkpoints[bisect_right(checkpoints, version) - 1]
+    past_devices = DeviceStore()
+    # the sweep status in a checkpoint is whatever it was then, not part of the history, so leave it out
+    past_devices.load_columns(*read_binary_columns(history_path(checkpoint_version, '.bin'))[:5])
+    for change in read_history_segment(checkpoint_version):
+        if change['version'] > version:
+            break
+        past_devices.apply_change(change)
+    past_devices.pending_changes.clear() # replayed, not new
+    return past_devices
+
+def read_history(first_version=0):
+    """Goes through every change record after first_version, oldest first."""
+    checkpoints = history_checkpoints()
+    first_segment = max(0, bisect_right(checkpoints, first_version) - 1)
+    for checkpoint_version in checkpoints[first_segment:]:
+        for change in read_history_segment(checkpoint_version):
+            if change['version'] > first_version:
+                yield change
+
+def read_history_lines():
+    """Goes through the undecoded change lines of the whole history, oldest first, for quick text checks."""
+    for checkpoint_version in history_checkpoints():
+        with open(history_path(checkpoint_version, '.jsonl'), 'r') as f:
+            next(f, None)
+            yield from f
+
+def changed_hostnames(change):
+    """The case-folded hostnames a change record mentions (before and after a rename)."""
+    details = change.get('device') or change.get('changes') or {}
+    return {str(host_name).casefold() for host_name in (change.get('hostname'), details.get('hostname')) if host_name is not None}
+
+@instrumented('history_device')
+def device_history(host_name):
+    """
+    Every change to the device with this hostname, oldest first, following it
+    through renames (so a device renamed from 'r1' to 'core-1' shows both
+    parts). A hostname that was deleted and reused later shows both devices.
+    A device that was there before the history started begins with a 'start'
+    record holding how it looked then.
+    """
+    # first pass: every rename in the history, so we know all the names the device went by
+    renamed_to = {} # case-folded hostname -> the names it was renamed to or from
+    for line in read_history_lines():
+        if line.count('"hostname"') < 2: # only a rename has the key twice (a name can't hold a bare quote)
+            continue
+        try:
+            mentioned_names = changed_hostnames(json.loads(line))
+        except json.JSONDecodeError: # torn by a crash
+            continue
+        for name in mentioned_names:
+            renamed_to.setdefault(name, set()).update(mentioned_names - {name})
+    names = set()
+    names_to_follow = [host_name.casefold()]
+    while names_to_follow:
+        name = names_to_follow.pop()
+        if name not in names:
+            names.add(name)
+            names_to_follow.extend(renamed_to.get(name, ()))
+    # second pass: the changes that mention any of those names
+    device_changes = []
+    # a plain text check skips most lines without decoding them (names with
+    # accents are written escaped in the file, so those get decoded every time)
+    quoted_names = [json.dumps(name)[1:-1] for name in names] if all(name.isascii() for name in names) else None
+    for line in read_history_lines():
+        if quoted_names is not None and not any(name in line.casefold() for name in quoted_names):
+            continue
+        try:
+            change = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if changed_hostnames(change) & names:
+            device_changes.append(change)
+    # a device that was already there when the history started has no 'add'
+    # record, so start with how it looked in the first checkpoint
+    checkpoints = history_checkpoints()
+    if checkpoints and (not device_changes or device_changes[0]['op'] != 'add'):
+        first_name = device_changes[0]['hostname'] if device_changes else host_name
+        starting_details = find_in_binary_snapshot(history_path(checkpoints[0], '.bin'), host_name=first_name)
+        if starting_details is not None:
+            with open(history_path(checkpoints[0], '.jsonl'), 'r') as f:
+                started_at = json.loads(f.readline())["time"]
+            device_changes.insert(0, {"version": checkpoints[0], "time": started_at, "op": "start",
+                                      "device": {field_name: starting_details[field_name] for field_name in DEVICE_FIELDS}})
+    return device_changes
+
+@instrumented('history_diff')
+def diff_versions(old_version, new_version):
+    """
+    What changed between two versions: the devices added and removed, and the
+    fields that changed on the rest ({field: [old value, new value]}).
+    """
+    if new_version < old_version:
+        old_version, new_version = new_version, old_version
+    past_devices = inventory_at(old_version)
+    before = {} # row id -> the device before its first change (None for devices added since)
+    for change in read_history(old_version):
+        if change['version'] > new_version:
+            break
+        if change.get('op') == 'add':
+            touched_row_id, old_details = len(past_devices.hostnames), None # where it's about to go
+        else:
+            touched_row_id = past_devices.find_by_hostname(change.get('hostname', ''))
+            old_details = None
+            if touched_row_id is not None and touched_row_id not in before:
+                old_details = past_devices.get(touched_row_id).to_dict()
+        if past_devices.apply_change(change) and touched_row_id not in before:
+            before[touched_row_id] = old_details
+    added, removed, changed = {}, {}, []
+    for row_id, old_details in before.items():
+        new_details = past_devices.get(row_id).to_dict() if past_devices.hostnames[row_id] is not None else None
+        if old_details is None and new_details is not None:
+            added[new_details['hostname'].casefold()] = new_details
+        elif old_details is not None and new_details is None:
+            removed[old_details['hostname'].casefold()] = old_details
+        elif old_details is not None and old_details != new_details:
+            changed.append((old_details, new_details))
+    for host_key in set(added) & set(removed): # deleted and added back under the same name: that's a change
+        changed.append((removed.pop(host_key), added.pop(host_key)))
+    return {
+        "from_version": old_version,
+        "to_version": new_version,
+        "added": list(added.values()),
+        "removed": list(removed.values()),
+        "changed": [{"hostname": new_details['hostname'],
+                     "changes": {field_name: [old_details[field_name], new_details[field_name]]
+                                 for field_name in DEVICE_FIELDS if old_details[field_name] != new_details[field_name]}}
+                    for old_details, new_details in changed if old_details != new_details],
+    }
+
+# --- SQLite Backend ---
+# Pointing --data-file at a .db / .sqlite file keeps the inventory in SQLite
+# instead of the JSON snapshot + journal. Each save turns the pending changes
+# into row inserts/updates/deletes inside one transaction, the database itself
+# refuses duplicate hostnames (any case) and IPs, and the get, list and report
+# commands ask SQL directly instead of loading every device first.
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+database_connection = None # opened the first time it's needed
+database_data_version = None # the database's data_version when we last read it, it changes when another program writes
+
+DATABASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    hostname TEXT NOT NULL,
+    hostname_key TEXT NOT NULL UNIQUE, -- case-folded hostname, so 'R1' and 'r1' clash
+    vendor TEXT NOT NULL,
+    os_version TEXT NOT NULL,
+    ip INTEGER NOT NULL UNIQUE, -- the IP as a 32-bit number, so ranges are simple BETWEEN queries
+    last_seen REAL, -- these three stay NULL until the reachability sweep fills them in
+    reachable INTEGER,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS devices_by_vendor ON devices (vendor COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS devices_by_os_version ON devices (os_version COLLATE NOCASE);
+"""
+DATABASE_COLUMNS = "hostname, vendor, os_version, ip, last_seen, reachable, latency_ms" # what a select hands to load_database_rows
+
+def uses_sqlite():
+    """True if DATA_FILE is a SQLite database rather than a JSON snapshot."""
+    return os.path.splitext(DATA_FILE)[1].lower() in SQLITE_EXTENSIONS
+
+def open_database(path=None):
+    """Opens the database (DATA_FILE unless told otherwise), creating the table if it's new."""
+    global database_connection
+    import sqlite3 # only needed for the SQLite backend
+    if path is not None: # a one-off database, e.g. the target of a migration
+        connection = sqlite3.connect(path)
+    elif database_connection is not None:
+        return database_connection
+    else:
+        # check_same_thread off: the HTTP service loads in one thread and saves from its writer thread
+        connection = database_connection = sqlite3.connect(DATA_FILE, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = WAL") # readers don't block the writer
+    connection.executescript(DATABASE_SCHEMA)
+    return connection
+
+def load_database_rows(store, rows):
+    """Fills the store with (hostname, vendor, os_version, ip, last_seen, reachable, latency_ms) rows."""
+    string_codes = {} # vendor / OS text -> code, in the order first seen
+    hostnames, ips, vendor_codes, os_codes = [], array('I'), array('I'), array('I')
+    last_seen, reachable, latency_ms = array('d'), array('b'), array('f')
+    for host_name, vendor, os_version, ip_number, seen_at, was_reachable, latency in rows:
+        hostnames.append(host_name)
+        ips.append(ip_number)
+        vendor_codes.append(string_codes.setdefault(vendor, len(string_codes)))
+        os_codes.append(string_codes.setdefault(os_version, len(string_codes)))
+        last_seen.append(seen_at or 0.0)
+        reachable.append(-1 if was_reachable is None else was_reachable)
+        latency_ms.append(-1.0 if latency is None else latency)
+    store.load_columns(list(string_codes), ips, vendor_codes, os_codes, hostnames, last_seen, reachable, latency_ms)
+
+def load_devices_from_database(quiet=False):
+    """Reads every device from the database into the store."""
+    global journal_record_count, database_data_version
     try:
-        with open(DATA_FILE, 'r') as f: # opening the file to read from it
-            network_devices = json.load(f) # pulling the data out of the JSON file
+        connection = open_database()
+        with connection: # one read transaction, so the version we note is the one we read
+            connection.execute("BEGIN")
+            load_database_rows(network_devices, connection.execute(f"SELECT {DATABASE_COLUMNS} FROM devices ORDER BY id"))
+            database_data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+    except Exception as e: # locked, not a database, ...
+        print(f"Error reading {DATA_FILE} ({e}). Starting empty.")
+        network_devices.clear()
+    journal_record_count = 0 # there's no journal with a database
+    if quiet:
+        return
+    if network_devices:
         print(f"Loaded {len(network_devices)} devices from {DATA_FILE}.")
-    except FileNotFoundError: # what if the file isn't there yet?
-        print("No old inventory file found. Starting fresh!")
-        network_devices = [] # make sure the list is empty if no file
-    except json.JSONDecodeError: # what if the file is messed up JSON?
-        print(f"Error reading {DATA_FILE}. It might be broken. Starting empty.")
-        network_devices = [] # clear the list if the file is corrupted
-
-def save_devices():
-    """Saves the current device data to our JSON file."""
-    try:
-        with open(DATA_FILE, 'w') as f: # opening the file to write to it (overwrites existing!)
-            json.dump(network_devices, f, indent=4) # putting our device list into the file, with nice spacing
-        print(f"Saved {len(network_devices)} devices to {DATA_FILE}.")
-    except Exception as e: # catching any other weird errors while saving
-        print(f"Oops, something went wrong saving devices: {e}")
+    else:
+        print("No devices in the database yet. Starting fresh!")
+
+def database_device_values(device_dict):
+    """The column values for a new device's row."""
+    return (device_dict['hostname'], device_dict['hostname'].casefold(), device_dict['vendor'],
+            device_dict['os_version'], ip_to_int(device_dict['ip_address']))
+
+def database_status_values(row_id):
+    """A device's sweep status as column values (None where it's unknown)."""
+    seen_at, reachable, latency_ms = network_devices.last_seen[row_id], network_devices.reachable[row_id], network_devices.latency_ms[row_id]
+    return seen_at or None, None if reachable < 0 else reachable, None if latency_ms < 0 else latency_ms
+
+def save_changes_to_database(changes, status_rows=None):
+    """
+    Writes change records as row-level inserts, updates and deletes, all in
+    one transaction. status_rows, if given, are (last_seen, reachable,
+    latency_ms, hostname_key) rows with every device's sweep status (that
+    isn't a change record, so it needs writing separately).
+    Returns False, writing nothing, if another program wrote to the database
+    since we last read it (so the caller can merge and try again). Errors
+    (e.g. the disk is full) are raised, with nothing written.
+    """
+    connection = open_database()
+    with connection: # one transaction: commits if everything worked, rolls back if anything didn't
+        connection.execute("BEGIN IMMEDIATE") # take the write lock now, so nobody slips in after the check below
+        if connection.execute("PRAGMA data_version").fetchone()[0] != database_data_version:
+            connection.rollback()
+            return False
+        for change in changes:
+            if change['op'] == 'add':
+                connection.execute("INSERT INTO devices (hostname, hostname_key, vendor, os_version, ip) VALUES (?, ?, ?, ?, ?)",
+                                   database_device_values(change['device']))
+            elif change['op'] == 'update':
+                set_columns, values = [], []
+                for field_name, value in change['changes'].items():
+                    if field_name == 'hostname':
+                        set_columns += ['hostname = ?', 'hostname_key = ?']
+                        values += [value, value.casefold()]
+                    elif field_name == 'ip_address':
+                        set_columns.append('ip = ?')
+                        values.append(ip_to_int(value))
+                    elif field_name in ('vendor', 'os_version'):
+                        set_columns.append(f'{field_name} = ?')
+                        values.append(value)
+                if set_columns:
+                    connection.execute(f"UPDATE devices SET {', '.join(set_columns)} WHERE hostname_key = ?",
+                                       values + [change['hostname'].casefold()])
+            elif change['op'] == 'delete':
+                connection.execute("DELETE FROM devices WHERE hostname_key = ?", (change['hostname'].casefold(),))
+        if status_rows is not None:
+            connection.executemany("UPDATE devices SET last_seen = ?, reachable = ?, latency_ms = ? WHERE hostname_key = ?", status_rows)
+    return True
+
+@instrumented('lookup_database')
+def find_in_database(host_name=None, ip_number=None):
+    """Looks up one device by hostname (any case) or IP number. Returns its dict, or None."""
+    if host_name is not None:
+        query, value = f"SELECT {DATABASE_COLUMNS} FROM devices WHERE hostname_key = ?", host_name.casefold()
+    else:
+        query, value = f"SELECT {DATABASE_COLUMNS} FROM devices WHERE ip = ?", ip_number
+    found_devices = DeviceStore()
+    load_database_rows(found_devices, open_database().execute(query, (value,)))
+    return found_devices.get(0).to_dict() if found_devices else None
+
+@instrumented('scan_database')
+def select_from_database(vendor=None, os_version=None, ip_prefix=None, sort_by=None, offset=0, limit=None):
+    """
+    select_devices() done in SQL, with the paging too. Loads just that page
+    into the store and returns (how many matched in total, the page's row ids).
+    """
+    conditions, values = [], []
+    if vendor:
+        conditions.append("vendor = ? COLLATE NOCASE")
+        values.append(vendor.strip())
+    if os_version:
+        conditions.append("os_version = ? COLLATE NOCASE")
+        values.append(os_version.strip())
+    if ip_prefix:
+        conditions.append("ip BETWEEN ? AND ?")
+        values += parse_ip_prefix(ip_prefix)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    order_by = {'hostname': 'hostname_key', 'ip': 'ip'}.get(sort_by, 'id')
+    connection = open_database()
+    matched_count, = connection.execute(f"SELECT COUNT(*) FROM devices{where}", values).fetchone()
+    page = connection.execute(f"SELECT {DATABASE_COLUMNS} FROM devices{where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+                              values + [-1 if limit is None else limit, offset]) # LIMIT -1 means no limit
+    load_database_rows(network_devices, page)
+    return matched_count, list(network_devices.row_ids())
+
+@instrumented('report_database')
+def report_from_database():
+    """The same numbers as DeviceStore.report_counts(), counted by SQL GROUP BYs."""
+    connection = open_database()
+    return {
+        "vendor": Counter(dict(connection.execute("SELECT vendor, COUNT(*) FROM devices GROUP BY vendor"))),
+        "os_version": Counter(dict(connection.execute("SELECT os_version, COUNT(*) FROM devices GROUP BY os_version"))),
+        "vendor_os": Counter({(vendor, os_version): count for vendor, os_version, count in
+                              connection.execute("SELECT vendor, os_version, COUNT(*) FROM devices GROUP BY vendor, os_version")}),
+        "subnet_24": Counter({int_to_ip(subnet << 8) + '/24': count for subnet, count in
+                              connection.execute("SELECT ip >> 8, COUNT(*) FROM devices GROUP BY ip >> 8")}),
+    }
+
+def migrate_to_database(database_path):
+    """Copies every device in the store into a new SQLite database in one go. Returns how many."""
+    connection = open_database(database_path)
+    try:
+        existing_count, = connection.execute("SELECT COUNT(*) FROM devices").fetchone()
+        if existing_count:
+            raise ValueError(f"{database_path} already has {existing_count} devices in it, not migrating on top of them.")
+        with connection:
+            connection.executemany(
+                "INSERT INTO devices (hostname, hostname_key, vendor, os_version, ip, last_seen, reachable, latency_ms) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (database_device_values(DeviceRow(network_devices, row_id)) + database_status_values(row_id)
+                 for row_id in network_devices.row_ids()))
+    finally:
+        connection.close()
+    return len(network_devices)
 
 # --- Helper Function for IP Validation ---
 
@@ -40,12 +2068,81 @@ def check_octet_validity(octet_number):
     else:
         return False
 
+# --- IP Address Number Helpers ---
+def ip_to_int(ip_address_string):
+    """
+    Turns a dotted IP address like '10.0.0.1' into one 32-bit number.
+
+    Raises ValueError if it isn't four numbers between 0 and 255.
+    """
+    octets_list = ip_address_string.split('.') # break IP into its four parts
+    if len(octets_list) != 4: # needs exactly 4 parts
+        raise ValueError("IP address needs exactly 4 parts separated by dots.")
+    ip_number = 0
+    for octet_string in octets_list:
+        try:
+            octet_int = int(octet_string) # try turning text into a number
+        except ValueError: # what if they typed "a" instead of a number?
+            raise ValueError(f"'{octet_string}' isn't a valid number.") from None
+        if not check_octet_validity(octet_int): # use our helper to check the number
+            raise ValueError(f"'{octet_string}' isn't between 0 and 255.")
+        ip_number = (ip_number << 8) | octet_int
+    return ip_number
+
+def int_to_ip(ip_number):
+    """Turns a 32-bit number back into a dotted IP address."""
+    return f"{ip_number >> 24}.{(ip_number >> 16) & 255}.{(ip_number >> 8) & 255}.{ip_number & 255}"
+
+def parse_cidr(cidr_string):
+    """
+    Turns a subnet like '10.20.0.0/16' into (first IP number, last IP number).
+
+    A plain IP counts as a /32. Host bits are ignored, so '10.20.5.1/16' is
+    the same as '10.20.0.0/16'. Raises ValueError if it doesn't make sense.
+    """
+    ip_part, _, prefix_part = cidr_string.strip().partition('/')
+    ip_number = ip_to_int(ip_part)
+    try:
+        prefix_length = int(prefix_part) if prefix_part else 32
+    except ValueError:
+        raise ValueError(f"'{prefix_part}' isn't a valid prefix length.") from None
+    if not 0 <= prefix_length <= 32:
+        raise ValueError(f"Prefix length /{prefix_length} isn't between 0 and 32.")
+    host_mask = (1 << (32 - prefix_length)) - 1 # the bits that vary inside the subnet
+    first_ip_number = ip_number & ~host_mask & 0xFFFFFFFF
+    return first_ip_number, first_ip_number | host_mask
+
+# These two hand back row ids rather than devices: a /8 can match a million
+# rows, and building a DeviceRow for each costs far more than the lookup.
+# Slice out the page you want and call network_devices.get() on just those.
+
+def find_devices_in_subnet(cidr_string):
+    """Returns the row ids of every device inside a subnet like '10.20.0.0/16', in IP order."""
+    first_ip_number, last_ip_number = parse_cidr(cidr_string)
+    return network_devices.find_in_ip_range(first_ip_number, last_ip_number)
+
+def find_devices_in_range(first_ip_address, last_ip_address):
+    """Returns the row ids of every device with an IP between the two addresses (inclusive), in IP order."""
+    first_ip_number, last_ip_number = ip_to_int(first_ip_address), ip_to_int(last_ip_address)
+    if first_ip_number > last_ip_number: # be nice if they're the wrong way round
+        first_ip_number, last_ip_number = last_ip_number, first_ip_number
+    return network_devices.find_in_ip_range(first_ip_number, last_ip_number)
+
 # --- IP Address Validation Function ---
-def get_validated_ip_address(current_device=None):
+@instrumented('duplicate_check_ip')
+def find_ip_owner(ip_address_string, current_row_id=None):
+    """
+    Returns the row id of the other device already using this IP, or None.
+    'current_row_id' is the device being updated, its own IP doesn't count.
+    """
+    owner_row_id = network_devices.find_by_ip(ip_address_string) # one index lookup, no scanning
+    return owner_row_id if owner_row_id != current_row_id else None
+
+def get_validated_ip_address(current_row_id=None):
     """
     Asks for an IP address and makes sure it's valid and not a duplicate.
 
-    If we're updating a device, 'current_device' tells it to ignore that device's own IP.
+    If we're updating a device, 'current_row_id' tells it to ignore that device's own IP.
     """
     while True: # keep asking until we get a good IP or the user cancels
         ip_address_string = input("Enter the IP address (e.g., 192.168.1.10) or 'cancel': ").strip()
@@ -53,131 +2150,615 @@ def get_validated_ip_address(current_device=None):
         if ip_address_string.lower() == 'cancel':
             return 'cancel' # user wants out
 
-        octets_list = ip_address_string.split('.') # break IP into its four parts
-        is_ip_valid_format_and_range = True # start assuming it's good
-
-        if len(octets_list) != 4: # needs exactly 4 parts
-            print("Error: IP address needs exactly 4 parts separated by dots.")
-            is_ip_valid_format_and_range = False
-        else:
-            for octet_string in octets_list:
-                try:
-                    octet_int = int(octet_string) # try turning text into a number
-                    if not check_octet_validity(octet_int): # use our helper to check the number
-                        print(f"Error: '{octet_string}' isn't between 0 and 255.")
-                        is_ip_valid_format_and_range = False
-                        break # stop checking if one part is bad
-                except ValueError: # what if they typed "a" instead of a number?
-                    print(f"Error: '{octet_string}' isn't a valid number.")
-                    is_ip_valid_format_and_range = False
-                    break # stop if it's not a number
-
-        if not is_ip_valid_format_and_range: # if any checks failed
+        try:
+            ip_to_int(ip_address_string) # checks the format and every octet, same rules as bulk import
+        except ValueError as e: # if any checks failed
+            print(f"Error: {e}")
             print("Invalid IP address format or range. Try again.")
             continue # ask for IP again
 
         # Now, check if this IP is already used by another device
         is_duplicate = False
-        for device_dict in network_devices:
-            # this part makes sure we don't say a device's current IP is a duplicate of itself during an update
-            if device_dict['ip_address'] == ip_address_string and \
-               (current_device is None or device_dict is not current_device):
-                print(f"Error: This IP address is already used by '{device_dict.get('hostname', 'N/A')}'.")
-                is_duplicate = True
-                break
+        owner_row_id = find_ip_owner(ip_address_string, current_row_id)
+        if owner_row_id is not None:
+            print(f"Error: This IP address is already used by '{network_devices.get(owner_row_id)['hostname']}'.")
+            is_duplicate = True
+
+        if is_duplicate:
+            print("Please enter a different IP address.")
+            continue # ask for IP again
+        else:
+            print("IP address looks good and is unique.")
+            return int_to_ip(ip_to_int(ip_address_string)) # finally, return the good IP (tidied up, so '010.0.0.1' becomes '10.0.0.1')
+
+# --- Add New Device Function ---
+def add_new_device():
+    print("\n--- Add New Device ---")
+
+    # Get a unique hostname
+    while True:
+        host_name = input("Enter the Host Name (or 'cancel'): ").strip()
+        if host_name.lower() == 'cancel':
+            print("Device addition cancelled.")
+            return
+        if not host_name: # can't be empty
+            print("Host Name cannot be empty. Try again.")
+            continue
+        is_duplicate_hostname = False
+        if network_devices.find_by_hostname(host_name) is not None: # check existing hostnames
+            print(f"Error: Host Name '{host_name}' already exists.")
+            is_duplicate_hostname = True
+        if is_duplicate_hostname:
+            print("Please enter a different Host Name.")
+            continue
+        else:
+            print(f"Host Name '{host_name}' is unique.")
+            break
+
+    # Get a non-empty vendor
+    while True:
+        vendor = input("Enter the Vendor: ").strip()
+        if not vendor:
+            print("Vendor cannot be empty. Enter a value.")
+            continue
+        break
+
+    # Get a non-empty OS version
+    while True:
+        os_version = input("Enter the Operating System Version: ").strip()
+        if not os_version:
+            print("OS Version cannot be empty. Enter a value.")
+            continue
+        break
+
+    # Get a validated IP address using our special function
+    ip_address_string = get_validated_ip_address()
+    if ip_address_string == 'cancel': # if user cancelled IP input
+        print("Device addition cancelled.")
+        return
+
+    # Put all device details into a dictionary
+    device_details = {
+        "hostname": host_name,
+        "vendor": vendor,
+        "os_version": os_version,
+        "ip_address": ip_address_string
+    }
+
+    # --- Confirmation before adding ---
+    print(f"\n--- Confirm New Device Details ---")
+    print(f"Host Name: {device_details['hostname']}")
+    print(f"Vendor: {device_details['vendor']}")
+    print(f"OS Version: {device_details['os_version']}")
+    print(f"IP Address: {device_details['ip_address']}")
+    confirm = input("Add this device to the inventory? (yes/no): ").strip().lower()
+
+    if confirm == 'yes': # if user says yes, add it
+        with store_lock: # the autosave thread may be writing right now
+            # check again: a save may have merged in someone else's device with this name or IP since we asked
+            if network_devices.find_by_hostname(host_name) is not None or network_devices.find_by_ip(ip_address_string) is not None:
+                print(f"Someone else added a device with Host Name '{host_name}' or IP {ip_address_string} meanwhile, so nothing was added. Please try again.")
+                return
+            network_devices.add(device_details)
+        print(f"\nDevice '{host_name}' (IP: {ip_address_string}) added successfully!")
+    else: # if user says no
+        print("Device addition cancelled by user.")
+
+# --- Bulk Import Functions ---
+def read_import_rows(file_path):
+    """Streams (line number, row dict) pairs from a CSV file (with a header row) or a JSON Lines file."""
+    if file_path.lower().endswith(('.jsonl', '.ndjson')):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue # skip blank lines
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else {"_raw": line.rstrip('\n')}
+    else:
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as f: # utf-8-sig drops Excel's BOM
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+def check_import_row(row, seen_hostnames, seen_ips):
+    """
+    Validates one imported row against the inventory and the rows before it.
+
+    Returns (device dict, None) if the row is good or (None, reason) if not.
+    Good rows get their hostname / IP added to the 'seen' sets.
+    """
+    if "_raw" in row:
+        return None, "Not a JSON object."
+    device_details = {}
+    for field_name in DEVICE_FIELDS:
+        value = row.get(field_name)
+        value = str(value).strip() if value is not None else ''
+        if not value: # same rule as the prompts: nothing can be empty
+            return None, f"'{field_name}' is missing or empty."
+        device_details[field_name] = value
+    try:
+        ip_number = ip_to_int(device_details['ip_address'])
+    except ValueError as e:
+        return None, f"Invalid IP address: {e}"
+    host_key = device_details['hostname'].casefold()
+    # check the file first: rows we already accepted are in the store too, and this is the better message for them
+    if host_key in seen_hostnames:
+        return None, f"Host Name '{device_details['hostname']}' appears more than once in this file."
+    if host_key in network_devices.hostname_index:
+        return None, f"Host Name '{device_details['hostname']}' already exists in the inventory."
+    if ip_number in seen_ips:
+        return None, f"IP address {device_details['ip_address']} appears more than once in this file."
+    if ip_number in network_devices.ip_index:
+        return None, f"IP address {device_details['ip_address']} is already used in the inventory."
+    seen_hostnames.add(host_key)
+    seen_ips.add(ip_number)
+    device_details['ip_address'] = int_to_ip(ip_number) # tidy it up, like the prompt does
+    return device_details, None
+
+def import_devices(file_path, report_path=None):
+    """
+    Bulk-imports devices from a CSV or JSON Lines file, no prompts.
+
+    Every row is checked with the same rules as the prompts (non-empty fields,
+    valid IP, unique hostname and IP across the inventory and the file). Good
+    rows are added, bad ones go to a CSV report, and the inventory is saved
+    once at the end. Returns (number added, number rejected, number that
+    clashed with devices someone else saved at the same time and weren't saved).
+    """
+    report_path = report_path or file_path + '.rejected.csv'
+    seen_hostnames = set() # case-folded hostnames accepted from this file so far
+    seen_ips = set() # IP numbers accepted from this file so far
+    added_count = 0
+    rejected_count = 0
+    with open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+        report_writer = csv.writer(report_file)
+        report_writer.writerow(['line', 'reason', *DEVICE_FIELDS])
+        for line_number, row in read_import_rows(file_path):
+            with store_lock: # checked and added in one go, so a save merging in someone else's devices can't come in between
+                device_details, reason = check_import_row(row, seen_hostnames, seen_ips)
+                if device_details is not None:
+                    network_devices.add(device_details)
+            if device_details is None:
+                rejected_count += 1
+                report_writer.writerow([line_number, reason, *(row.get(field_name, '') for field_name in DEVICE_FIELDS)])
+                continue
+            added_count += 1
+    if rejected_count == 0:
+        os.remove(report_path) # no point keeping an empty report around
+    clashed_count = len(save_devices()) # one save for the whole file (it'll fold into the snapshot if it's a big one)
+    return added_count - clashed_count, rejected_count, clashed_count
+
+def import_devices_from_file():
+    """Asks for a file name and bulk-imports it."""
+    print("\n--- Import Devices ---")
+    file_path = input("Enter the CSV or JSONL file to import (or 'cancel'): ").strip()
+    if not file_path or file_path.lower() == 'cancel':
+        print("Import cancelled.")
+        return
+    try:
+        added_count, rejected_count, clashed_count = import_devices(file_path)
+    except OSError as e: # file not there, no permission, etc.
+        print(f"Couldn't read {file_path}: {e}")
+        return
+    print(f"Imported {added_count} device(s).")
+    if clashed_count:
+        print(f"{clashed_count} device(s) weren't saved, someone else added the same hostname or IP at the same time.")
+    if rejected_count:
+        print(f"Rejected {rejected_count} row(s), see {file_path}.rejected.csv for the reasons.")
+
+# --- Reconcile With a Discovery Scan ---
+# Compares a discovery export (CSV or JSONL with hostname, ip_address, vendor,
+# os_version - vendor and OS may be empty) with the inventory and sorts every
+# difference into a category:
+#   new      in the scan, not in the inventory
+#   missing  in the inventory, not in the scan
+#   moved    same hostname, different IP
+#   drifted  same hostname, different vendor or OS version
+# (plus 'duplicate' and 'invalid' for scan rows we couldn't use).
+# The scan is never held in memory all at once: it's read in runs of
+# RECONCILE_RUN_SIZE rows, each run is sorted by hostname and spilled to a temp
+# file, and the runs are merged back in order and walked side by side with the
+# sorted hostname index (a sorted-merge join). Differences are streamed to a
+# JSON Lines report, which is also what 'apply' works from afterwards.
+RECONCILE_RUN_SIZE = 100000 # scan rows sorted in memory at a time
+RECONCILE_CATEGORIES = ('new', 'missing', 'moved', 'drifted')
+
+def read_scan_row(row):
+    """Tidies one scan row. Returns (hostname, IP number, vendor, OS version) or raises ValueError saying what's wrong."""
+    if "_raw" in row:
+        raise ValueError("Not a JSON object.")
+    host_name, vendor, os_version, ip_address = (str(row.get(field_name) or '').strip() for field_name in DEVICE_FIELDS)
+    if not host_name or not ip_address:
+        raise ValueError("'hostname' and 'ip_address' can't be empty.")
+    try:
+        ip_number = ip_to_int(ip_address)
+    except ValueError as e:
+        raise ValueError(f"Invalid IP address: {e}") from None
+    return host_name, ip_number, vendor, os_version
+
+def write_scan_run(sorted_entries, temp_dir):
+    """Spills one sorted run of scan entries to a temp file. Returns its path."""
+    run_path = os.path.join(temp_dir, f"run-{len(os.listdir(temp_dir)):05d}.jsonl")
+    with open(run_path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(entry, separators=(',', ':')) + '\n' for entry in sorted_entries)
+    return run_path
+
+def read_scan_run(run_path):
+    with open(run_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield tuple(json.loads(line)) # tuples, so they compare with the ones still in memory
+
+def sorted_scan_entries(file_path, temp_dir, write_record, counts):
+    """
+    Streams the scan sorted by folded hostname, as (host key, line number,
+    hostname, IP number, vendor, OS version). Rows we can't use are written
+    to the report straight away.
+    """
+    run_paths = []
+    entries = []
+    for line_number, row in read_import_rows(file_path):
+        counts['scanned'] += 1
+        try:
+            host_name, ip_number, vendor, os_version = read_scan_row(row)
+        except ValueError as e:
+            counts['invalid'] += 1
+            write_record({"category": "invalid", "line": line_number, "reason": str(e)})
+            continue
+        entries.append((fold_hostname(host_name), line_number, host_name, ip_number, vendor, os_version))
+        if len(entries) >= RECONCILE_RUN_SIZE:
+            entries.sort()
+            run_paths.append(write_scan_run(entries, temp_dir))
+            entries = []
+    entries.sort()
+    if not run_paths: # it all fitted in one run, no need to go through the disk
+        return iter(entries)
+    return heapq.merge(*map(read_scan_run, run_paths), entries)
+
+@instrumented('reconcile')
+def reconcile_scan(file_path, report_path):
+    """
+    Compares a discovery scan with the inventory and writes every difference
+    to report_path (JSON Lines). Nothing in the inventory changes. Returns the
+    number of rows in each category.
+    """
+    import tempfile # only needed for the spilled runs
+    counts = Counter({category: 0 for category in ('scanned', 'matched', *RECONCILE_CATEGORIES, 'duplicate', 'invalid')})
+    network_devices.ensure_host_order()
+    host_keys, host_rows = network_devices.sorted_host_keys, network_devices.sorted_host_rows
+    hostnames, ips, ip_index = network_devices.hostnames, network_devices.ips, network_devices.ip_index
+    strings, vendor_codes, os_codes = network_devices.strings, network_devices.vendor_codes, network_devices.os_codes
+    with open(report_path, 'w', encoding='utf-8') as report_file, tempfile.TemporaryDirectory() as temp_dir:
+        def write_record(record):
+            report_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+        def ip_used_by(record, ip_number, row_id=None):
+            """Notes which other device already has this IP, since that stops the change being applied."""
+            owner_row_id = ip_index.get(ip_number)
+            if owner_row_id is not None and owner_row_id != row_id:
+                record["ip_used_by"] = hostnames[owner_row_id]
+            return record
+
+        def report_missing(end_position):
+            nonlocal position
+            for row_id in host_rows[position:end_position]:
+                counts['missing'] += 1
+                write_record({"category": "missing", "device": DeviceRow(network_devices, row_id).to_dict()})
+            position = end_position
+
+        position = 0 # where we are in the sorted hostname index
+        previous_host_key = None
+        for host_key, line_number, host_name, ip_number, vendor, os_version in sorted_scan_entries(file_path, temp_dir, write_record, counts):
+            if host_key == previous_host_key: # the first line with this hostname wins
+                counts['duplicate'] += 1
+                write_record({"category": "duplicate", "line": line_number, "hostname": host_name})
+                continue
+            previous_host_key = host_key
+            report_missing(bisect_left(host_keys, host_key, position)) # everything before it isn't in the scan
+            if position < len(host_keys) and host_keys[position] == host_key:
+                row_id = host_rows[position]
+                position += 1
+                counts['matched'] += 1
+                if ips[row_id] != ip_number:
+                    counts['moved'] += 1
+                    write_record(ip_used_by({"category": "moved", "hostname": hostnames[row_id],
+                                             "ip_address": [int_to_ip(ips[row_id]), int_to_ip(ip_number)]}, ip_number, row_id))
+                drift = {field_name: [strings[code_column[row_id]], scan_value]
+                         for field_name, code_column, scan_value in (('vendor', vendor_codes, vendor), ('os_version', os_codes, os_version))
+                         if scan_value and scan_value.casefold() != strings[code_column[row_id]].casefold()} # an empty scan value means "unknown"
+                if drift:
+                    counts['drifted'] += 1
+                    write_record({"category": "drifted", "hostname": hostnames[row_id], "changes": drift})
+            else:
+                counts['new'] += 1
+                write_record(ip_used_by({"category": "new", "line": line_number, "device": {
+                    "hostname": host_name, "vendor": vendor, "os_version": os_version, "ip_address": int_to_ip(ip_number)}}, ip_number))
+        report_missing(len(host_keys)) # whatever's left after the last scan row
+    return counts
+
+def read_report_batches(report_path, category):
+    """Streams one category's records from a reconcile report, RECONCILE_RUN_SIZE at a time."""
+    batch = []
+    with open(report_path, 'r', encoding='utf-8') as f: # always JSON Lines, whatever the file is called
+        for line in f:
+            record = json.loads(line)
+            if record.get('category') == category:
+                batch.append(record)
+                if len(batch) >= RECONCILE_RUN_SIZE:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+@instrumented('reconcile_apply')
+def apply_reconcile_report(report_path, categories):
+    """
+    Applies the chosen categories from a reconcile report: deletes the
+    missing devices, gives moved ones their new IP, drifted ones their new
+    vendor / OS and adds the new ones. Anything that would clash with another
+    device (or has no vendor / OS to add it with) is skipped. The report is
+    read in batches, so it never has to fit in memory. Saves once.
+    Returns ({category: number applied}, number skipped).
+    """
+    applied = Counter()
+    skipped = 0
+    find_by_hostname = network_devices.find_by_hostname
+    # deletes go first, they free up IPs the moves and adds may want
+    for category in ('missing', 'moved', 'drifted', 'new'):
+        if category not in categories:
+            continue
+        for batch in read_report_batches(report_path, category):
+            with store_lock:
+                if category == 'missing':
+                    missing_rows = {find_by_hostname(record['device']['hostname']) for record in batch} - {None}
+                    network_devices.delete_many(missing_rows)
+                    applied[category] += len(missing_rows)
+                    skipped += len(batch) - len(missing_rows)
+                elif category in ('moved', 'drifted'):
+                    changes_by_row, claimed_ips = {}, set()
+                    for record in batch:
+                        row_id = find_by_hostname(record['hostname'])
+                        if category == 'moved':
+                            new_ip_number = ip_to_int(record['ip_address'][1])
+                            if row_id is None or network_devices.ip_index.get(new_ip_number, row_id) != row_id or new_ip_number in claimed_ips:
+                                skipped += 1
+                                continue
+                            claimed_ips.add(new_ip_number)
+                            changes_by_row[row_id] = {"ip_address": record['ip_address'][1]}
+                        elif row_id is None:
+                            skipped += 1
+                        else:
+                            changes_by_row[row_id] = {field_name: values[1] for field_name, values in record['changes'].items()}
+                    network_devices.update_many(changes_by_row)
+                    applied[category] += len(changes_by_row)
+                else:
+                    for record in batch:
+                        device_details = record['device']
+                        if (not device_details['vendor'] or not device_details['os_version']
+                                or find_by_hostname(device_details['hostname']) is not None
+                                or network_devices.find_by_ip(device_details['ip_address']) is not None):
+                            skipped += 1
+                            continue
+                        network_devices.add(device_details)
+                        applied[category] += 1
+    for change in save_devices(): # one save for everything; these clashed with changes someone else saved meanwhile
+        if change['op'] == 'delete':
+            category = 'missing'
+        elif change['op'] == 'add':
+            category = 'new'
+        else:
+            category = 'moved' if 'ip_address' in change['changes'] else 'drifted'
+        applied[category] -= 1
+        skipped += 1
+    return {category: applied[category] for category in categories}, skipped
+
+def parse_reconcile_categories(text):
+    """Turns 'new,moved' (or 'all') into a tuple of categories. Raises ValueError for unknown ones."""
+    categories = RECONCILE_CATEGORIES if text.strip().lower() == 'all' else tuple(
+        category.strip().lower() for category in text.split(',') if category.strip())
+    unknown = [category for category in categories if category not in RECONCILE_CATEGORIES]
+    if unknown:
+        raise ValueError(f"Unknown categor{'y' if len(unknown) == 1 else 'ies'} {', '.join(unknown)}. "
+                         f"Pick from {', '.join(RECONCILE_CATEGORIES)} or all.")
+    return categories
+
+def reconcile_interactively():
+    """Asks for a scan file, shows what's different, and applies the categories you pick."""
+    print("\n--- Reconcile With a Discovery Scan ---")
+    file_path = input("Enter the CSV or JSONL scan file (or 'cancel'): ").strip()
+    if not file_path or file_path.lower() == 'cancel':
+        print("Reconcile cancelled.")
+        return
+    report_path = file_path + '.reconcile.jsonl'
+    try:
+        counts = reconcile_scan(file_path, report_path)
+    except OSError as e:
+        print(f"Couldn't read {file_path}: {e}")
+        return
+    print(f"Scanned {counts['scanned']} row(s), {counts['matched']} matched the inventory.")
+    for category in (*RECONCILE_CATEGORIES, 'duplicate', 'invalid'):
+        print(f"  {category:<10} {counts[category]}")
+    print(f"Every difference is listed in {report_path}.")
+    if not any(counts[category] for category in RECONCILE_CATEGORIES):
+        return
+    answer = input(f"Apply which? ({', '.join(RECONCILE_CATEGORIES)}, all, or press Enter for none): ").strip()
+    if not answer:
+        print("Nothing applied.")
+        return
+    try:
+        categories = parse_reconcile_categories(answer)
+    except ValueError as e:
+        print(f"Error: {e} Nothing applied.")
+        return
+    applied, skipped = apply_reconcile_report(report_path, categories)
+    print(f"Applied: {', '.join(f'{count} {category}' for category, count in applied.items())}.")
+    if skipped:
+        print(f"Skipped {skipped} that would clash with another device (or had no vendor / OS version).")
+
+# --- Device Listing ---
+# Filtering, sorting, paging and formatting for long device lists. The
+# filters work on the store's columns before anything gets formatted, and the
+# text is built a chunk of devices at a time instead of one print per line.
+LIST_CHUNK_SIZE = 1000 # devices formatted per write
+DISPLAY_PAGE_SIZE = 50 # devices per page when the menu is showing them on a screen
+LIST_FORMATS = ('block', 'table', 'csv', 'jsonl')
+SORT_ORDERS = ('hostname', 'ip')
+
+def parse_ip_prefix(prefix_string):
+    """
+    Turns an IP prefix into (first IP number, last IP number).
+
+    Takes a subnet ('10.20.0.0/16') or just the leading octets of an address
+    ('10.20' or '10.20.' both mean 10.20.0.0/16).
+    """
+    prefix_string = prefix_string.strip()
+    if '/' in prefix_string:
+        return parse_cidr(prefix_string)
+    octets = prefix_string.rstrip('.').split('.')
+    if len(octets) > 4:
+        raise ValueError(f"'{prefix_string}' has more than four parts.")
+    return parse_cidr('.'.join(octets + ['0'] * (4 - len(octets))) + f"/{8 * len(octets)}")
+
+@instrumented('scan_select')
+def select_devices(vendor=None, os_version=None, ip_prefix=None, sort_by=None, os_pattern=None):
+    """
+    Returns the row ids of the devices that match every filter given.
+
+    Vendor and OS version have to match the whole name (any case); os_pattern
+    is a wildcard pattern like '15.*' (any case). sort_by is 'hostname', 'ip'
+    or None for the order they were added.
+    """
+    if ip_prefix:
+        selected_rows = network_devices.find_in_ip_range(*parse_ip_prefix(ip_prefix)) # comes back in IP order
+        if sort_by != 'ip':
+            selected_rows = sorted(selected_rows)
+    elif sort_by == 'ip':
+        network_devices.ensure_ip_order()
+        selected_rows = network_devices.sorted_rows # the sorted IP index already has every row in IP order
+    else:
+        selected_rows = network_devices.row_ids()
+    # compare string codes, not text: a handful of names to check instead of one per device
+    for wanted_text, code_column in ((vendor, network_devices.vendor_codes), (os_version, network_devices.os_codes)):
+        if wanted_text:
+            wanted_key = wanted_text.strip().casefold()
+            wanted_codes = {code for code, text in enumerate(network_devices.strings) if text.casefold() == wanted_key}
+            selected_rows = [row_id for row_id in selected_rows if code_column[row_id] in wanted_codes]
+    if os_pattern:
+        from fnmatch import fnmatchcase # only pattern filters need it
+        wanted_pattern = os_pattern.strip().casefold()
+        wanted_codes = {code for code, text in enumerate(network_devices.strings) if fnmatchcase(text.casefold(), wanted_pattern)}
+        os_codes = network_devices.os_codes
+        selected_rows = [row_id for row_id in selected_rows if os_codes[row_id] in wanted_codes]
+    if sort_by == 'hostname':
+        hostnames = network_devices.hostnames
+        selected_rows = sorted(selected_rows, key=lambda row_id: fold_hostname(hostnames[row_id]))
+    return list(selected_rows)
 
-        if is_duplicate:
-            print("Please enter a different IP address.")
-            continue # ask for IP again
-        else:
-            print("IP address looks good and is unique.")
-            return ip_address_string # finally, return the good IP
+def format_device_status(device_dict, indent):
+    """What the last reachability sweep found, as text lines (empty if the device was never swept)."""
+    if device_dict['reachable'] is None:
+        return "" # never swept, nothing to say
+    if device_dict['reachable']:
+        status_line = f"{indent}Status: reachable ({device_dict['latency_ms']} ms)\n"
+    else:
+        status_line = f"{indent}Status: not reachable\n"
+    return status_line + f"{indent}Last Seen: {device_dict['last_seen'] or 'never'}\n"
 
-# --- Add New Device Function ---
-def add_new_device():
-    print("\n--- Add New Device ---")
+def format_block_chunk(device_rows, first_number):
+    return ''.join(f"--- Device {number} ---\n"
+                   f"Host Name: {device_row['hostname']}\n"
+                   f"Vendor: {device_row['vendor']}\n"
+                   f"OS Version: {device_row['os_version']}\n"
+                   f"IP Address: {device_row['ip_address']}\n"
+                   f"{format_device_status(device_row, '')}"
+                   "----------------------------\n"
+                   for number, device_row in enumerate(device_rows, first_number))
 
-    # Get a unique hostname
-    while True:
-        host_name = input("Enter the Host Name (or 'cancel'): ").strip()
-        if host_name.lower() == 'cancel':
-            print("Device addition cancelled.")
-            return
-        if not host_name: # can't be empty
-            print("Host Name cannot be empty. Try again.")
-            continue
-        is_duplicate_hostname = False
-        for device_dict in network_devices:
-            if device_dict['hostname'].lower() == host_name.lower(): # check existing hostnames
-                print(f"Error: Host Name '{host_name}' already exists.")
-                is_duplicate_hostname = True
-                break
-        if is_duplicate_hostname:
-            print("Please enter a different Host Name.")
-            continue
-        else:
-            print(f"Host Name '{host_name}' is unique.")
-            break
+def format_table_row(host_name, vendor, os_version, ip_address, status):
+    return f"{host_name:<24} {vendor:<12} {os_version:<14} {ip_address:<15} {status}".rstrip() + "\n"
 
-    # Get a non-empty vendor
-    while True:
-        vendor = input("Enter the Vendor: ").strip()
-        if not vendor:
-            print("Vendor cannot be empty. Enter a value.")
-            continue
-        break
+def format_table_chunk(device_rows, first_number):
+    table_lines = []
+    for device_row in device_rows:
+        reachable = device_row['reachable']
+        status = '' if reachable is None else ('up' if reachable else 'down')
+        table_lines.append(format_table_row(device_row['hostname'], device_row['vendor'],
+                                            device_row['os_version'], device_row['ip_address'], status))
+    return ''.join(table_lines)
 
-    # Get a non-empty OS version
-    while True:
-        os_version = input("Enter the Operating System Version: ").strip()
-        if not os_version:
-            print("OS Version cannot be empty. Enter a value.")
-            continue
-        break
+def format_csv_chunk(device_rows, first_number):
+    import io # just a place for the csv writer to write into
+    chunk_text = io.StringIO()
+    csv.writer(chunk_text).writerows(['' if device_row[field_name] is None else device_row[field_name]
+                                      for field_name in DEVICE_FIELDS + STATUS_FIELDS] for device_row in device_rows)
+    return chunk_text.getvalue()
 
-    # Get a validated IP address using our special function
-    ip_address_string = get_validated_ip_address()
-    if ip_address_string == 'cancel': # if user cancelled IP input
-        print("Device addition cancelled.")
-        return
+def format_jsonl_chunk(device_rows, first_number):
+    return ''.join(json.dumps(device_row.to_dict()) + '\n' for device_row in device_rows)
 
-    # Put all device details into a dictionary
-    device_details = {
-        "hostname": host_name,
-        "vendor": vendor,
-        "os_version": os_version,
-        "ip_address": ip_address_string
-    }
+# format name -> (header line, function that formats a chunk of devices)
+LIST_FORMATTERS = {
+    'block': ("", format_block_chunk),
+    'table': (format_table_row('HOSTNAME', 'VENDOR', 'OS VERSION', 'IP ADDRESS', 'STATUS'), format_table_chunk),
+    'csv': (','.join(DEVICE_FIELDS + STATUS_FIELDS) + '\r\n', format_csv_chunk), # csv module line endings
+    'jsonl': ("", format_jsonl_chunk),
+}
 
-    # --- Confirmation before adding ---
-    print(f"\n--- Confirm New Device Details ---")
-    print(f"Host Name: {device_details['hostname']}")
-    print(f"Vendor: {device_details['vendor']}")
-    print(f"OS Version: {device_details['os_version']}")
-    print(f"IP Address: {device_details['ip_address']}")
-    confirm = input("Add this device to the inventory? (yes/no): ").strip().lower()
+def write_device_list(row_ids, list_format, output, first_number=1, with_header=True):
+    """Writes the devices to an open text file (or stdout), LIST_CHUNK_SIZE devices per write."""
+    header, format_chunk = LIST_FORMATTERS[list_format]
+    if with_header and header:
+        output.write(header)
+    for chunk_start in range(0, len(row_ids), LIST_CHUNK_SIZE):
+        device_rows = [DeviceRow(network_devices, row_id) for row_id in row_ids[chunk_start:chunk_start + LIST_CHUNK_SIZE]]
+        output.write(format_chunk(device_rows, first_number + chunk_start))
+    output.flush()
 
-    if confirm == 'yes': # if user says yes, add it
-        network_devices.append(device_details)
-        print(f"\nDevice '{host_name}' (IP: {ip_address_string}) added successfully!")
-    else: # if user says no
-        print("Device addition cancelled by user.")
+def ask_list_options():
+    """Asks which devices to show and how. Returns (row ids, format)."""
+    narrow_down = input("Filter, sort or change the layout first? (yes/no): ").strip().lower()
+    if narrow_down != 'yes':
+        return select_devices(), 'block'
+    vendor = input("Only this vendor (press Enter for any): ").strip()
+    os_version = input("Only this OS version (press Enter for any): ").strip()
+    while True:
+        ip_prefix = input("Only IPs starting with (e.g., 10.20 or 10.20.0.0/16, press Enter for any): ").strip()
+        sort_by = input("Sort by 'hostname' or 'ip' (press Enter to keep the order they were added): ").strip().lower()
+        list_format = input("Layout: block, table, csv or jsonl (press Enter for block): ").strip().lower() or 'block'
+        if sort_by and sort_by not in SORT_ORDERS:
+            print("Sort by has to be 'hostname' or 'ip'. Try again.")
+        elif list_format not in LIST_FORMATS:
+            print("Layout has to be block, table, csv or jsonl. Try again.")
+        else:
+            try:
+                return select_devices(vendor, os_version, ip_prefix, sort_by or None), list_format
+            except ValueError as e: # bad IP prefix
+                print(f"Error: {e} Try again.")
 
 # --- Display All Devices Function ---
 def display_all_devices():
-    """Shows all devices currently in the inventory."""
-    if not network_devices: # check if the list is empty
+    """Shows the devices in the inventory, a page at a time when it's going to a screen."""
+    if not network_devices: # check if the store is empty
         print("\nNo devices in the inventory yet.\n")
-    else:
-        print("\n-------------------------------------------------")
-        print(f"\nHere are all the devices in the inventory: \n")
-        for i, device_dict in enumerate(network_devices): # loop through devices to print them
-            print(f"--- Device {i+1} ---") # adding a number for each device
-            print(f"Host Name: {device_dict['hostname']}")
-            print(f"Vendor: {device_dict['vendor']}")
-            print(f"OS Version: {device_dict['os_version']}")
-            print(f"IP Address: {device_dict['ip_address']}")
-            print("----------------------------")
+        return
+    selected_rows, list_format = ask_list_options()
+    if not selected_rows:
+        print("\nNo devices match that.\n")
+        return
+    print("\n-------------------------------------------------")
+    print(f"\nHere are {len(selected_rows)} of the {len(network_devices)} devices in the inventory: \n")
+    # on a screen, stop after each page; into a pipe or file, just stream the lot
+    page_size = DISPLAY_PAGE_SIZE if sys.stdout.isatty() else len(selected_rows)
+    for page_start in range(0, len(selected_rows), page_size):
+        write_device_list(selected_rows[page_start:page_start + page_size], list_format, sys.stdout,
+                          first_number=page_start + 1, with_header=page_start == 0)
+        shown_so_far = page_start + page_size
+        if shown_so_far < len(selected_rows):
+            more = input(f"-- {shown_so_far} of {len(selected_rows)} shown. Press Enter for more, or 'q' to stop: ")
+            if more.strip().lower() == 'q':
+                break
 
 # --- Display Specific Device Function ---
 def display_specific_device():
@@ -192,12 +2773,25 @@ def display_specific_device():
         print("1. By Host Name")
         print("2. By IP Address")
         print("3. Back to Main Menu")
-        search_choice = input("Enter your choice (1/2/3): ").strip()
+        print("4. By Subnet (e.g., 10.20.0.0/16)")
+        print("5. By IP Range (e.g., 10.20.0.1 - 10.20.0.100)")
+        print("6. By Part of the Host Name (e.g., dc1-leaf)")
+        search_choice = input("Enter your choice (1/2/3/4/5/6): ").strip()
 
         if search_choice == '3': # user wants to go back
             print("Going back to main menu.")
             return
 
+        if search_choice in ('4', '5'): # these can match lots of devices, so they get their own little helper
+            if search_devices_by_ip_block(search_choice == '4'):
+                break # found something, exit the search loop
+            continue
+
+        if search_choice == '6':
+            if search_devices_by_partial_hostname():
+                break
+            continue
+
         search_by_hostname = False
         search_by_ip = False
 
@@ -206,7 +2800,7 @@ def display_specific_device():
         elif search_choice == '2':
             search_by_ip = True
         else:
-            print("Invalid choice. Please enter 1, 2, or 3.")
+            print("Invalid choice. Please enter 1, 2, 3, 4, 5, or 6.")
             continue # ask for search type again
 
         search_term = ""
@@ -219,31 +2813,85 @@ def display_specific_device():
             print("Search cancelled. Going back to main menu.")
             return
 
-        found_device = None
-        for device_dict in network_devices: # loop through all devices to find a match
-            if search_by_hostname:
-                if device_dict['hostname'].lower() == search_term.lower(): # case-insensitive hostname search
-                    found_device = device_dict
-                    break
-            elif search_by_ip:
-                if device_dict['ip_address'] == search_term: # IP needs exact match
-                    found_device = device_dict
-                    break
+        found_row_id = None
+        if search_by_hostname:
+            found_row_id = network_devices.find_by_hostname(search_term) # case-insensitive hostname lookup
+        elif search_by_ip:
+            found_row_id = network_devices.find_by_ip(search_term) # IP needs exact match
 
-        if found_device: # if we found it
+        if found_row_id is not None: # if we found it
+            found_device = network_devices.get(found_row_id)
             print(f"\n--- Details for Device: {found_device['hostname']} ---")
             print(f"  Vendor: {found_device['vendor']}")
             print(f"  OS Version: {found_device['os_version']}")
             print(f"  IP Address: {found_device['ip_address']}")
+            print(format_device_status(found_device, "  "), end='')
             print("-------------------------------------------")
             break # exit the search loop
         else: # if not found
             if search_by_hostname:
                 print(f"Device with Host Name '{search_term}' not found. Try again.")
+                print_hostname_suggestions(search_term)
             elif search_by_ip:
                 print(f"Device with IP Address '{search_term}' not found. Try again.")
             # loop continues to ask for another search term
 
+MAX_SEARCH_RESULTS_SHOWN = 100 # a /8 can match a million devices, nobody wants all of those on screen
+MAX_HOSTNAME_SUGGESTIONS = 5 # names offered after a "not found"
+
+def print_hostname_suggestions(host_name):
+    """Prints a "did you mean" line for a hostname that wasn't found, if any names look close."""
+    suggestions = [network_devices.hostnames[row_id] for row_id, _ in network_devices.search_hostnames(host_name, MAX_HOSTNAME_SUGGESTIONS)]
+    if suggestions:
+        print(f"Did you mean: {', '.join(suggestions)}?")
+
+def search_devices_by_partial_hostname():
+    """Asks for part of a hostname and shows the best matches. Returns True if any were found."""
+    search_term = input("Enter the start or any part (3 letters or more) of the Host Name (or 'cancel'): ").strip()
+    if search_term.lower() == 'cancel' or not search_term:
+        return False
+    matches = network_devices.search_hostnames(search_term, MAX_SEARCH_RESULTS_SHOWN)
+    if not matches:
+        print(f"No host names look like '{search_term}'. Try again.")
+        return False
+    print(f"\n--- Best matches for '{search_term}' ---")
+    for row_id, how_it_matched in matches:
+        found_device = network_devices.get(row_id)
+        print(f"  {found_device['hostname']:<30} {found_device['ip_address']:<15} ({how_it_matched})")
+    print("-------------------------------------------")
+    return True
+
+def search_devices_by_ip_block(by_subnet):
+    """Asks for a subnet (or an IP range) and shows the devices in it. Returns True if any were found."""
+    try:
+        if by_subnet:
+            search_term = input("Enter the subnet to search (e.g., 10.20.0.0/16) (or 'cancel'): ").strip()
+            if search_term.lower() == 'cancel':
+                return False
+            matching_rows = find_devices_in_subnet(search_term)
+        else:
+            first_ip_address = input("Enter the first IP Address of the range (or 'cancel'): ").strip()
+            if first_ip_address.lower() == 'cancel':
+                return False
+            last_ip_address = input("Enter the last IP Address of the range: ").strip()
+            search_term = f"{first_ip_address} - {last_ip_address}"
+            matching_rows = find_devices_in_range(first_ip_address, last_ip_address)
+    except ValueError as e: # a typo in the subnet or one of the IPs
+        print(f"Error: {e} Try again.")
+        return False
+
+    if not matching_rows:
+        print(f"No devices found in {search_term}. Try again.")
+        return False
+    print(f"\n--- {len(matching_rows)} device(s) in {search_term} ---")
+    for row_id in matching_rows[:MAX_SEARCH_RESULTS_SHOWN]: # only the rows we show get looked at
+        device_row = network_devices.get(row_id)
+        print(f"  {device_row['ip_address']:<15}  {device_row['hostname']}  ({device_row['vendor']}, {device_row['os_version']})")
+    if len(matching_rows) > MAX_SEARCH_RESULTS_SHOWN:
+        print(f"  ... and {len(matching_rows) - MAX_SEARCH_RESULTS_SHOWN} more.")
+    print("-------------------------------------------")
+    return True
+
 # --- Update Existing Device Function ---
 def update_device():
     """Allows you to change details of an existing device."""
@@ -257,13 +2905,13 @@ def update_device():
             print("\nGoing back to main menu.")
             return False # no changes made
 
-        found_device = None # reset for each search attempt
-        for device_dict in network_devices: # loop to find the device by hostname
-            if device_dict['hostname'].lower() == device_update_hostname.lower():
-                found_device = device_dict
-                break
+        reloads_seen = inventory_reloads # a background save merging in someone else's changes would renumber the rows
+        found_row_id = network_devices.find_by_hostname(device_update_hostname) # index lookup by hostname
 
-        if found_device: # if we found the device
+        if found_row_id is not None: # if we found the device
+            original_device = network_devices.get(found_row_id)
+            # we edit a copy, so the store (and its indexes) only change if the user saves
+            found_device = dict(original_device)
             print(f"Device found: {found_device['hostname']}")
             print("Current details:")
             print(f"  Vendor: {found_device['vendor']}")
@@ -290,12 +2938,11 @@ def update_device():
                             print("Host Name can't be empty. Try again.")
                             continue
                         is_duplicate_hostname = False
-                        for device_dict in network_devices:
-                            # make sure the new hostname isn't used by another device
-                            if device_dict['hostname'].lower() == new_host_name.lower() and device_dict is not found_device:
-                                print(f"Error: Host Name '{new_host_name}' already exists.")
-                                is_duplicate_hostname = True
-                                break
+                        owner_row_id = network_devices.find_by_hostname(new_host_name)
+                        # make sure the new hostname isn't used by another device
+                        if owner_row_id is not None and owner_row_id != found_row_id:
+                            print(f"Error: Host Name '{new_host_name}' already exists.")
+                            is_duplicate_hostname = True
                         if is_duplicate_hostname:
                             print("Please enter a different Host Name.")
                             continue
@@ -339,7 +2986,7 @@ def update_device():
                 elif device_detail_choice == "4":
                     old_ip = found_device['ip_address']
                     print(f"Current IP Address: {old_ip}")
-                    new_ip_address = get_validated_ip_address(current_device=found_device) # use our IP validation function
+                    new_ip_address = get_validated_ip_address(current_row_id=found_row_id) # use our IP validation function
 
                     if new_ip_address == 'cancel':
                         print("IP update cancelled.")
@@ -362,6 +3009,13 @@ def update_device():
                         print(f"  IP Address: {found_device['ip_address']}")
                         confirm_save = input("Are you sure you want to save these changes? (yes/no): ").strip().lower()
                         if confirm_save == 'yes':
+                            # only hand the store the fields that really changed, so it can re-index them
+                            changed_fields = {key: value for key, value in found_device.items() if original_device[key] != value}
+                            with store_lock:
+                                if reloaded_since(reloads_seen):
+                                    print("Someone else's changes were merged in while you were editing, so nothing was changed. Please try again.")
+                                    return False
+                                network_devices.update(found_row_id, changed_fields)
                             print(f"Changes for {found_device['hostname']} confirmed and will be saved.")
                             returned_changes_saved = True # tell the main program to save
                         else:
@@ -373,7 +3027,7 @@ def update_device():
 
                 elif device_detail_choice == "6": # Discard Changes and Go Back
                     print("All changes discarded. Going back to main menu.")
-                    # changes in memory are ignored because returned_changes_saved is still False
+                    # the edits only ever touched our copy, so the store is left exactly as it was
                     break # exit this sub-menu
 
                 else:
@@ -383,6 +3037,7 @@ def update_device():
 
         else: # if the device wasn't found by hostname
             print(f"Device '{device_update_hostname}' not found. Try again.")
+            print_hostname_suggestions(device_update_hostname)
 
     print("--- Update Finished ---")
     return returned_changes_saved # tell main program whether to save or not
@@ -398,17 +3053,11 @@ def delete_device():
             print("Deletion cancelled. Going back to main menu.")
             return # exit the function
 
-        device_found = False # flag to track if we found it
-        index_to_delete = -1 # where the device is in our list
+        reloads_seen = inventory_reloads # a background save merging in someone else's changes would renumber the rows
+        row_id_to_delete = network_devices.find_by_hostname(hostname_to_delete) # index lookup, None if missing
 
-        for index, device_dict in enumerate(network_devices): # loop to find the device
-            if device_dict['hostname'].lower() == hostname_to_delete.lower():
-                device_found = True
-                index_to_delete = index # save its position
-                break # found it, stop looping
-
-        if device_found: # if we found the device
-            found_device = network_devices[index_to_delete] # get the actual device dictionary
+        if row_id_to_delete is not None: # if we found the device
+            found_device = network_devices.get(row_id_to_delete) # get the actual device dictionary
             print(f"\n--- Found Device: {found_device['hostname']} ---")
             print("Current details:")
             print(f"  Vendor: {found_device['vendor']}")
@@ -419,18 +3068,187 @@ def delete_device():
             confirmation = input(f"Really delete '{found_device['hostname']}' (IP: {found_device['ip_address']})? (yes/no): ").strip().lower()
 
             if confirmation == 'yes': # if user says yes
-                del network_devices[index_to_delete] # remove it from the list
-                print(f"Device '{found_device['hostname']}' successfully deleted.")
+                deleted_host_name = found_device['hostname'] # grab it now, the row view is empty once it's deleted
+                with store_lock:
+                    if reloaded_since(reloads_seen):
+                        print("Someone else's changes were merged in while you were deciding, so nothing was deleted. Please try again.")
+                        return
+                    network_devices.delete(row_id_to_delete) # remove it from the store and its indexes
+                print(f"Device '{deleted_host_name}' successfully deleted.")
                 break # exit the main delete loop
             else: # if user says no
                 print("Deletion cancelled by user.")
                 break # exit the main delete loop
         else: # if device not found
             print(f"Device with Host Name '{hostname_to_delete}' not found. Try again.")
+            print_hostname_suggestions(hostname_to_delete)
 
     print("--- Delete Finished ---")
 
+# --- Bulk Update / Delete ---
+# Changes (or deletes) every device matching some conditions in one go, e.g.
+# every Cisco box on OS 15.* gets os_version 17.9.4. The matching devices are
+# found in one pass, every change is checked before anything is touched, and
+# the lot is saved once.
+BULK_PREVIEW_SHOWN = 10 # matching hostnames listed before asking "are you sure?"
+
+def select_bulk_targets(vendor=None, os_pattern=None, ip_prefix=None):
+    """Row ids of the devices matching every condition given. At least one condition is needed."""
+    if not (vendor or os_pattern or ip_prefix):
+        raise ValueError("Give at least one condition (vendor, OS version pattern or IP prefix), "
+                         "a bulk change to every device is too easy to do by accident.")
+    return select_devices(vendor=vendor, ip_prefix=ip_prefix, os_pattern=os_pattern)
+
+def plan_bulk_update(row_ids, assignments):
+    """
+    Works out what setting 'assignments' ({field name: new value}) on every
+    row would change, without changing anything. A value can use {hostname},
+    {vendor}, {os_version} or {ip_address} for the device's current one, e.g.
+    hostname='{hostname}-old'.
+
+    Returns ({row id: the fields that really change}, [problems]). Any problem
+    (an empty value, a bad IP, a hostname or IP some other device has or
+    would get) means the update mustn't go ahead.
+    """
+    changes_by_row = {}
+    problems = []
+    new_host_keys = set() # hostnames / IPs handed out by this batch so far
+    new_ip_numbers = set()
+    hostname_index, ip_index = network_devices.hostname_index, network_devices.ip_index
+    for row_id in row_ids:
+        current_details = network_devices.get(row_id).to_dict()
+        new_values = {}
+        for field_name, new_value in assignments.items():
+            try:
+                new_value = new_value.format_map(current_details).strip()
+            except (KeyError, ValueError, IndexError) as e: # same template for every row, so stop right away
+                raise ValueError(f"Can't fill in '{new_value}' ({e}). Use {{{{ and }}}} for a plain {{ or }}.") from None
+            if not new_value:
+                problems.append(f"{current_details['hostname']}: {field_name} would be empty")
+                continue
+            if field_name == 'ip_address':
+                try:
+                    new_value = int_to_ip(ip_to_int(new_value))
+                except ValueError as e:
+                    problems.append(f"{current_details['hostname']}: invalid IP address {new_value} ({e})")
+                    continue
+            if new_value != current_details[field_name]:
+                new_values[field_name] = new_value
+        if 'hostname' in new_values:
+            new_host_key = fold_hostname(new_values['hostname'])
+            if hostname_index.get(new_host_key, row_id) != row_id or new_host_key in new_host_keys:
+                problems.append(f"{current_details['hostname']}: Host Name '{new_values['hostname']}' is already taken")
+            new_host_keys.add(new_host_key)
+        if 'ip_address' in new_values:
+            new_ip_number = ip_to_int(new_values['ip_address'])
+            if ip_index.get(new_ip_number, row_id) != row_id or new_ip_number in new_ip_numbers:
+                problems.append(f"{current_details['hostname']}: IP address {new_values['ip_address']} is already taken")
+            new_ip_numbers.add(new_ip_number)
+        if new_values:
+            changes_by_row[row_id] = new_values
+    return changes_by_row, problems
+
+def bulk_update_or_delete():
+    """
+    Asks for conditions and what to do with the matching devices, shows how
+    many match, and does it after one confirmation. The caller saves.
+    """
+    print("\n--- Bulk Update / Delete ---")
+    print("Pick the devices (leave a line empty to not use that condition).")
+    vendor = input("Vendor (e.g., Cisco): ").strip()
+    os_pattern = input("OS Version, * and ? work as wildcards (e.g., 15.*): ").strip()
+    ip_prefix = input("Subnet or IP prefix (e.g., 10.20.0.0/16 or 10.20): ").strip()
+    reloads_seen = inventory_reloads # a background save merging in someone else's changes would renumber the rows
+    try:
+        row_ids = select_bulk_targets(vendor, os_pattern, ip_prefix)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    if not row_ids:
+        print("No devices match. Nothing to do.")
+        return
+    hostnames = network_devices.hostnames
+    print(f"\n{len(row_ids)} device(s) match, e.g. {', '.join(hostnames[row_id] for row_id in row_ids[:BULK_PREVIEW_SHOWN])}"
+          f"{' ...' if len(row_ids) > BULK_PREVIEW_SHOWN else ''}")
+
+    action = input("\n1. Update them\n2. Delete them\n3. Cancel\nEnter your choice (1/2/3): ").strip()
+    if action == '1':
+        print("New values (leave empty to keep). {hostname}, {vendor}, {os_version} and {ip_address} stand for a device's current ones.")
+        assignments = {}
+        for field_name, label in (('vendor', 'Vendor'), ('os_version', 'OS Version'), ('hostname', 'Host Name'), ('ip_address', 'IP Address')):
+            new_value = input(f"New {label}: ").strip()
+            if new_value:
+                assignments[field_name] = new_value
+        if not assignments:
+            print("Nothing to change. Cancelled.")
+            return
+        try:
+            changes_by_row, problems = plan_bulk_update(row_ids, assignments)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if problems:
+            print(f"Can't do it, {len(problems)} problem(s):")
+            for problem in problems[:BULK_PREVIEW_SHOWN]:
+                print(f"  {problem}")
+            print("Nothing was changed.")
+            return
+        if not changes_by_row:
+            print("Those devices already have those values. Nothing to change.")
+            return
+        if input(f"Change {len(changes_by_row)} device(s)? (yes/no): ").strip().lower() != 'yes':
+            print("Bulk update cancelled.")
+            return
+        with store_lock:
+            if reloaded_since(reloads_seen):
+                print("Someone else's changes were merged in meanwhile, so nothing was changed. Please try again.")
+                return
+            network_devices.update_many(changes_by_row)
+        print(f"Updated {len(changes_by_row)} device(s).")
+    elif action == '2':
+        if input(f"Delete {len(row_ids)} device(s)? This can't be undone. (yes/no): ").strip().lower() != 'yes':
+            print("Bulk delete cancelled.")
+            return
+        with store_lock:
+            if reloaded_since(reloads_seen):
+                print("Someone else's changes were merged in meanwhile, so nothing was deleted. Please try again.")
+                return
+            network_devices.delete_many(row_ids)
+        print(f"Deleted {len(row_ids)} device(s).")
+    else:
+        print("Cancelled. Going back to main menu.")
+
+# --- Device History Function ---
+def describe_change(change):
+    """One line saying what a history record did."""
+    if change['op'] in ('add', 'start'):
+        device_details = change['device']
+        return (f"{'added' if change['op'] == 'add' else 'already there:'} {device_details['hostname']} "
+                f"({device_details['vendor']} {device_details['os_version']}, {device_details['ip_address']})")
+    if change['op'] == 'update':
+        return f"changed {change['hostname']}: " + ', '.join(f"{field_name} -> {value}" for field_name, value in change['changes'].items())
+    return f"deleted {change['hostname']}"
+
+def show_device_history():
+    """Asks for a hostname and prints every change recorded for that device."""
+    print("\n--- Device History ---")
+    host_name = input("Enter the Host Name (or 'cancel'): ").strip()
+    if not host_name or host_name.lower() == 'cancel':
+        print("Cancelled. Going back to main menu.")
+        return
+    device_changes = device_history(host_name)
+    if not device_changes:
+        print(f"No changes recorded for '{host_name}'.")
+        print_hostname_suggestions(host_name)
+        return
+    for change in device_changes:
+        print(f"  version {change['version']:<8} {change['time']}  {describe_change(change)}")
+    print("-------------------------------------------")
+
 # --- Generate Reports Function ---
+TOP_SUBNETS_SHOWN = 20 # a big network has thousands of /24s, the report only lists the busiest ones
+
+@instrumented('report')
 def generate_reports():
     """Generates simple statistics about the inventory."""
     print("\n--- Network Device Inventory Reports ---")
@@ -439,14 +3257,16 @@ def generate_reports():
         print("Inventory is empty. No reports to make.")
         return
 
+    # the store keeps these counts up to date as devices change, so this is quick however big the inventory is
+    report_counts = network_devices.report_counts()
+
     # 1. Total devices
     total_devices = len(network_devices)
     print(f"\nTotal number of devices: {total_devices}")
 
     # 2. Devices grouped by Vendor
     print("\n--- Devices by Vendor ---")
-    vendors = [device['vendor'] for device in network_devices] # get all vendor names
-    vendor_counts = Counter(vendors) # count how many of each vendor
+    vendor_counts = report_counts["vendor"] # how many of each vendor
     if vendor_counts:
         for vendor, count in vendor_counts.most_common(): # print them from most to least common
             print(f"- {vendor}: {count} device(s)")
@@ -456,61 +3276,1004 @@ def generate_reports():
 
     # 3. Devices grouped by OS Version
     print("\n--- Devices by OS Version ---")
-    os_versions = [device['os_version'] for device in network_devices] # get all OS versions
-    os_version_counts = Counter(os_versions) # count how many of each OS
+    os_version_counts = report_counts["os_version"] # how many of each OS
     if os_version_counts:
         for os_version, count in os_version_counts.most_common(): # print them from most to least common
             print(f"- {os_version}: {count} device(s)")
     else:
         print("No OS version data.")
 
+    # 4. Devices grouped by Vendor and OS Version together
+    print("\n--- Devices by Vendor and OS Version ---")
+    for vendor, os_version in sorted(report_counts["vendor_os"]): # alphabetical, so each vendor's versions sit together
+        print(f"- {vendor} / {os_version}: {report_counts['vendor_os'][(vendor, os_version)]} device(s)")
+
+    # 5. Devices per /24 subnet
+    subnet_counts = report_counts["subnet_24"]
+    print(f"\n--- Busiest /24 Subnets ({len(subnet_counts)} in use) ---")
+    for subnet, count in subnet_counts.most_common(TOP_SUBNETS_SHOWN):
+        print(f"- {subnet}: {count} device(s)")
+
     print("\n--- End of Reports ---")
 
+def check_report_consistency():
+    """
+    Recounts every report number from scratch and compares it with the counts
+    the store keeps up to date. Returns True if they all match.
+    """
+    kept_counts = network_devices.report_counts()
+    fresh_counts = network_devices.recount_from_scratch()
+    all_match = True
+    for report_name, fresh_counter in fresh_counts.items():
+        if kept_counts[report_name] != fresh_counter:
+            all_match = False
+            mismatched_keys = set(kept_counts[report_name]) ^ set(fresh_counter) | \
+                {key for key in fresh_counter if kept_counts[report_name][key] != fresh_counter[key]}
+            print(f"Report '{report_name}' is out of step for: {sorted(map(str, mismatched_keys))[:10]}")
+    if all_match:
+        print("All report counts match a full recount.")
+    return all_match
+
+# --- Reachability Sweep ---
+# Checks every device with a plain TCP connect, lots of them at once.
+# 'reachable' means something answered on the port; a refused or timed out
+# connect counts as not reachable. 'last_seen' only moves when it answers.
+SWEEP_PORT = 22 # SSH, most network gear listens there
+SWEEP_TIMEOUT = 0.5 # seconds to wait for each device
+SWEEP_CONCURRENCY = 1000 # how many connects can be waiting at the same time
+
+def raise_open_file_limit(wanted):
+    """Asks for enough file handles to keep 'wanted' sockets open. Returns how many we can really use."""
+    try:
+        import resource # not on Windows
+    except ImportError:
+        return wanted
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = wanted + 64 # leave some for the data files, stdin/stdout and so on
+    if soft_limit != resource.RLIM_INFINITY and soft_limit < needed:
+        new_limit = needed if hard_limit == resource.RLIM_INFINITY else min(needed, hard_limit)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_limit, hard_limit))
+            soft_limit = new_limit
+        except (ValueError, OSError):
+            pass # stuck with what we've got
+        return max(1, min(wanted, soft_limit - 64))
+    return wanted
+
+def sweep_devices(port=SWEEP_PORT, timeout=SWEEP_TIMEOUT, concurrency=SWEEP_CONCURRENCY):
+    """
+    Tries a TCP connect to every device and records the result on it.
+
+    Saves once at the end. Returns (checked, reachable, seconds taken).
+    """
+    import asyncio # only the sweep needs these
+    import socket
+
+    async def check_device(loop, ip_address):
+        """One connect attempt. Returns (reachable, latency in ms)."""
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        connection.setblocking(False)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(loop.sock_connect(connection, (ip_address, port)), timeout)
+            return True, (time.perf_counter() - started) * 1000
+        except (OSError, asyncio.TimeoutError): # refused, unreachable network, too slow...
+            return False, -1.0
+        finally:
+            connection.close()
+
+    async def sweep_worker(loop, rows_to_check, results):
+        for row_id in rows_to_check: # all the workers share one iterator, so each row is checked once
+            results[row_id] = await check_device(loop, int_to_ip(swept_ips[row_id]))
+
+    async def run_sweep(worker_count):
+        loop = asyncio.get_running_loop()
+        rows_to_check = iter(list(network_devices.row_ids()))
+        results = {}
+        await asyncio.gather(*(sweep_worker(loop, rows_to_check, results) for _ in range(worker_count)))
+        return results
+
+    started = time.perf_counter()
+    reloads_seen = inventory_reloads
+    swept_hostnames, swept_ips = network_devices.hostnames, network_devices.ips # a reload swaps in new columns, these stay as they were
+    worker_count = max(1, min(raise_open_file_limit(concurrency), len(network_devices)))
+    results = asyncio.run(run_sweep(worker_count))
+    checked_at = time.time()
+    with store_lock:
+        if reloaded_since(reloads_seen): # someone else's changes were merged in meanwhile, find the devices again by hostname
+            results = {network_devices.find_by_hostname(swept_hostnames[row_id]): result for row_id, result in results.items()}
+            results.pop(None, None) # deleted since
+        for row_id, (reachable, latency_ms) in results.items():
+            network_devices.set_status(row_id, reachable, latency_ms, checked_at)
+    if results:
+        save_devices(force_compact=True) # status isn't journaled, so it goes straight into a fresh snapshot
+    reachable_count = sum(reachable for reachable, _ in results.values())
+    return len(results), reachable_count, time.perf_counter() - started
+
+def sweep_devices_interactively():
+    """Asks for the port and timeout, then runs the sweep."""
+    print("\n--- Reachability Sweep ---")
+    if not network_devices:
+        print("The inventory is empty. No devices to check.")
+        return
+    try:
+        port_text = input(f"Port to check (press Enter for {SWEEP_PORT}): ").strip()
+        port = int(port_text) if port_text else SWEEP_PORT
+        timeout_text = input(f"Seconds to wait per device (press Enter for {SWEEP_TIMEOUT}): ").strip()
+        timeout = float(timeout_text) if timeout_text else SWEEP_TIMEOUT
+    except ValueError:
+        print("That's not a number. Sweep cancelled.")
+        return
+    if not 1 <= port <= 65535 or timeout <= 0:
+        print("Port must be 1-65535 and the timeout more than 0. Sweep cancelled.")
+        return
+    print(f"Checking {len(network_devices)} devices on port {port}...")
+    checked_count, reachable_count, seconds_taken = sweep_devices(port, timeout)
+    print(f"Done in {seconds_taken:.1f}s: {reachable_count} of {checked_count} devices reachable.")
+
+# --- Background Autosave ---
+# The menu doesn't wait for the disk after each edit: it just asks for a save,
+# and a background thread does it once things have been quiet for a moment.
+# A burst of edits ends up in one save, and an exit always writes what's left.
+AUTOSAVE_DELAY = 1.0 # seconds without a new edit before saving
+AUTOSAVE_MAX_DELAY = 10.0 # ...but never keep an edit waiting longer than this
+
+class Autosaver:
+    """
+    Runs save_devices() on a background thread, a little after the last
+    request() (debounced). flush() saves right away, stop() saves whatever is
+    still waiting and ends the thread.
+    """
+    def __init__(self, delay=AUTOSAVE_DELAY, max_delay=AUTOSAVE_MAX_DELAY):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.wake_up = threading.Condition()
+        self.first_request_at = None # when the oldest unsaved request came in (None = nothing waiting)
+        self.last_request_at = None
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name='inventory-autosave', daemon=True)
+        self.thread.start()
+
+    def request(self):
+        """Asks for a save soon. Does nothing if nothing has changed (e.g. the edit was cancelled)."""
+        if not network_devices.pending_changes:
+            return
+        with self.wake_up:
+            now = time.monotonic()
+            self.first_request_at = self.first_request_at or now
+            self.last_request_at = now
+            self.wake_up.notify()
+
+    def save_due_at(self):
+        return min(self.last_request_at + self.delay, self.first_request_at + self.max_delay)
+
+    def run(self):
+        while True:
+            with self.wake_up:
+                while not self.stopping and (self.first_request_at is None or time.monotonic() < self.save_due_at()):
+                    self.wake_up.wait(None if self.first_request_at is None else self.save_due_at() - time.monotonic())
+                if self.stopping:
+                    return
+                self.first_request_at = self.last_request_at = None
+            save_devices(quiet=True) # errors still get printed, and the changes stay pending for the next try
+
+    def flush(self):
+        """Saves everything pending right now, on this thread."""
+        with self.wake_up:
+            self.first_request_at = self.last_request_at = None
+        save_devices()
+
+    def stop(self):
+        with self.wake_up:
+            self.stopping = True
+            self.wake_up.notify()
+        self.thread.join() # lets a save that's already running finish
+        self.flush()
+
 # --- Main Program Logic ---
 def main_program():
     """The main loop for our inventory management application."""
     load_devices() # load any saved devices when the program starts
+    autosaver = Autosaver() # edits get saved in the background, so the menu never waits for the disk
 
-    while True: # keep showing the menu until user quits
-        print("\nWelcome, what would you like to do today?\n")
-        print("------------------------------------------------------------------------------------")
-        print("1. Add New Device")
-        print("2. Display All Devices")
-        print("3. Display Specific Device")
-        print("4. Update Device")
-        print("5. Delete Device")
-        print("6. Generate Reports")
-        print("7. Exit")
-        choice = input("\nEnter your choice (1/2/3/4/5/6/7): ").strip() # get user's choice
-
-        if choice == "1":
-            print("\nAdding a new device...\n")
-            add_new_device() # call the add function
-            save_devices() # save after adding (or cancelling add)
-        elif choice == "2":
-            print("\nDisplaying all devices...\n")
-            display_all_devices() # call the display all function
-        elif choice == "3":
-            print("\nDisplaying a specific device...\n")
-            display_specific_device() # call the display specific function
-        elif choice == "4":
-            print("\nUpdating a device...\n")
-            if update_device(): # call update, if it returns True (changes saved)
-                save_devices() # then save the changes
-        elif choice == "5":
-            print("\nDeleting a device...\n")
-            delete_device() # call the delete function
-            save_devices() # save after deleting (or cancelling delete)
-        elif choice == "6":
-            print("\nGenerating reports...\n")
-            generate_reports() # call the reports function
-        elif choice == "7":
-            print("\nExiting the program. Goodbye!\n")
-            save_devices() # save one last time before closing
-            break # exit the main loop
-        else:
-            print("Invalid choice. Please enter a number between 1 and 7.")
+    try:
+        while True: # keep showing the menu until user quits
+            if refresh_devices(): # someone else (another menu, a script, the service) saved changes meanwhile
+                print(f"\n(Picked up changes saved by someone else, there are now {len(network_devices)} devices.)")
+            print("\nWelcome, what would you like to do today?\n")
+            print("------------------------------------------------------------------------------------")
+            print("1. Add New Device")
+            print("2. Display All Devices")
+            print("3. Display Specific Device")
+            print("4. Update Device")
+            print("5. Delete Device")
+            print("6. Generate Reports")
+            print("7. Exit")
+            print("8. Import Devices (CSV/JSONL)")
+            print("9. Reachability Sweep")
+            print("10. Device History")
+            print("11. Bulk Update / Delete")
+            print("12. Reconcile With a Discovery Scan")
+            choice = input("\nEnter your choice (1-12): ").strip() # get user's choice
+
+            if choice == "1":
+                print("\nAdding a new device...\n")
+                add_new_device() # call the add function
+                autosaver.request() # journal the new device soon (nothing happens if the add was cancelled)
+            elif choice == "2":
+                print("\nDisplaying all devices...\n")
+                display_all_devices() # call the display all function
+            elif choice == "3":
+                print("\nDisplaying a specific device...\n")
+                display_specific_device() # call the display specific function
+            elif choice == "4":
+                print("\nUpdating a device...\n")
+                if update_device(): # call update, if it returns True (changes saved)
+                    autosaver.request() # then save the changes
+            elif choice == "5":
+                print("\nDeleting a device...\n")
+                delete_device() # call the delete function
+                autosaver.request() # journal the delete soon (nothing happens if it was cancelled)
+            elif choice == "6":
+                print("\nGenerating reports...\n")
+                generate_reports() # call the reports function
+            elif choice == "7":
+                print("\nExiting the program. Goodbye!\n")
+                break # exit the main loop (the finally below saves one last time)
+            elif choice == "8":
+                print("\nImporting devices...\n")
+                import_devices_from_file() # saves once by itself when it's done
+            elif choice == "9":
+                sweep_devices_interactively() # saves once by itself when it's done
+            elif choice == "10":
+                show_device_history()
+            elif choice == "11":
+                bulk_update_or_delete()
+                autosaver.request() # one save for the whole batch
+            elif choice == "12":
+                reconcile_interactively() # saves once by itself if anything gets applied
+            else:
+                print("Invalid choice. Please enter a number between 1 and 12.")
+    finally:
+        autosaver.stop() # however we leave (Exit, Ctrl+C, end of input), write everything still waiting
+
+# --- Command Line Interface ---
+# Running the script with a command (e.g. 'get --hostname r1') does that one
+# thing, prints the answer as JSON and exits. Running it with no command
+# starts the interactive menu like before.
+#
+# Exit codes: 0 = worked, 1 = device not found, 2 = bad input (invalid IP,
+# duplicate hostname, ...), 3 = someone else changed the same device at the same
+# time, so nothing was saved (run it again). Chatty messages go to stderr so
+# stdout is pure JSON.
+
+class CommandError(Exception):
+    """A command couldn't do what it was asked. Carries the exit code to use."""
+    def __init__(self, message, exit_code=2):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+def quick_find_device(host_name=None, ip_address_string=None):
+    """
+    Tries to answer a single lookup from the binary snapshot (or the SQLite
+    database) without loading the whole inventory. Returns (True, device dict or None) if it could, or
+    (False, None) if we need a full load (no current binary snapshot, or the
+    journal has changes touching this device).
+    """
+    ip_number = ip_to_int(ip_address_string) if ip_address_string is not None else None
+    if uses_sqlite(): # an indexed query answers it straight away
+        return True, find_in_database(host_name, ip_number)
+    if not binary_snapshot_is_current():
+        return False, None
+    touched_hostnames = set() # every hostname the journal mentions, case-folded
+    touched_ips = set() # every IP number the journal mentions
+    for change in read_journal():
+        details = change.get('device') or change.get('changes') or {}
+        if 'hostname' in change:
+            touched_hostnames.add(str(change['hostname']).casefold())
+        if 'hostname' in details:
+            touched_hostnames.add(str(details['hostname']).casefold())
+        if 'ip_address' in details:
+            try:
+                touched_ips.add(ip_to_int(str(details['ip_address'])))
+            except ValueError:
+                pass
+    if (host_name is not None and host_name.casefold() in touched_hostnames) or ip_number in touched_ips:
+        return False, None
+    try:
+        device_details = find_in_binary_snapshot(BINARY_FILE, host_name, ip_number)
+    except (ValueError, IndexError, struct.error, UnicodeDecodeError):
+        return False, None # something's off with the file, let the full load deal with it
+    if device_details and device_details['hostname'].casefold() in touched_hostnames:
+        return False, None # found by IP, but the journal changed it since
+    return True, device_details
+
+@instrumented('duplicate_check')
+def check_device_details(device_details, current_row_id=None):
+    """
+    Checks a full set of device fields the way the prompts do (nothing empty,
+    valid IP, hostname and IP not used by another device). Returns the details
+    with the IP tidied up, or raises CommandError.
+    """
+    for field_name in DEVICE_FIELDS:
+        if not device_details.get(field_name, '').strip():
+            raise CommandError(f"'{field_name}' cannot be empty.")
+        device_details[field_name] = device_details[field_name].strip()
+    try:
+        device_details['ip_address'] = int_to_ip(ip_to_int(device_details['ip_address']))
+    except ValueError as e:
+        raise CommandError(f"Invalid IP address: {e}") from None
+    owner_row_id = network_devices.find_by_hostname(device_details['hostname'])
+    if owner_row_id is not None and owner_row_id != current_row_id:
+        raise CommandError(f"Host Name '{device_details['hostname']}' already exists.")
+    owner_row_id = network_devices.find_by_ip(device_details['ip_address'])
+    if owner_row_id is not None and owner_row_id != current_row_id:
+        raise CommandError(f"IP address {device_details['ip_address']} is already used by '{network_devices.get(owner_row_id)['hostname']}'.")
+    return device_details
+
+def find_row_or_fail(host_name):
+    """Returns the row id for a hostname, or raises a 'not found' CommandError."""
+    row_id = network_devices.find_by_hostname(host_name)
+    if row_id is None:
+        raise CommandError(f"Device with Host Name '{host_name}' not found.", exit_code=1)
+    return row_id
+
+# These work on the devices already in the store, so the commands (which load
+# first) and the HTTP service (which loads once) can share them.
+def find_device_details(host_name=None, ip_address_string=None):
+    """Returns the dict of the device with this hostname (or IP), or raises a 'not found' CommandError."""
+    row_id = network_devices.find_by_hostname(host_name) if host_name is not None else network_devices.find_by_ip(ip_address_string)
+    if row_id is None:
+        raise device_not_found(host_name, ip_address_string)
+    return network_devices.get(row_id).to_dict()
+
+def device_not_found(host_name=None, ip_address_string=None):
+    return CommandError(f"Device with {'Host Name' if host_name is not None else 'IP Address'} "
+                        f"'{host_name if host_name is not None else ip_address_string}' not found.", exit_code=1)
+
+def save_or_fail():
+    """Saves, raising CommandError (exit code 3) if any change clashed with one someone else saved first."""
+    dropped_changes = save_devices()
+    if len(dropped_changes) == 1:
+        raise CommandError("Someone else changed the same device (or took its hostname / IP) at the same time, "
+                           "so this change wasn't saved. Try again.", exit_code=3)
+    if dropped_changes:
+        raise CommandError(f"Someone else changed some of the same devices at the same time, so {len(dropped_changes)} "
+                           "of the changes weren't saved (the rest were). Try again.", exit_code=3)
+
+# The change helpers below hold store_lock just while they check and change
+# the store, and save after letting go of it, so the HTTP service's readers
+# only wait for the change, not for the disk.
+
+def add_device_details(device_details):
+    """Checks and adds one device, then saves. Returns the command's answer."""
+    with store_lock:
+        device_details = check_device_details({field_name: device_details.get(field_name) or '' for field_name in DEVICE_FIELDS})
+        network_devices.add(device_details)
+    save_or_fail()
+    return {"added": device_details}
+
+def update_device_details(host_name, new_values):
+    """Changes the given fields of one device (None means leave it), then saves. Returns the command's answer."""
+    with store_lock:
+        row_id = find_row_or_fail(host_name)
+        original_details = network_devices.get(row_id).to_dict()
+        new_details = {field_name: original_details[field_name] for field_name in DEVICE_FIELDS}
+        for field_name in DEVICE_FIELDS:
+            if new_values.get(field_name) is not None:
+                new_details[field_name] = new_values[field_name]
+        check_device_details(new_details, current_row_id=row_id)
+        changed_fields = {key: value for key, value in new_details.items() if original_details[key] != value}
+        if changed_fields:
+            network_devices.update(row_id, changed_fields)
+    if changed_fields:
+        save_or_fail()
+    return {"updated": new_details, "changed": sorted(changed_fields)}
+
+def delete_device_details(host_name):
+    """Deletes one device, then saves. Returns the command's answer."""
+    with store_lock:
+        row_id = find_row_or_fail(host_name)
+        deleted_details = network_devices.get(row_id).to_dict()
+        network_devices.delete(row_id)
+    save_or_fail()
+    return {"deleted": deleted_details}
+
+def list_device_page(vendor=None, os_version=None, ip_prefix=None, sort_by=None, offset=0, limit=None):
+    """Filters, sorts and pages the devices. Returns (how many matched, the page's row ids)."""
+    if offset < 0 or (limit is not None and limit < 0):
+        raise CommandError("offset and limit can't be negative")
+    try:
+        selected_rows = select_devices(vendor, os_version, ip_prefix, sort_by)
+    except ValueError as e: # bad IP prefix
+        raise CommandError(str(e))
+    return len(selected_rows), selected_rows[offset:None if limit is None else offset + limit]
+
+def bulk_change_details(vendor=None, os_pattern=None, ip_prefix=None, assignments=None, apply=False):
+    """
+    Bulk update (assignments given) or bulk delete (no assignments) of the
+    devices matching the conditions, saved once. Without 'apply' it's a dry
+    run that only counts. Returns the command's answer.
+    """
+    with store_lock:
+        try:
+            row_ids = select_bulk_targets(vendor, os_pattern, ip_prefix)
+            changes_by_row, problems = plan_bulk_update(row_ids, assignments) if assignments else ({}, [])
+        except ValueError as e: # no conditions, a bad IP prefix or a bad {field} in a value
+            raise CommandError(str(e))
+        result = {"matched": len(row_ids), "sample": [network_devices.hostnames[row_id] for row_id in row_ids[:BULK_PREVIEW_SHOWN]],
+                  "applied": apply}
+        if problems:
+            raise CommandError(f"{len(problems)} problem(s), nothing was changed: {'; '.join(problems[:BULK_PREVIEW_SHOWN])}")
+        changed = apply and (changes_by_row if assignments else row_ids)
+        if changed and assignments:
+            network_devices.update_many(changes_by_row)
+        elif changed:
+            network_devices.delete_many(row_ids)
+    if changed:
+        save_or_fail()
+    if assignments:
+        result["updated" if apply else "would_update"] = len(changes_by_row)
+    else:
+        result["deleted" if apply else "would_delete"] = len(row_ids)
+    return result
+
+def build_report(report_counts):
+    """Turns report_counts() style counters into the report command's answer."""
+    return {
+        "total": sum(report_counts["vendor"].values()),
+        "vendor": dict(report_counts["vendor"].most_common()),
+        "os_version": dict(report_counts["os_version"].most_common()),
+        "vendor_os": [{"vendor": vendor, "os_version": os_version, "count": count}
+                      for (vendor, os_version), count in sorted(report_counts["vendor_os"].items())],
+        "subnet_24": dict(report_counts["subnet_24"].most_common()),
+    }
+
+def command_add(args):
+    load_devices()
+    return add_device_details({"hostname": args.hostname, "vendor": args.vendor,
+                               "os_version": args.os_version, "ip_address": args.ip})
+
+def command_get(args):
+    answered, device_details = quick_find_device(args.hostname, args.ip)
+    if not answered: # the quick way couldn't tell, do it properly
+        load_devices()
+        device_details = find_device_details(args.hostname, args.ip)
+    elif device_details is None:
+        raise device_not_found(args.hostname, args.ip)
+    return {"device": device_details}
+
+def command_update(args):
+    load_devices()
+    return update_device_details(args.target, {"hostname": args.hostname, "vendor": args.vendor,
+                                               "os_version": args.os_version, "ip_address": args.ip})
+
+def command_delete(args):
+    load_devices()
+    return delete_device_details(args.target)
+
+def command_list(args):
+    if uses_sqlite(): # let the database filter, sort and page, and only load the page
+        if args.offset < 0 or (args.limit is not None and args.limit < 0):
+            raise CommandError("offset and limit can't be negative")
+        try:
+            matched_count, page_rows = select_from_database(args.vendor, args.os_version, args.ip_prefix,
+                                                            args.sort, args.offset, args.limit)
+        except ValueError as e: # bad IP prefix
+            raise CommandError(str(e))
+    else:
+        load_devices()
+        matched_count, page_rows = list_device_page(args.vendor, args.os_version, args.ip_prefix,
+                                                    args.sort, args.offset, args.limit)
+    if args.format != 'json': # the other layouts aren't JSON, so they go straight to the real stdout
+        write_device_list(page_rows, args.format, args.output, first_number=args.offset + 1)
+        return None
+    return {"matched": matched_count, "devices": [DeviceRow(network_devices, row_id).to_dict() for row_id in page_rows]}
+
+BULK_SET_FIELDS = {'hostname': 'hostname', 'vendor': 'vendor', 'os_version': 'os_version', 'os-version': 'os_version',
+                   'ip': 'ip_address', 'ip_address': 'ip_address'} # what --set FIELD=VALUE accepts
+
+def command_bulk_update(args):
+    assignments = {}
+    for assignment in args.set:
+        field_name, equals_sign, new_value = assignment.partition('=')
+        if not equals_sign or field_name.strip() not in BULK_SET_FIELDS:
+            raise CommandError(f"--set wants FIELD=VALUE with FIELD one of hostname, vendor, os_version, ip (got '{assignment}')")
+        assignments[BULK_SET_FIELDS[field_name.strip()]] = new_value
+    load_devices()
+    return bulk_change_details(args.vendor, args.os_pattern, args.ip_prefix, assignments, apply=args.yes)
+
+def command_bulk_delete(args):
+    load_devices()
+    return bulk_change_details(args.vendor, args.os_pattern, args.ip_prefix, apply=args.yes)
+
+def command_search(args):
+    if args.limit < 1:
+        raise CommandError("limit must be at least 1")
+    load_devices()
+    return {"matches": [dict(DeviceRow(network_devices, row_id).to_dict(), match=how_it_matched)
+                        for row_id, how_it_matched in network_devices.search_hostnames(args.text, args.limit)]}
+
+def command_report(args):
+    if uses_sqlite() and not args.verify: # GROUP BYs in the database, no need to load anything
+        return build_report(report_from_database())
+    load_devices()
+    result = build_report(network_devices.report_counts())
+    if args.verify:
+        result["consistent"] = check_report_consistency()
+    return result
+
+def command_import(args):
+    load_devices()
+    try:
+        added_count, rejected_count, clashed_count = import_devices(args.file, args.report)
+    except OSError as e:
+        raise CommandError(f"Couldn't read {args.file}: {e}") from None
+    return {"added": added_count, "rejected": rejected_count, "clashed": clashed_count,
+            "report": (args.report or args.file + '.rejected.csv') if rejected_count else None}
+
+def command_reconcile(args):
+    try:
+        categories = parse_reconcile_categories(args.apply) if args.apply else ()
+    except ValueError as e:
+        raise CommandError(str(e))
+    load_devices()
+    report_path = args.report or args.file + '.reconcile.jsonl'
+    try:
+        counts = reconcile_scan(args.file, report_path)
+    except OSError as e:
+        raise CommandError(f"Couldn't read {args.file}: {e}") from None
+    result = {**counts, "report": report_path}
+    if categories:
+        result["applied"], result["skipped"] = apply_reconcile_report(report_path, categories)
+    return result
+
+def export_devices(file_path, file_format=None):
+    """Writes the whole inventory to a file as json, jsonl, csv or binary (guessed from the extension if not given)."""
+    file_format = file_format or {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv',
+                                  '.bin': 'binary'}.get(os.path.splitext(file_path)[1].lower(), 'json')
+    if file_format == 'binary':
+        write_file_atomically(file_path, encode_binary_snapshot(network_devices))
+    elif file_format in ('csv', 'jsonl'):
+        with open(file_path, 'w', newline='', encoding='utf-8') as f: # newline='' so csv's \r\n goes out untouched
+            write_device_list(select_devices(), file_format, f)
+    else:
+        write_file_atomically(file_path, json.dumps(network_devices.to_list(), separators=(',', ':')))
+    return file_format
+
+def command_export(args):
+    load_devices()
+    file_format = export_devices(args.file, args.format)
+    return {"exported": len(network_devices), "file": args.file, "format": file_format}
+
+def command_sweep(args):
+    if not 1 <= args.port <= 65535 or args.timeout <= 0 or args.concurrency < 1:
+        raise CommandError("port must be 1-65535, timeout more than 0 and concurrency at least 1")
+    load_devices()
+    checked_count, reachable_count, seconds_taken = sweep_devices(args.port, args.timeout, args.concurrency)
+    return {"checked": checked_count, "reachable": reachable_count, "seconds": round(seconds_taken, 2)}
+
+def command_to_sqlite(args):
+    if uses_sqlite():
+        raise CommandError(f"{DATA_FILE} is already a SQLite database.")
+    if os.path.splitext(args.database)[1].lower() not in SQLITE_EXTENSIONS:
+        raise CommandError(f"The database file name has to end in {', '.join(SQLITE_EXTENSIONS)}.")
+    load_devices()
+    return {"migrated": migrate_to_database(args.database), "from": DATA_FILE, "to": args.database}
+
+def command_to_binary(args):
+    if uses_sqlite():
+        raise CommandError("to-binary works on a JSON inventory, not a SQLite one.")
+    load_devices()
+    compact_journal(write_binary=True) # fold the journal in as well, so both snapshots are complete
+    return {"converted": len(network_devices), "from": DATA_FILE, "to": BINARY_FILE}
+
+def command_to_json(args):
+    if uses_sqlite():
+        raise CommandError("to-json works on a JSON inventory, not a SQLite one.")
+    return {"converted": convert_binary_to_json(), "from": BINARY_FILE, "to": DATA_FILE}
+
+def command_history(args):
+    if args.hostname is None: # just say what history there is
+        checkpoints = history_checkpoints()
+        if not checkpoints:
+            raise CommandError(f"There's no change history for {DATA_FILE} yet.", exit_code=1)
+        with open(history_path(checkpoints[0], '.jsonl'), 'r') as f:
+            started_at = json.loads(f.readline())["time"]
+        folder = history_folder()
+        return {"folder": folder, "started": started_at, "first_version": checkpoints[0],
+                "latest_version": latest_history_version(checkpoints), "checkpoints": checkpoints,
+                "bytes": sum(os.path.getsize(os.path.join(folder, file_name)) for file_name in os.listdir(folder))}
+    device_changes = device_history(args.hostname)
+    if not device_changes:
+        raise CommandError(f"No changes recorded for Host Name '{args.hostname}'.", exit_code=1)
+    return {"hostname": args.hostname, "changes": device_changes}
+
+def command_as_of(args):
+    version = parse_history_point(args.when)
+    past_devices = inventory_at(version)
+    if args.hostname is None and args.ip is None:
+        return {"version": version, "devices": past_devices.to_list()}
+    row_id = past_devices.find_by_hostname(args.hostname) if args.hostname is not None else past_devices.find_by_ip(args.ip)
+    if row_id is None:
+        raise CommandError(f"Device with {'Host Name' if args.hostname is not None else 'IP Address'} "
+                           f"'{args.hostname if args.hostname is not None else args.ip}' not found at version {version}.", exit_code=1)
+    return {"version": version, "device": past_devices.get(row_id).to_dict()}
+
+def command_diff(args):
+    old_version = parse_history_point(args.old)
+    new_version = parse_history_point(args.new) if args.new is not None else latest_history_version()
+    return diff_versions(old_version, new_version)
+
+# --- HTTP Service ---
+# 'serve' loads the inventory once and answers lookups, lists and reports over
+# HTTP/JSON on localhost, so other tools don't have to run the script each time:
+#   GET /devices/HOSTNAME, GET /ips/IP, GET /devices?vendor=&os_version=&ip_prefix=&sort=&offset=&limit=
+#   GET /search?q=TEXT&limit=, GET /report, POST /devices (JSON body), PATCH /devices/HOSTNAME (JSON body), DELETE /devices/HOSTNAME
+#   GET /metrics (Prometheus text, when started with --metrics)
+# Reads run on a fixed pool of threads and their answers are cached until the
+# next change. Changes all go through one writer thread, one at a time. Every
+# SERVICE_REFRESH_INTERVAL seconds it also picks up changes other programs saved.
+SERVICE_HOST = '127.0.0.1' # localhost only, there's no login
+SERVICE_PORT = 8080
+SERVICE_THREADS = 16 # requests answered at the same time (each keep-alive connection holds one)
+SERVICE_IDLE_TIMEOUT = 5 # seconds a quiet keep-alive connection may hold on to a thread
+SERVICE_CACHE_SIZE = 10000 # GET answers to remember
+SERVICE_REFRESH_INTERVAL = 1.0 # seconds between checks for changes saved by other programs
+
+class ResponseCache:
+    """
+    Remembers encoded GET answers. invalidate() forgets all of them, and an
+    answer worked out before an invalidate() is never stored after it.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # request path -> (generation, status, body), least recently used first
+        self.generation = 0 # goes up by one on every change to the inventory
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != self.generation:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key, generation, status, body):
+        with self.lock:
+            if generation != self.generation: # the inventory changed while this was being worked out
+                return
+            self.entries[key] = (generation, status, body)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False) # drop the one used longest ago
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+def handle_service_request(method, path, query, body):
+    """
+    Works out the answer to one HTTP request, using the devices in the store.
+    Returns (HTTP status, JSON-able answer).
+    """
+    from urllib.parse import unquote # already loaded by the service, so this is free
+    parts = [unquote(part) for part in path.strip('/').split('/')]
+    try:
+        if method == 'GET' and parts == ['search']:
+            matches = network_devices.search_hostnames(query.get('q', ''), int(query.get('limit', 10)))
+            return 200, {"matches": [dict(DeviceRow(network_devices, row_id).to_dict(), match=how_it_matched)
+                                     for row_id, how_it_matched in matches]}
+        if method == 'GET' and parts == ['report']:
+            return 200, build_report(network_devices.report_counts())
+        if method == 'GET' and parts == ['devices']:
+            limit = query.get('limit')
+            matched_count, page_rows = list_device_page(query.get('vendor'), query.get('os_version'), query.get('ip_prefix'),
+                                                        query.get('sort') if query.get('sort') in SORT_ORDERS else None,
+                                                        int(query.get('offset', 0)), None if limit is None else int(limit))
+            return 200, {"matched": matched_count, "devices": [DeviceRow(network_devices, row_id).to_dict() for row_id in page_rows]}
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'devices':
+            return 200, {"device": find_device_details(host_name=parts[1])}
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'ips':
+            return 200, {"device": find_device_details(ip_address_string=parts[1])}
+        if method == 'POST' and parts == ['devices']:
+            return 201, add_device_details(json.loads(body or b'{}'))
+        if method == 'PATCH' and len(parts) == 2 and parts[0] == 'devices':
+            return 200, update_device_details(parts[1], json.loads(body or b'{}'))
+        if method == 'DELETE' and len(parts) == 2 and parts[0] == 'devices':
+            return 200, delete_device_details(parts[1])
+        return 404, {"error": f"No such endpoint: {method} {path}"}
+    except CommandError as e:
+        return {1: 404, 3: 409}.get(e.exit_code, 400), {"error": str(e)}
+    except (ValueError, TypeError, AttributeError) as e: # bad numbers, a body that isn't a JSON object, ...
+        return 400, {"error": f"Bad request: {e}"}
+
+def serve_inventory(host=SERVICE_HOST, port=SERVICE_PORT, thread_count=SERVICE_THREADS):
+    """Loads the inventory and answers HTTP requests until Ctrl+C."""
+    import http.server # only the service needs these
+    import queue
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from urllib.parse import parse_qsl, urlsplit
+
+    response_cache = ResponseCache(SERVICE_CACHE_SIZE)
+    write_queue = queue.Queue() # (method, path, body, Future) waiting for the writer
+
+    def run_writer():
+        """The only thread that ever changes the store (and saves it)."""
+        while True:
+            method, path, body, answer = write_queue.get()
+            if method is None: # told to stop
+                return
+            with save_lock: # the change helpers take store_lock just for the change, the save happens after
+                status, result = handle_service_request(method, path, {}, body)
+            if status < 300 or status == 409: # a 409 still merged in other programs' changes
+                response_cache.invalidate() # only once the change is made, so nothing stale sneaks back in
+            answer.set_result((status, result))
+
+    def run_refresher():
+        """Picks up changes saved by other programs (the menu, scripts, another service) now and then."""
+        while not stop_refreshing.wait(SERVICE_REFRESH_INTERVAL):
+            if refresh_devices():
+                response_cache.invalidate()
+
+    class InventoryRequestHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, so a client can send lots of lookups down one connection
+        timeout = SERVICE_IDLE_TIMEOUT
+        disable_nagle_algorithm = True # headers and body go out as two writes, don't let TCP sit on the second
+
+        def do_GET(self):
+            if self.path == '/metrics': # never cached, it changes with every request
+                if not metrics_enabled:
+                    self.send_answer(404, {"error": "Metrics are off, start the service with --metrics FILE."})
+                    return
+                self.send_answer(200, metrics_as_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+                return
+            answer = response_cache.get(self.path)
+            if answer is None:
+                generation = response_cache.generation # taken before we look, so a change while we look isn't cached
+                url = urlsplit(self.path)
+                with store_lock:
+                    status, result = handle_service_request('GET', url.path, dict(parse_qsl(url.query)), None)
+                answer = (status, json.dumps(result).encode('utf-8'))
+                if status == 200:
+                    response_cache.put(self.path, generation, *answer)
+            self.send_answer(*answer)
+
+        def do_change(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            answer = Future()
+            write_queue.put((self.command, urlsplit(self.path).path, body, answer))
+            self.send_answer(*answer.result()) # waits our turn with the writer
+
+        do_POST = do_PATCH = do_DELETE = do_change
+
+        def send_answer(self, status, result, content_type='application/json'):
+            body = result if isinstance(result, bytes) else json.dumps(result).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # a line per request would be thousands of lines a second
+
+    class PooledHTTPServer(http.server.HTTPServer):
+        """Hands each connection to a fixed pool of threads instead of starting a new thread for it."""
+        def process_request(self, request, client_address):
+            request_pool.submit(self.process_request_in_pool, request, client_address)
+
+        def process_request_in_pool(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    load_devices()
+    request_pool = ThreadPoolExecutor(max_workers=thread_count)
+    writer_thread = threading.Thread(target=run_writer, name='inventory-writer', daemon=True)
+    writer_thread.start()
+    stop_refreshing = threading.Event()
+    refresher_thread = threading.Thread(target=run_refresher, name='inventory-refresher', daemon=True)
+    refresher_thread.start()
+    server = PooledHTTPServer((host, port), InventoryRequestHandler)
+    print(f"Serving {len(network_devices)} devices on http://{host}:{server.server_port}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping the service.")
+    finally:
+        server.server_close()
+        write_queue.put((None, None, None, None))
+        writer_thread.join()
+        stop_refreshing.set()
+        refresher_thread.join()
+        request_pool.shutdown(wait=False)
+        save_devices() # every change was saved as it happened, this only catches stragglers
+
+def command_serve(args):
+    if args.threads < 1:
+        raise CommandError("threads must be at least 1")
+    serve_inventory(args.host, args.port, args.threads)
+    return None
+
+def use_data_file(data_file):
+    """Points the program at a different inventory file (the journal and binary snapshot sit next to it)."""
+    global DATA_FILE, JOURNAL_FILE, BINARY_FILE
+    base_name = os.path.splitext(data_file)[0]
+    DATA_FILE, JOURNAL_FILE, BINARY_FILE = data_file, base_name + '.journal', base_name + '.bin'
+
+def build_argument_parser():
+    """Sets up the command line commands and their options."""
+    import argparse # only needed when there are arguments to read
+    parser = argparse.ArgumentParser(description="Network device inventory. Run with no command for the interactive menu.")
+    parser.add_argument('--data-file', help=f"inventory file to use, JSON or a SQLite .db (default: {DATA_FILE})")
+    parser.add_argument('--metrics', metavar='FILE', help="time the main operations and write the numbers here on exit "
+                                                         "(Prometheus text for .prom/.txt, JSON otherwise)")
+    parser.add_argument('--profile', metavar='FILE', help="run under cProfile and write the stats here")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    add_parser = commands.add_parser('add', help="add one device")
+    add_parser.add_argument('--hostname', required=True)
+    add_parser.add_argument('--vendor', required=True)
+    add_parser.add_argument('--os-version', required=True)
+    add_parser.add_argument('--ip', required=True)
+    add_parser.set_defaults(handler=command_add)
+
+    get_parser = commands.add_parser('get', help="show one device by hostname or IP")
+    get_by = get_parser.add_mutually_exclusive_group(required=True)
+    get_by.add_argument('--hostname')
+    get_by.add_argument('--ip')
+    get_parser.set_defaults(handler=command_get)
+
+    update_parser = commands.add_parser('update', help="change fields of one device")
+    update_parser.add_argument('target', metavar='HOSTNAME', help="current hostname of the device")
+    update_parser.add_argument('--hostname', help="new hostname")
+    update_parser.add_argument('--vendor')
+    update_parser.add_argument('--os-version')
+    update_parser.add_argument('--ip')
+    update_parser.set_defaults(handler=command_update)
+
+    delete_parser = commands.add_parser('delete', help="delete one device")
+    delete_parser.add_argument('target', metavar='HOSTNAME')
+    delete_parser.set_defaults(handler=command_delete)
+
+    list_parser = commands.add_parser('list', help="list devices, optionally filtered, sorted and paged")
+    list_parser.add_argument('--vendor', help="only devices from this vendor (any case)")
+    list_parser.add_argument('--os-version', help="only devices running this OS version")
+    list_parser.add_argument('--ip-prefix', help="only IPs in this prefix, e.g. 10.20 or 10.20.0.0/16")
+    list_parser.add_argument('--sort', choices=SORT_ORDERS, help="default: the order they were added")
+    list_parser.add_argument('--offset', type=int, default=0, help="skip this many matching devices")
+    list_parser.add_argument('--limit', type=int, help="show at most this many")
+    list_parser.add_argument('--format', choices=('json',) + LIST_FORMATS, default='json', help="default: json")
+    list_parser.set_defaults(handler=command_list)
+
+    search_parser = commands.add_parser('search', help="find hostnames by prefix, part of the name or a close spelling")
+    search_parser.add_argument('text', help="under 3 letters only finds names starting with it")
+    search_parser.add_argument('--limit', type=int, default=10, help="default: 10")
+    search_parser.set_defaults(handler=command_search)
+
+    bulk_update_parser = commands.add_parser('bulk-update', help="change fields on every device matching some conditions")
+    bulk_delete_parser = commands.add_parser('bulk-delete', help="delete every device matching some conditions")
+    for bulk_parser in (bulk_update_parser, bulk_delete_parser):
+        bulk_parser.add_argument('--vendor', help="devices from this vendor (any case)")
+        bulk_parser.add_argument('--os-pattern', help="devices whose OS version matches this, * and ? are wildcards, e.g. '15.*'")
+        bulk_parser.add_argument('--ip-prefix', help="devices with IPs in this prefix, e.g. 10.20 or 10.20.0.0/16")
+        bulk_parser.add_argument('--yes', action='store_true', help="really do it (without this it's a dry run that only counts)")
+    bulk_update_parser.add_argument('--set', action='append', required=True, metavar='FIELD=VALUE',
+                                    help="new value, can use {hostname}, {vendor}, {os_version}, {ip_address}; repeat for more fields")
+    bulk_update_parser.set_defaults(handler=command_bulk_update)
+    bulk_delete_parser.set_defaults(handler=command_bulk_delete)
+
+    report_parser = commands.add_parser('report', help="device counts by vendor, OS version and subnet")
+    report_parser.add_argument('--verify', action='store_true', help="also recount from scratch and check the numbers match")
+    report_parser.set_defaults(handler=command_report)
+
+    import_parser = commands.add_parser('import', help="bulk-import devices from a CSV or JSONL file")
+    import_parser.add_argument('file')
+    import_parser.add_argument('--report', help="where to write rejected rows (default: FILE.rejected.csv)")
+    import_parser.set_defaults(handler=command_import)
+
+    reconcile_parser = commands.add_parser('reconcile', help="compare a discovery scan (CSV/JSONL) with the inventory")
+    reconcile_parser.add_argument('file')
+    reconcile_parser.add_argument('--report', help="where to list every difference (default: FILE.reconcile.jsonl)")
+    reconcile_parser.add_argument('--apply', metavar='CATEGORIES', help=f"also apply these, e.g. 'new,moved' or 'all' ({', '.join(RECONCILE_CATEGORIES)})")
+    reconcile_parser.set_defaults(handler=command_reconcile)
+
+    export_parser = commands.add_parser('export', help="write the inventory to a file")
+    export_parser.add_argument('file')
+    export_parser.add_argument('--format', choices=['json', 'jsonl', 'csv', 'binary'], help="default: from the file extension")
+    export_parser.set_defaults(handler=command_export)
+
+    history_parser = commands.add_parser('history', help="every recorded change to one device (or, with no hostname, what history there is)")
+    history_parser.add_argument('hostname', nargs='?')
+    history_parser.set_defaults(handler=command_history)
+
+    as_of_parser = commands.add_parser('as-of', help="the inventory (or one device) as it was at a version or time")
+    as_of_parser.add_argument('when', metavar='VERSION_OR_TIME', help="a version number, or a date / time like 2026-10-13T17:30 (local time)")
+    as_of_by = as_of_parser.add_mutually_exclusive_group()
+    as_of_by.add_argument('--hostname')
+    as_of_by.add_argument('--ip')
+    as_of_parser.set_defaults(handler=command_as_of)
+
+    diff_parser = commands.add_parser('diff', help="devices added, removed and changed between two versions or times")
+    diff_parser.add_argument('old', metavar='FROM', help="a version number or a date / time")
+    diff_parser.add_argument('new', metavar='TO', nargs='?', help="default: the latest version")
+    diff_parser.set_defaults(handler=command_diff)
+
+    sweep_parser = commands.add_parser('sweep', help="check which devices answer on a TCP port and record it")
+    sweep_parser.add_argument('--port', type=int, default=SWEEP_PORT, help=f"default: {SWEEP_PORT}")
+    sweep_parser.add_argument('--timeout', type=float, default=SWEEP_TIMEOUT, help=f"seconds per device (default: {SWEEP_TIMEOUT})")
+    sweep_parser.add_argument('--concurrency', type=int, default=SWEEP_CONCURRENCY, help=f"connects at once (default: {SWEEP_CONCURRENCY})")
+    sweep_parser.set_defaults(handler=command_sweep)
+
+    serve_parser = commands.add_parser('serve', help="answer lookups, lists and reports over HTTP/JSON")
+    serve_parser.add_argument('--host', default=SERVICE_HOST, help=f"default: {SERVICE_HOST}")
+    serve_parser.add_argument('--port', type=int, default=SERVICE_PORT, help=f"default: {SERVICE_PORT}")
+    serve_parser.add_argument('--threads', type=int, default=SERVICE_THREADS, help=f"requests at once (default: {SERVICE_THREADS})")
+    serve_parser.set_defaults(handler=command_serve)
+
+    sqlite_parser = commands.add_parser('to-sqlite', help="copy the JSON inventory into a new SQLite database")
+    sqlite_parser.add_argument('database', help="e.g. network_devices.db, then use it with --data-file")
+    sqlite_parser.set_defaults(handler=command_to_sqlite)
+
+    commands.add_parser('to-binary', help="convert the JSON snapshot to the binary one").set_defaults(handler=command_to_binary)
+    commands.add_parser('to-json', help="convert the binary snapshot to the JSON one").set_defaults(handler=command_to_json)
+    return parser
+
+def run_command(argv):
+    """Runs one command line command (with metrics / profiling if asked for). Returns the exit code."""
+    args = build_argument_parser().parse_args(argv)
+    if args.data_file:
+        use_data_file(args.data_file)
+    if args.metrics:
+        enable_metrics()
+        if hasattr(signal, 'SIGUSR1'): # 'kill -USR1 <pid>' writes the metrics so far, e.g. while the menu is open
+            signal.signal(signal.SIGUSR1, lambda signal_number, frame: write_metrics(args.metrics))
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        return dispatch_command(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile) # read it with: python -m pstats FILE
+            print(f"Profile written to {args.profile}.", file=sys.stderr)
+        if args.metrics:
+            write_metrics(args.metrics)
+
+def dispatch_command(args):
+    """Runs the command (or the interactive menu if there isn't one). Returns the exit code."""
+    from contextlib import redirect_stdout
+    if args.command is None: # just options, no command: interactive as usual
+        main_program()
+        return 0
+    args.output = sys.stdout # the real stdout, for commands that stream their own output
+    try:
+        with redirect_stdout(sys.stderr): # messages like "Loaded 10 devices" go to stderr...
+            result = args.handler(args)
+    except BrokenPipeError: # e.g. piped into 'head', which stopped reading
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno()) # so Python's last flush doesn't complain again
+        return 0
+    except CommandError as e:
+        print(json.dumps({"error": str(e)}))
+        return e.exit_code
+    except (OSError, ValueError) as e: # missing files, broken snapshots and the like
+        print(json.dumps({"error": str(e)}))
+        return 2
+    if result is not None: # None means the command already wrote its output
+        print(json.dumps(result)) # ...so stdout is nothing but the JSON answer
+    return 0
 
 # --- Start the program when the script runs ---
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
     main_program()
@@ -0,0 +1,164 @@
+"""
+Stress test for several programs sharing one inventory.
+
+    python stress_test.py                                  # 12 processes, JSON and SQLite
+    python stress_test.py --processes 16 --operations 300 --backend json
+
+Starts a lot of processes on the same inventory (in a temporary folder, so
+the real one is never touched). Each one does a random mix of adds, updates,
+deletes and reads, saving after every change, sometimes picking up the
+others' changes first and sometimes not (so its saves are stale and have to
+be merged). A few hostnames and IPs are fought over on purpose, so some
+changes clash and get dropped. The journal is compacted every few saves, so
+saves also have to cope with a new journal generation.
+
+At the end it loads the inventory fresh and checks that:
+- the device count is what the successful adds and deletes add up to,
+- the change history has exactly one version per successful change,
+- no journal record was skipped or damaged on the way.
+It prints the numbers as JSON and exits with an error if any check fails.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import network_inventory as inventory
+
+SEED_DEVICES = 200 # devices in the inventory before the processes start
+CONTESTED_HOSTNAMES = 20 # 'hot-N' names every process tries to add
+CONTESTED_SUBNET = "10.9" # IPs in here are fought over too
+
+
+def run_worker(data_file, worker_number, operation_count, refresh_chance):
+    """One process's share of the work. Returns its counts as a dict."""
+    counts = {"adds": 0, "deletes": 0, "updates": 0, "dropped": 0, "reads": 0, "refreshes": 0}
+    rng = random.Random(worker_number)
+    messages = io.StringIO()
+    with contextlib.redirect_stdout(messages):
+        inventory.use_data_file(data_file)
+        inventory.load_devices()
+        store = inventory.network_devices
+        for operation_number in range(operation_count):
+            if rng.random() < refresh_chance and inventory.refresh_devices():
+                counts["refreshes"] += 1
+            row_ids = list(store.row_ids())
+            kind = rng.random()
+            contested_ip = f"{CONTESTED_SUBNET}.{rng.randrange(4)}.{rng.randrange(1, 250)}"
+            if kind < 0.3 or not row_ids:
+                if rng.random() < 0.3:
+                    host_name, ip_address = f"hot-{rng.randrange(CONTESTED_HOSTNAMES)}", contested_ip
+                else: # a name and IP only this process uses
+                    host_name = f"p{worker_number}-{operation_number}"
+                    ip_address = f"10.{100 + worker_number}.{operation_number // 250}.{operation_number % 250 + 1}"
+                if store.find_by_hostname(host_name) is not None or store.find_by_ip(ip_address) is not None:
+                    continue
+                store.add({"hostname": host_name, "vendor": "Cisco", "os_version": "17.9.4", "ip_address": ip_address})
+                done = "adds"
+            elif kind < 0.45:
+                store.delete(rng.choice(row_ids))
+                done = "deletes"
+            elif kind < 0.8:
+                changes = {"os_version": str(rng.randrange(1000))}
+                if rng.random() < 0.3:
+                    if store.find_by_ip(contested_ip) is not None:
+                        continue
+                    changes["ip_address"] = contested_ip
+                store.update(rng.choice(row_ids), changes)
+                done = "updates"
+            else:
+                for row_id in rng.sample(row_ids, min(5, len(row_ids))):
+                    store.get(row_id).to_dict()
+                counts["reads"] += 1
+                continue
+            if inventory.save_devices():
+                counts["dropped"] += 1
+            else:
+                counts[done] += 1
+    counts["problems"] = [line for line in messages.getvalue().splitlines()
+                          if "skipped" in line or "damaged" in line or "Oops" in line]
+    return counts
+
+
+def run_backend(file_name, process_count, operation_count, compact_every, refresh_chance):
+    """Runs every process against one fresh inventory. Returns (results dict, list of failed checks)."""
+    with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(io.StringIO()):
+        data_file = os.path.join(work_dir, file_name)
+        inventory.use_data_file(data_file)
+        inventory.load_devices()
+        for number in range(SEED_DEVICES):
+            inventory.network_devices.add({"hostname": f"seed-{number}", "vendor": "Juniper", "os_version": "22.2R3",
+                                           "ip_address": f"10.1.{number // 250}.{number % 250 + 1}"})
+        inventory.save_devices(force_compact=True)
+        first_version = inventory.latest_history_version()
+
+        started = time.perf_counter()
+        children = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', str(worker_number),
+                                      '--data-file', data_file, '--operations', str(operation_count),
+                                      '--compact-every', str(compact_every), '--refresh-chance', str(refresh_chance)],
+                                     stdout=subprocess.PIPE, text=True)
+                    for worker_number in range(process_count)]
+        worker_counts = []
+        for child in children:
+            output, _ = child.communicate()
+            if child.returncode != 0:
+                sys.exit(f"A worker failed (exit code {child.returncode}).")
+            worker_counts.append(json.loads(output))
+        seconds = time.perf_counter() - started
+
+        inventory.load_devices()
+        device_count = len(inventory.network_devices)
+        versions = inventory.latest_history_version() - first_version
+
+    totals = {name: sum(counts[name] for counts in worker_counts)
+              for name in ("adds", "deletes", "updates", "dropped", "reads", "refreshes")}
+    successful_changes = totals["adds"] + totals["deletes"] + totals["updates"]
+    expected_count = SEED_DEVICES + totals["adds"] - totals["deletes"]
+    problems = [line for counts in worker_counts for line in counts["problems"]]
+    failed_checks = []
+    if device_count != expected_count:
+        failed_checks.append(f"{file_name}: {device_count} devices at the end, expected {expected_count}")
+    if versions != successful_changes:
+        failed_checks.append(f"{file_name}: {versions} history versions, expected {successful_changes}")
+    if problems:
+        failed_checks.append(f"{file_name}: {len(problems)} problem message(s), e.g. {problems[0]!r}")
+    return {"backend": file_name, "processes": process_count, "seconds": round(seconds, 2), **totals,
+            "devices": device_count, "history_versions": versions}, failed_checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Many processes reading and writing one inventory at the same time.")
+    parser.add_argument('--processes', type=int, default=12, help="processes running at once (default: 12)")
+    parser.add_argument('--operations', type=int, default=150, help="operations per process (default: 150)")
+    parser.add_argument('--backend', choices=('json', 'sqlite', 'both'), default='both')
+    parser.add_argument('--compact-every', type=int, default=50, help="journal records between compactions (default: 50)")
+    parser.add_argument('--refresh-chance', type=float, default=0.5,
+                        help="how often a process picks up the others' changes before an operation (default: 0.5)")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS) # used by the child processes
+    parser.add_argument('--data-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        inventory.COMPACT_EVERY = args.compact_every
+        print(json.dumps(run_worker(args.data_file, args.worker, args.operations, args.refresh_chance)))
+        return
+
+    file_names = {'json': ['inventory.json'], 'sqlite': ['inventory.db'], 'both': ['inventory.json', 'inventory.db']}[args.backend]
+    all_failed_checks = []
+    for file_name in file_names:
+        results, failed_checks = run_backend(file_name, args.processes, args.operations, args.compact_every, args.refresh_chance)
+        print(json.dumps(results))
+        all_failed_checks += failed_checks
+    if all_failed_checks:
+        sys.exit("FAILED:\n" + "\n".join(all_failed_checks))
+    print("All checks passed.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,754 @@
+"""
+Regression tests for the inventory. Each test works in its own temporary
+folder, so the real inventory is never touched.
+
+    python -m pytest test_network_inventory.py    (or python -m unittest)
+"""
+import contextlib
+import csv
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import network_inventory as inventory
+import stress_test
+
+
+class InventoryTestCase(unittest.TestCase):
+    """Points the program at an empty inventory in a temporary folder."""
+
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.work_dir = work_dir.name
+        inventory.use_data_file(os.path.join(self.work_dir, "inventory.json"))
+        inventory.network_devices.clear()
+
+    def quietly(self, function, *args, **kwargs):
+        """Runs function without its "Loaded ..." / "Saved ..." chatter."""
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args, **kwargs)
+
+    def write_inventory(self, devices):
+        """Writes a JSON snapshot with these devices and loads it."""
+        with open(inventory.DATA_FILE, 'w') as f:
+            json.dump(devices, f)
+        self.quietly(inventory.load_devices)
+
+
+def run_other_program(*arguments):
+    """Runs the inventory as a separate program on the same files, like a second user would."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "network_inventory.py")
+    return subprocess.run([sys.executable, script, "--data-file", inventory.DATA_FILE, *arguments],
+                          capture_output=True, text=True, check=True)
+
+
+# Compacts in another program that dies after the snapshot is written but
+# before the new journal is (argv[1] is the data file)
+COMPACT_THEN_DIE = """
+import os, sys
+import network_inventory as inventory
+inventory.use_data_file(sys.argv[1])
+inventory.load_devices(quiet=True)
+write_file_atomically = inventory.write_file_atomically
+def write_then_die(path, data):
+    if path == inventory.JOURNAL_FILE:
+        os._exit(9)
+    write_file_atomically(path, data)
+inventory.write_file_atomically = write_then_die
+inventory.compact_journal()
+"""
+
+
+def compact_in_other_program_and_die():
+    folder = os.path.dirname(os.path.abspath(__file__))
+    finished = subprocess.run([sys.executable, "-c", COMPACT_THEN_DIE, inventory.DATA_FILE], cwd=folder, capture_output=True)
+    assert finished.returncode == 9, finished.stderr
+
+
+def device(host_name, ip_address, vendor="Cisco", os_version="17.9.4"):
+    return {"hostname": host_name, "vendor": vendor, "os_version": os_version, "ip_address": ip_address}
+
+
+class DeviceStoreTests(unittest.TestCase):
+    """The store on its own, no files involved."""
+
+    def test_hostname_and_ip_lookups_follow_changes(self):
+        store = inventory.DeviceStore()
+        row_id = store.add(device("Core-SW1", "10.0.0.1"))
+        self.assertEqual(store.find_by_hostname("core-sw1"), row_id) # hostnames match in any case
+        self.assertEqual(store.find_by_ip("10.0.0.1"), row_id)
+        self.assertIsNone(store.find_by_ip("not an ip"))
+        store.update(row_id, {"hostname": "core-sw2", "ip_address": "10.0.0.2"})
+        self.assertIsNone(store.find_by_hostname("Core-SW1"))
+        self.assertIsNone(store.find_by_ip("10.0.0.1"))
+        self.assertEqual((store.find_by_hostname("CORE-SW2"), store.find_by_ip("10.0.0.2")), (row_id, row_id))
+        store.delete(row_id)
+        self.assertEqual((store.find_by_hostname("core-sw2"), store.find_by_ip("10.0.0.2"), len(store)), (None, None, 0))
+        self.assertNotEqual(store.add(device("core-sw2", "10.0.0.2")), row_id) # the name and IP are free again, in a new row
+
+    def test_columns_share_strings_and_round_trip(self):
+        store = inventory.DeviceStore()
+        for number in range(1, 7):
+            store.add(device(f"r{number}", f"10.0.0.{number}", vendor="Cisco" if number % 2 else "Juniper"))
+        store.delete(store.find_by_hostname("r3"))
+        self.assertEqual(sorted(store.strings), ["17.9.4", "Cisco", "Juniper"]) # each vendor / OS stored once
+        copy = inventory.DeviceStore()
+        copy.load_columns(*store.columns()) # the deleted row is squeezed out
+        self.assertEqual(copy.to_list(), store.to_list())
+        self.assertEqual(len(copy.hostnames), 5)
+        self.assertEqual(copy.get(copy.find_by_ip("10.0.0.4"))["vendor"], "Juniper")
+
+    def test_prefix_contains_and_similar_search(self):
+        store = inventory.DeviceStore()
+        for number, host_name in enumerate(["dc1-leaf-01", "dc1-leaf-02", "DC1-Spine-01", "dc2-leaf-01", "edge-router"], 1):
+            store.add(device(host_name, f"10.0.0.{number}"))
+
+        def search(text, limit=10):
+            return [(store.hostnames[row_id], how_it_matched) for row_id, how_it_matched in store.search_hostnames(text, limit)]
+
+        self.assertEqual(search("dc1-leaf-01")[0], ("dc1-leaf-01", "exact")) # the close names follow it
+        self.assertEqual(search("DC1-"), [("dc1-leaf-01", "prefix"), ("dc1-leaf-02", "prefix"), ("DC1-Spine-01", "prefix")])
+        self.assertEqual(search("dc1-", limit=2), [("dc1-leaf-01", "prefix"), ("dc1-leaf-02", "prefix")])
+        self.assertEqual(search("router"), [("edge-router", "contains")])
+        self.assertEqual(search("01"), []) # too short for the trigram index, and no name starts with it
+        self.assertEqual(search("dc", limit=1), [("dc1-leaf-01", "prefix")])
+        self.assertEqual(search("edge-ruoter"), [("edge-router", "similar")]) # a typo
+        self.assertEqual(search("leaf-01"), [("dc1-leaf-01", "contains"), ("dc2-leaf-01", "contains")])
+        store.update(store.find_by_hostname("edge-router"), {"hostname": "edge-fw"})
+        store.delete(store.find_by_hostname("dc2-leaf-01"))
+        self.assertEqual(search("router"), []) # the old trigram entries don't count any more
+        self.assertEqual(search("leaf-01"), [("dc1-leaf-01", "contains")])
+
+    def check_indexes(self, store):
+        """Every index in the store should give the same answers as a store freshly loaded with its devices."""
+        fresh = inventory.DeviceStore()
+        fresh.load(store.to_list())
+        self.assertEqual(len(store), len(fresh))
+        for found in fresh:
+            self.assertEqual(store.get(store.find_by_hostname(found["hostname"])).to_dict(), found.to_dict())
+            self.assertEqual(store.get(store.find_by_ip(found["ip_address"])).to_dict(), found.to_dict())
+        self.assertEqual((len(store.hostname_index), len(store.ip_index)), (len(fresh), len(fresh)))
+        for find_in_order in (lambda devices: devices.find_in_ip_range(0, 0xFFFFFFFF),
+                              lambda devices: devices.find_by_hostname_prefix("")):
+            self.assertEqual([store.hostnames[row_id] for row_id in find_in_order(store)],
+                             [fresh.hostnames[row_id] for row_id in find_in_order(fresh)])
+        for text in ("r1", "x-r2", "r10", "r1-new"):
+            self.assertEqual([store.hostnames[row_id] for row_id, _ in store.search_hostnames(text)],
+                             [fresh.hostnames[row_id] for row_id, _ in fresh.search_hostnames(text)])
+        self.assertEqual(store.report_counts(), fresh.report_counts())
+
+    def test_indexes_stay_right_after_bulk_changes(self):
+        store = inventory.DeviceStore()
+        for number in range(300):
+            store.add(device(f"r{number}", f"10.0.{number // 200}.{number % 200}"))
+        store.search_hostnames("r1"), store.report_counts() # build every lazy index, so the batches have to keep them up
+        by_name = store.find_by_hostname
+        store.update_many({by_name("r1"): {"hostname": "r2"}, by_name("r2"): {"hostname": "r1"}, # a swap, in one batch
+                           by_name("r3"): {"ip_address": "10.0.0.4"}, by_name("r4"): {"ip_address": "10.0.0.3", "vendor": "Arista"}})
+        self.check_indexes(store)
+        # bigger than BULK_REINDEX_ROWS, so the sorted indexes get rebuilt instead of patched
+        store.update_many({by_name(f"r{number}"): {"hostname": f"x-r{number}", "ip_address": f"10.1.{number // 200}.{number % 200}"}
+                           for number in range(100, 250)})
+        self.check_indexes(store)
+        store.delete_many([by_name("r1"), by_name("x-r120")])
+        self.check_indexes(store)
+        store.delete_many([by_name(f"r{number}") for number in range(250, 300)] + [by_name(f"x-r{number}") for number in range(130, 200)])
+        self.check_indexes(store)
+        self.assertEqual(len(store), 178)
+
+    def test_report_counters_match_a_full_recount(self):
+        store = inventory.DeviceStore()
+        for number in range(1, 9):
+            store.add(device(f"r{number}", f"10.0.{number % 3}.{number}", vendor="Cisco" if number % 2 else "Juniper"))
+        store.report_counts() # counted now, so everything below nudges the counters
+        store.add(device("r9", "10.0.9.9", vendor="Arista", os_version="4.30"))
+        store.update(store.find_by_hostname("r1"), {"vendor": "Arista", "ip_address": "10.0.9.1"})
+        store.delete(store.find_by_hostname("r2"))
+        store.update_many({store.find_by_hostname("r3"): {"os_version": "18.1"}, store.find_by_hostname("r4"): {"vendor": "Cisco"}})
+        store.delete_many([store.find_by_hostname("r5"), store.find_by_hostname("r9")])
+        self.assertEqual(store.report_counts(), store.recount_from_scratch())
+        self.assertEqual(store.report_counts()["vendor"]["Arista"], 1) # r1 moved in, r9 came and went
+
+
+class BinarySnapshotLookupTests(InventoryTestCase):
+
+    def test_finds_hostnames_that_overlap_earlier_ones(self):
+        # 'aa' starts inside the text of 'aaa' just before it, so a search that
+        # doesn't allow overlapping matches never gets to test the real 'aa'
+        devices = [device("aaa", "10.0.0.1"), device("aa", "10.0.0.2"), device("abab", "10.0.0.3"), device("ab", "10.0.0.4")]
+        self.write_inventory(devices)
+        self.quietly(inventory.convert_json_to_binary)
+        for expected in devices:
+            for asked_for in (expected["hostname"], expected["hostname"].upper()):
+                found = inventory.find_in_binary_snapshot(inventory.BINARY_FILE, host_name=asked_for)
+                self.assertEqual(found and found["ip_address"], expected["ip_address"], asked_for)
+        self.assertIsNone(inventory.find_in_binary_snapshot(inventory.BINARY_FILE, host_name="a"))
+
+    def test_history_start_record_for_overlapping_hostname(self):
+        self.write_inventory([device("aaa", "10.0.0.1"), device("aa", "10.0.0.2")])
+        inventory.network_devices.update(inventory.network_devices.find_by_hostname("aa"), {"os_version": "18.1"})
+        self.quietly(inventory.save_devices)
+        history = inventory.device_history("aa")
+        self.assertEqual([change["op"] for change in history], ["start", "update"])
+        self.assertEqual(history[0]["device"], device("aa", "10.0.0.2"))
+
+    def test_to_json_refuses_an_out_of_date_binary_snapshot(self):
+        self.write_inventory([device("r1", "10.0.0.1")])
+        self.quietly(inventory.convert_json_to_binary)
+        self.write_inventory([device("r1", "10.0.0.1"), device("r2", "10.0.0.2")]) # a newer JSON snapshot
+        os.utime(inventory.BINARY_FILE, ns=(0, 0)) # in case both landed in the same clock tick
+        with self.assertRaises(ValueError):
+            inventory.convert_binary_to_json()
+        self.quietly(inventory.load_devices)
+        self.assertIsNotNone(inventory.network_devices.find_by_hostname("r2"))
+
+
+class HistoryTests(InventoryTestCase):
+
+    def test_history_starts_at_the_first_save_not_the_first_load(self):
+        self.write_inventory([device("r1", "10.0.0.1")])
+        self.assertEqual(inventory.history_checkpoints(), []) # only read, nothing written
+        inventory.network_devices.add(device("r2", "10.0.0.2"))
+        self.quietly(inventory.save_devices)
+        self.assertEqual([change["op"] for change in inventory.device_history("r1")], ["start"])
+        self.assertEqual([change["op"] for change in inventory.device_history("r2")], ["add"])
+
+    def test_as_of_and_diff(self):
+        self.write_inventory([device("r1", "10.0.0.1"), device("r2", "10.0.0.2")])
+        store = inventory.network_devices
+        for make_change in (lambda: store.add(device("r3", "10.0.0.3")), # version 1
+                            lambda: store.update(store.find_by_hostname("r1"), {"os_version": "18.1"}), # 2
+                            lambda: store.delete(store.find_by_hostname("r2")), # 3
+                            lambda: store.update(store.find_by_hostname("r3"), {"hostname": "core3"})): # 4
+            make_change()
+            self.quietly(inventory.save_devices)
+        self.assertEqual(inventory.inventory_at(0).to_list(), [device("r1", "10.0.0.1"), device("r2", "10.0.0.2")])
+        self.assertEqual(inventory.inventory_at(2).to_list(),
+                         [device("r1", "10.0.0.1", os_version="18.1"), device("r2", "10.0.0.2"), device("r3", "10.0.0.3")])
+        self.assertEqual(inventory.parse_history_point("2999-01-01"), 4)
+        diff = inventory.diff_versions(4, 1) # either way round
+        self.assertEqual((diff["from_version"], diff["to_version"], diff["added"]), (1, 4, []))
+        self.assertEqual(diff["removed"], [device("r2", "10.0.0.2")])
+        self.assertEqual(sorted(diff["changed"], key=lambda changed: changed["hostname"]),
+                         [{"hostname": "core3", "changes": {"hostname": ["r3", "core3"]}},
+                          {"hostname": "r1", "changes": {"os_version": ["17.9.4", "18.1"]}}])
+        self.assertEqual(inventory.diff_versions(0, 4)["added"], [device("core3", "10.0.0.3")])
+        self.assertEqual([change["op"] for change in inventory.device_history("core3")], ["add", "update"])
+
+    def test_device_history_follows_renames_in_two_reads(self):
+        self.write_inventory([device("r1", "10.0.0.1"), device("other", "10.0.0.9")])
+        store = inventory.network_devices
+        for old_name, new_name in (("r1", "r2"), ("r2", "r3"), ("r3", "core1")):
+            store.update(store.find_by_hostname(old_name), {"hostname": new_name})
+            store.update(store.find_by_hostname("other"), {"os_version": old_name})
+            self.quietly(inventory.save_devices)
+        with mock.patch.object(inventory, 'read_history_lines', wraps=inventory.read_history_lines) as read_history_lines:
+            history = inventory.device_history("R1")
+        self.assertEqual(read_history_lines.call_count, 2) # however many renames there were
+        self.assertEqual([change.get("changes", {}).get("hostname") for change in history], [None, "r2", "r3", "core1"])
+        self.assertEqual(inventory.device_history("core1"), history)
+
+
+class IpRangeSearchTests(InventoryTestCase):
+
+    def test_subnet_and_range_give_row_ids_in_ip_order(self):
+        self.write_inventory([device("r3", "10.20.9.1"), device("r1", "10.20.0.5"), device("r2", "10.21.0.1"),
+                              device("r4", "10.20.0.10")])
+        in_subnet = inventory.find_devices_in_subnet("10.20.5.1/16") # host bits are ignored
+        self.assertEqual([inventory.network_devices.hostnames[row_id] for row_id in in_subnet], ["r1", "r4", "r3"])
+        in_range = inventory.find_devices_in_range("10.21.0.1", "10.20.0.6") # the wrong way round is fine
+        self.assertEqual([inventory.network_devices.get(row_id)["hostname"] for row_id in in_range], ["r4", "r3", "r2"])
+        self.assertEqual(len(inventory.find_devices_in_subnet("192.168.0.0/24")), 0)
+
+
+class ReconcileTests(InventoryTestCase):
+
+    def test_report_is_read_as_json_lines_whatever_its_name(self):
+        self.write_inventory([device("r1", "10.0.0.9", os_version="16")])
+        scan_path = os.path.join(self.work_dir, "scan.csv")
+        with open(scan_path, 'w') as f:
+            f.write("hostname,vendor,os_version,ip_address\nr1,Cisco,17,10.0.0.9\nr2,Juniper,20,10.0.0.2\n")
+        report_path = os.path.join(self.work_dir, "diff.json") # not .jsonl, so read_import_rows would take it for CSV
+        counts = self.quietly(inventory.reconcile_scan, scan_path, report_path)
+        self.assertEqual((counts["drifted"], counts["new"]), (1, 1))
+        applied, skipped = self.quietly(inventory.apply_reconcile_report, report_path, {"drifted", "new"})
+        self.assertEqual((applied["drifted"], applied["new"], skipped), (1, 1, 0))
+        store = inventory.network_devices
+        self.assertEqual(store.get(store.find_by_hostname("r1"))["os_version"], "17")
+        self.assertIsNotNone(store.find_by_hostname("r2"))
+
+
+class ListingTests(InventoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_inventory([device("sw-b", "10.0.0.20", vendor="Cisco, Inc."), device("SW-a", "10.0.0.3"),
+                              device("fw1", "10.1.0.1", vendor="Juniper", os_version="23.2")])
+        inventory.network_devices.set_status(inventory.network_devices.find_by_hostname("fw1"), True, 1.5, 0)
+
+    def listing(self, row_ids, list_format):
+        output = io.StringIO()
+        with mock.patch.object(inventory, 'LIST_CHUNK_SIZE', 2): # more than one chunk
+            inventory.write_device_list(row_ids, list_format, output)
+        return output.getvalue()
+
+    def test_filters_and_sorting(self):
+        hostnames = inventory.network_devices.hostnames
+        self.assertEqual([hostnames[row_id] for row_id in inventory.select_devices(sort_by='hostname')], ["fw1", "SW-a", "sw-b"])
+        self.assertEqual([hostnames[row_id] for row_id in inventory.select_devices(ip_prefix="10.0", sort_by='ip')], ["SW-a", "sw-b"])
+        self.assertEqual([hostnames[row_id] for row_id in inventory.select_devices(vendor="juniper")], ["fw1"])
+        matched_count, page_rows = inventory.list_device_page(sort_by='ip', offset=1, limit=1)
+        self.assertEqual((matched_count, [hostnames[row_id] for row_id in page_rows]), (3, ["sw-b"]))
+
+    def test_csv_and_jsonl_hold_every_field(self):
+        row_ids = inventory.select_devices(sort_by='ip')
+        expected = [inventory.network_devices.get(row_id).to_dict() for row_id in row_ids]
+        csv_rows = list(csv.DictReader(io.StringIO(self.listing(row_ids, 'csv'))))
+        self.assertEqual([{field_name: value for field_name, value in row.items() if value} for row in csv_rows],
+                         [{field_name: str(value) for field_name, value in found.items()} for found in expected])
+        self.assertEqual([json.loads(line) for line in self.listing(row_ids, 'jsonl').splitlines()], expected)
+
+    def test_block_and_table_number_across_chunks(self):
+        row_ids = inventory.select_devices(sort_by='hostname')
+        block_text = self.listing(row_ids, 'block')
+        self.assertEqual([line for line in block_text.splitlines() if line.startswith("--- Device")],
+                         ["--- Device 1 ---", "--- Device 2 ---", "--- Device 3 ---"])
+        self.assertIn("Status: reachable (1.5 ms)", block_text)
+        table_lines = self.listing(row_ids, 'table').splitlines()
+        self.assertEqual([line.split()[0] for line in table_lines], ["HOSTNAME", "fw1", "SW-a", "sw-b"])
+        self.assertTrue(table_lines[1].endswith("up"))
+
+
+class BulkChangeTests(InventoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_inventory([device("r1", "10.0.0.1", os_version="15.2"), device("r2", "10.0.0.2", os_version="15.9"),
+                              device("r3", "10.0.1.3", os_version="15.2"), device("fw1", "10.0.0.9", vendor="Juniper")])
+
+    def test_dry_run_then_apply(self):
+        dry_run = inventory.bulk_change_details(os_pattern="15.*", ip_prefix="10.0.0", assignments={"hostname": "{hostname}-old"})
+        self.assertEqual((dry_run["matched"], dry_run["would_update"], inventory.network_devices.pending_changes), (2, 2, []))
+        result = self.quietly(inventory.bulk_change_details, os_pattern="15.*", ip_prefix="10.0.0",
+                              assignments={"hostname": "{hostname}-old"}, apply=True)
+        self.assertEqual(result["updated"], 2)
+        result = self.quietly(inventory.bulk_change_details, vendor="juniper", apply=True)
+        self.assertEqual(result["deleted"], 1)
+        self.quietly(inventory.load_devices)
+        self.assertEqual(sorted(inventory.network_devices.hostname_index), ["r1-old", "r2-old", "r3"])
+
+    def test_a_clash_changes_nothing(self):
+        with self.assertRaises(inventory.CommandError):
+            inventory.bulk_change_details(os_pattern="15.2", assignments={"hostname": "fw1"}, apply=True) # two of them, and fw1 is taken
+        with self.assertRaises(inventory.CommandError):
+            inventory.bulk_change_details(assignments={"vendor": "Cisco"}, apply=True) # no conditions at all
+        self.assertEqual(inventory.network_devices.pending_changes, [])
+
+
+class ImportTests(InventoryTestCase):
+
+    def import_file(self, file_name, text):
+        import_path = os.path.join(self.work_dir, file_name)
+        with open(import_path, 'w') as f:
+            f.write(text)
+        counts = self.quietly(inventory.import_devices, import_path)
+        rejected = []
+        if os.path.exists(import_path + '.rejected.csv'):
+            with open(import_path + '.rejected.csv', newline='') as f:
+                rejected = [(row["line"], row["hostname"]) for row in csv.DictReader(f)]
+        return counts, rejected
+
+    def test_csv_good_rows_are_added_and_bad_ones_reported(self):
+        self.write_inventory([device("r1", "10.0.0.1")])
+        counts, rejected = self.import_file("new.csv", "hostname,vendor,os_version,ip_address\n"
+                                                       "r2,Cisco,17,10.0.0.2\n"
+                                                       "R1,Cisco,17,10.0.0.9\n" # already in the inventory
+                                                       "r3,Cisco,17,10.0.0.2\n" # same IP as r2 above
+                                                       "r4,Cisco,17,10.0.0.300\n"
+                                                       "r5,,17,10.0.0.5\n")
+        self.assertEqual(counts, (1, 4, 0))
+        self.assertEqual(rejected, [("3", "R1"), ("4", "r3"), ("5", "r4"), ("6", "r5")])
+        self.quietly(inventory.load_devices) # saved once at the end
+        self.assertEqual(sorted(found["hostname"] for found in inventory.network_devices.to_list()), ["r1", "r2"])
+
+    def test_json_lines(self):
+        counts, rejected = self.import_file("new.jsonl", json.dumps(device("r1", "10.0.0.1")) + "\n\nnot json\n"
+                                                         + json.dumps(device("r2", "10.0.0.2")) + "\n")
+        self.assertEqual(counts, (2, 1, 0))
+        self.assertEqual(rejected, [("3", "")])
+
+
+class MetricsTests(InventoryTestCase):
+    """Run in another program, as switching metrics on swaps functions for the rest of the run."""
+
+    def test_metrics_as_json_and_prometheus(self):
+        self.write_inventory([device("r1", "10.0.0.1")])
+        json_path, prometheus_path = os.path.join(self.work_dir, "metrics.json"), os.path.join(self.work_dir, "metrics.prom")
+        run_other_program("--metrics", json_path, "add", "--hostname", "r2", "--vendor", "Cisco", "--os-version", "17", "--ip", "10.0.0.2")
+        with open(json_path) as f:
+            operations = json.load(f)["operations"]
+        self.assertEqual(operations["store_add"]["count"], 1)
+        self.assertGreater(operations["save"]["bytes"], 0)
+        self.assertEqual(sum(operations["load"]["histogram"].values()), operations["load"]["count"])
+        run_other_program("--metrics", prometheus_path, "get", "--hostname", "r2")
+        with open(prometheus_path) as f:
+            samples = dict(line.rsplit(' ', 1) for line in f.read().splitlines() if not line.startswith('#'))
+        lookup_count = int(samples['inventory_operation_seconds_count{operation="lookup_hostname"}'])
+        self.assertGreater(lookup_count, 0)
+        self.assertEqual(int(samples['inventory_operation_seconds_bucket{operation="lookup_hostname",le="+Inf"}']), lookup_count)
+        self.assertEqual(int(samples['inventory_operation_bytes_total{operation="load"}']), sum(
+            os.path.getsize(path) for path in (inventory.DATA_FILE, inventory.JOURNAL_FILE)))
+
+    def test_profile_writes_a_stats_file(self):
+        import pstats
+        self.write_inventory([device("r1", "10.0.0.1")])
+        stats_path = os.path.join(self.work_dir, "get.prof")
+        run_other_program("--profile", stats_path, "get", "--hostname", "r1")
+        self.assertTrue(any(function_name == "load_devices" for _, _, function_name in pstats.Stats(stats_path).stats))
+
+
+class SqliteBackendTests(InventoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        inventory.use_data_file(os.path.join(self.work_dir, "inventory.db"))
+        connection_patch = mock.patch.object(inventory, 'database_connection', None) # a fresh connection for this database
+        connection_patch.start()
+        self.addCleanup(connection_patch.stop)
+        self.quietly(inventory.load_devices)
+        self.addCleanup(inventory.open_database().close)
+        inventory.network_devices.add(device("R1", "10.0.0.1"))
+        self.quietly(inventory.save_devices)
+
+    def saved_hostnames(self):
+        return sorted(row[0] for row in inventory.open_database().execute("SELECT hostname FROM devices"))
+
+    def test_database_refuses_duplicate_hostnames_and_ips(self):
+        import sqlite3
+        for clash in (device("r1", "10.0.0.2"), device("r2", "10.0.0.1")): # 'r1' clashes with 'R1' too
+            with self.assertRaises(sqlite3.IntegrityError):
+                with inventory.open_database() as connection:
+                    connection.execute("INSERT INTO devices (hostname, hostname_key, vendor, os_version, ip) VALUES (?, ?, ?, ?, ?)",
+                                       inventory.database_device_values(clash))
+        self.assertEqual(self.saved_hostnames(), ["R1"])
+
+    def test_a_failing_save_writes_nothing(self):
+        import sqlite3
+        changes = [{"op": "add", "device": device("r2", "10.0.0.2")}, {"op": "add", "device": device("r3", "10.0.0.1")}]
+        with self.assertRaises(sqlite3.IntegrityError):
+            inventory.save_changes_to_database(changes)
+        self.assertEqual(self.saved_hostnames(), ["R1"]) # r2 was rolled back with the rest
+
+    def test_save_after_another_program_wrote_merges_first(self):
+        inventory.network_devices.add(device("r2", "10.0.0.2"))
+        run_other_program("add", "--hostname", "r3", "--vendor", "Arista", "--os-version", "4.30", "--ip", "10.0.0.3")
+        self.assertFalse(inventory.save_changes_to_database(inventory.network_devices.pending_changes)) # out of date
+        self.assertEqual(self.quietly(inventory.save_devices), [])
+        self.assertEqual(self.saved_hostnames(), ["R1", "r2", "r3"])
+
+
+class JournalTests(InventoryTestCase):
+
+    def test_saves_append_and_compaction_folds_them_in(self):
+        self.write_inventory([device("r1", "10.0.0.1"), device("r2", "10.0.0.2")])
+        with open(inventory.DATA_FILE, 'rb') as f:
+            snapshot_before = f.read()
+        store = inventory.network_devices
+        store.add(device("r3", "10.0.0.3"))
+        store.update(store.find_by_hostname("r1"), {"vendor": "Juniper"})
+        store.delete(store.find_by_hostname("r2"))
+        self.quietly(inventory.save_devices)
+        expected = [device("r1", "10.0.0.1", vendor="Juniper"), device("r3", "10.0.0.3")]
+        with open(inventory.DATA_FILE, 'rb') as f:
+            self.assertEqual(f.read(), snapshot_before) # the save only touched the journal
+        with open(inventory.JOURNAL_FILE) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record["op"] for record in records if "op" in record], ["add", "update", "delete"])
+        store.clear()
+        self.quietly(inventory.load_devices)
+        self.assertEqual(store.to_list(), expected)
+
+        self.quietly(inventory.compact_journal)
+        with open(inventory.JOURNAL_FILE) as f:
+            self.assertEqual([json.loads(line) for line in f], [{"generation": inventory.snapshot_generation}]) # a new, empty journal
+        store.clear()
+        self.quietly(inventory.load_devices)
+        self.assertEqual(store.to_list(), expected)
+        self.assertEqual(inventory.journal_record_count, 0)
+
+
+class CompactionCrashTests(InventoryTestCase):
+    """A compaction killed after writing the snapshot but before starting the new journal."""
+
+    def setUp(self):
+        super().setUp()
+        self.write_inventory([device("r1", "10.0.0.1"), device("r2", "10.0.0.2")])
+        store = inventory.network_devices
+        store.delete(store.find_by_hostname("r2"))
+        store.update(store.find_by_hostname("r1"), {"hostname": "r2"}) # only works after the delete, so replaying both twice fails
+        self.quietly(inventory.save_devices)
+        compact_in_other_program_and_die()
+
+    def hostnames(self):
+        return sorted(found["hostname"] for found in inventory.network_devices.to_list())
+
+    def test_old_journal_is_not_replayed_again(self):
+        messages = io.StringIO()
+        with contextlib.redirect_stdout(messages):
+            inventory.load_devices()
+        self.assertNotIn("skipped", messages.getvalue())
+        self.assertEqual(self.hostnames(), ["r2"])
+        self.assertFalse(self.quietly(inventory.refresh_devices)) # and the leftover journal doesn't look like a new save
+
+    def test_saving_afterwards_starts_the_new_journal(self):
+        # this program loaded before the crash, so it has to notice the new snapshot
+        inventory.network_devices.add(device("r3", "10.0.0.3"))
+        self.assertEqual(self.quietly(inventory.save_devices), [])
+        self.quietly(inventory.load_devices)
+        self.assertEqual(self.hostnames(), ["r2", "r3"])
+        with open(inventory.JOURNAL_FILE, 'rb') as f:
+            self.assertEqual(inventory.read_journal_header(f), inventory.snapshot_file_generation(inventory.DATA_FILE))
+
+
+class ClashingSaveTests(InventoryTestCase):
+    """Another program saves first, and some of our changes no longer fit."""
+
+    def setUp(self):
+        super().setUp()
+        self.write_inventory([device("r1", "10.0.0.1"), device("r2", "10.0.0.2", os_version="16")])
+
+    def test_save_merges_what_another_program_saved(self):
+        run_other_program("add", "--hostname", "r3", "--vendor", "Arista", "--os-version", "4.30", "--ip", "10.0.0.3")
+        inventory.network_devices.add(device("r4", "10.0.0.4"))
+        self.assertEqual(self.quietly(inventory.save_devices), [])
+        self.quietly(inventory.load_devices)
+        self.assertEqual(sorted(found["hostname"] for found in inventory.network_devices.to_list()), ["r1", "r2", "r3", "r4"])
+
+    def test_change_to_a_device_they_deleted_is_dropped(self):
+        run_other_program("delete", "r2")
+        store = inventory.network_devices
+        store.update(store.find_by_hostname("r2"), {"os_version": "18"})
+        dropped_changes = self.quietly(inventory.save_devices)
+        self.assertEqual([change["hostname"] for change in dropped_changes], ["r2"])
+        self.quietly(inventory.load_devices)
+        self.assertEqual([found["hostname"] for found in inventory.network_devices.to_list()], ["r1"])
+
+    def test_refresh_picks_up_what_another_program_saved(self):
+        run_other_program("add", "--hostname", "r3", "--vendor", "Arista", "--os-version", "4.30", "--ip", "10.0.0.3")
+        self.assertTrue(self.quietly(inventory.refresh_devices))
+        self.assertIsNotNone(inventory.network_devices.find_by_hostname("r3"))
+        self.assertFalse(self.quietly(inventory.refresh_devices)) # nothing new the second time
+
+    def test_torn_journal_tail_doesnt_look_like_a_new_save(self):
+        inventory.network_devices.add(device("r3", "10.0.0.3"))
+        self.quietly(inventory.save_devices)
+        with open(inventory.JOURNAL_FILE, 'ab') as f:
+            f.write(b'{"op":"add","device":{"hostn') # a crash halfway through appending
+        self.quietly(inventory.load_devices)
+        self.assertFalse(self.quietly(inventory.refresh_devices))
+        self.assertFalse(self.quietly(inventory.refresh_devices))
+        run_other_program("add", "--hostname", "r4", "--vendor", "Arista", "--os-version", "4.30", "--ip", "10.0.0.4")
+        self.assertTrue(self.quietly(inventory.refresh_devices)) # their save cut the torn line off and went on the end
+        self.assertIsNotNone(inventory.network_devices.find_by_hostname("r4"))
+        self.assertFalse(self.quietly(inventory.refresh_devices))
+
+    def test_menu_add_checks_again_after_a_merge(self):
+        answers = {"Enter the Host Name": "r9", "Enter the Vendor": "Cisco", "Enter the Operating System Version": "17",
+                   "Enter the IP address": "10.0.0.9"}
+
+        def answer(prompt):
+            if prompt.startswith("Add this device"): # meanwhile: a pending edit, another program adds r9, the autosave merges it in
+                store = inventory.network_devices
+                store.update(store.find_by_hostname("r1"), {"os_version": "18"})
+                run_other_program("add", "--hostname", "r9", "--vendor", "Arista", "--os-version", "4.30", "--ip", "10.0.0.99")
+                inventory.save_devices()
+                return "yes"
+            return next(value for start, value in answers.items() if prompt.startswith(start))
+
+        with mock.patch('builtins.input', answer):
+            self.quietly(inventory.add_new_device)
+        store = inventory.network_devices
+        self.assertEqual(sorted(found["hostname"] for found in store.to_list()), ["r1", "r2", "r9"])
+        self.assertEqual(store.get(store.find_by_hostname("r9"))["ip_address"], "10.0.0.99") # theirs, not ours
+        self.assertEqual(store.pending_changes, [])
+
+    def test_store_refuses_a_duplicate_add(self):
+        store = inventory.network_devices
+        for duplicate in (device("R1", "10.0.0.50"), device("r50", "10.0.0.1")):
+            with self.assertRaises(ValueError):
+                store.add(duplicate)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.pending_changes, [])
+        self.assertEqual((store.find_by_hostname("r1"), store.find_by_ip("10.0.0.1")), (0, 0))
+
+    def test_bulk_update_fails_with_exit_code_3(self):
+        run_other_program("delete", "r2")
+        with self.assertRaises(inventory.CommandError) as raised:
+            self.quietly(inventory.bulk_change_details, vendor="Cisco", assignments={"os_version": "18"}, apply=True)
+        self.assertEqual(raised.exception.exit_code, 3)
+        self.quietly(inventory.load_devices)
+        self.assertEqual([found["os_version"] for found in inventory.network_devices.to_list()], ["18"]) # r1 still got it
+
+    def test_import_counts_clashes_separately(self):
+        run_other_program("add", "--hostname", "r3", "--vendor", "Arista", "--os-version", "4.30", "--ip", "10.0.0.3")
+        import_path = os.path.join(self.work_dir, "new.csv")
+        with open(import_path, 'w') as f:
+            f.write("hostname,vendor,os_version,ip_address\nr3,Cisco,17,10.0.0.33\nr4,Cisco,17,10.0.0.4\n")
+        self.assertEqual(self.quietly(inventory.import_devices, import_path), (1, 0, 1))
+
+    def test_reconcile_apply_counts_clashes_as_skipped(self):
+        scan_path = os.path.join(self.work_dir, "scan.csv")
+        with open(scan_path, 'w') as f:
+            f.write("hostname,vendor,os_version,ip_address\nr1,Cisco,17.9.4,10.0.0.1\nr2,Cisco,17,10.0.0.2\n")
+        report_path = scan_path + ".reconcile.jsonl"
+        self.quietly(inventory.reconcile_scan, scan_path, report_path)
+        run_other_program("delete", "r2")
+        applied, skipped = self.quietly(inventory.apply_reconcile_report, report_path, {"drifted"})
+        self.assertEqual((applied["drifted"], skipped), (0, 1))
+
+
+class SweepTests(InventoryTestCase):
+    """Sweeps against listeners on this machine's own 127.0.0.x addresses."""
+
+    def listen(self, ip_address, port=0, answering=True):
+        """
+        Starts a listener and returns its port. One that isn't answering has a
+        full backlog, so new connects to it get no reply and time out.
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind((ip_address, port))
+        listener.listen(16 if answering else 0)
+        if not answering:
+            filler = socket.create_connection(listener.getsockname(), timeout=1) # takes the one place in the backlog
+            self.addCleanup(filler.close)
+        return listener.getsockname()[1]
+
+    def status(self, host_name):
+        """(reachable, latency_ms, last_seen) as the store has them."""
+        store = inventory.network_devices
+        row_id = store.find_by_hostname(host_name)
+        return store.reachable[row_id], store.latency_ms[row_id], store.last_seen[row_id]
+
+    def test_listening_host_is_reachable_and_a_dead_one_is_not(self):
+        port = self.listen("127.0.0.2")
+        self.write_inventory([device("up", "127.0.0.2"), device("down", "127.0.0.3")])
+        checked, reachable, _ = self.quietly(inventory.sweep_devices, port, 2.0, 10)
+        self.assertEqual((checked, reachable), (2, 1))
+        up_reachable, up_latency, up_last_seen = self.status("up")
+        self.assertEqual(up_reachable, 1)
+        self.assertGreaterEqual(up_latency, 0)
+        self.assertGreater(up_last_seen, 0)
+        self.assertEqual(self.status("down"), (0, -1.0, 0.0))
+        self.quietly(inventory.load_devices) # the results were saved too
+        self.assertEqual(self.status("up")[0], 1)
+
+    def test_last_seen_stays_put_once_a_host_stops_answering(self):
+        listener = socket.create_server(("127.0.0.2", 0))
+        port = listener.getsockname()[1]
+        self.write_inventory([device("r1", "127.0.0.2")])
+        with listener:
+            self.quietly(inventory.sweep_devices, port, 2.0, 10)
+        last_seen = self.status("r1")[2]
+        self.assertGreater(last_seen, 0)
+        self.quietly(inventory.sweep_devices, port, 2.0, 10) # nothing listening now
+        self.assertEqual(self.status("r1"), (0, -1.0, last_seen))
+
+    def test_timeouts_and_the_concurrency_bound(self):
+        port = self.listen("127.0.0.4", answering=False)
+        for ip_address in ("127.0.0.5", "127.0.0.6"):
+            self.listen(ip_address, port, answering=False)
+        self.write_inventory([device(f"slow-{number}", f"127.0.0.{number}") for number in (4, 5, 6)])
+        checked, reachable, seconds = self.quietly(inventory.sweep_devices, port, 0.3, 1)
+        self.assertEqual((checked, reachable), (3, 0))
+        self.assertGreaterEqual(seconds, 0.9) # one at a time: three whole timeouts
+        _, _, seconds = self.quietly(inventory.sweep_devices, port, 0.3, 3)
+        self.assertLess(seconds, 0.8) # all three at once: about one timeout
+
+
+class BackgroundSaveTests(InventoryTestCase):
+    """The autosave thread writing mustn't hold up the menu."""
+
+    def test_store_is_usable_while_a_save_waits_for_the_disk(self):
+        self.write_inventory([device("r1", "10.0.0.1")])
+        self.quietly(inventory.save_devices, force_compact=True) # starts the history, so the save below only appends
+        inventory.network_devices.add(device("r2", "10.0.0.2"))
+        disk_busy, disk_done = threading.Event(), threading.Event()
+        real_fsync = os.fsync
+
+        def slow_fsync(fd):
+            disk_busy.set()
+            disk_done.wait(10)
+            real_fsync(fd)
+
+        with mock.patch.object(inventory.os, 'fsync', slow_fsync):
+            saver = threading.Thread(target=self.quietly, args=(inventory.save_devices,))
+            saver.start()
+            self.assertTrue(disk_busy.wait(10))
+            self.assertTrue(inventory.store_lock.acquire(timeout=1)) # the save is writing, but not holding the store
+            try:
+                inventory.network_devices.add(device("r3", "10.0.0.3")) # an edit made while the save is writing
+            finally:
+                inventory.store_lock.release()
+            self.assertFalse(inventory.refresh_devices()) # doesn't wait for the save either
+            disk_done.set()
+            saver.join()
+        self.assertEqual([change["device"]["hostname"] for change in inventory.network_devices.pending_changes], ["r3"])
+        self.quietly(inventory.save_devices)
+        self.quietly(inventory.load_devices)
+        self.assertEqual(len(inventory.network_devices), 3)
+
+    def test_service_reads_while_a_service_write_saves(self):
+        self.write_inventory([device("r1", "10.0.0.1")])
+        self.quietly(inventory.save_devices, force_compact=True)
+        disk_busy, disk_done = threading.Event(), threading.Event()
+        real_fsync = os.fsync
+        answers = []
+
+        def slow_fsync(fd):
+            disk_busy.set()
+            disk_done.wait(10)
+            real_fsync(fd)
+
+        def write_like_the_service(): # what run_writer does with a POST
+            with inventory.save_lock:
+                answers.append(inventory.handle_service_request('POST', '/devices', {}, json.dumps(device("r2", "10.0.0.2"))))
+
+        with mock.patch.object(inventory.os, 'fsync', slow_fsync):
+            writer = threading.Thread(target=self.quietly, args=(write_like_the_service,))
+            writer.start()
+            self.assertTrue(disk_busy.wait(10))
+            self.assertTrue(inventory.store_lock.acquire(timeout=1)) # a GET isn't stuck behind the save
+            try:
+                self.assertEqual(inventory.handle_service_request('GET', '/devices/r2', {}, None)[0], 200)
+            finally:
+                inventory.store_lock.release()
+            disk_done.set()
+            writer.join()
+        self.assertEqual(answers[0][0], 201)
+        self.quietly(inventory.load_devices)
+        self.assertEqual(len(inventory.network_devices), 2)
+
+
+class ConcurrentProcessesTests(unittest.TestCase):
+    """A small run of stress_test.py: many processes reading and writing the same inventory."""
+
+    def test_json_with_compaction(self):
+        _, failed_checks = stress_test.run_backend("inventory.json", 6, 40, 20, 0.5)
+        self.assertEqual(failed_checks, [])
+
+    def test_sqlite(self):
+        _, failed_checks = stress_test.run_backend("inventory.db", 6, 40, 20, 0.5)
+        self.assertEqual(failed_checks, [])
+
+
+if __name__ == "__main__":
+    unittest.main()